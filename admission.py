@@ -0,0 +1,199 @@
+import contextvars
+import math
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, Optional
+
+from config import Settings, settings
+from metrics import registry
+
+
+admission_queue_depth = registry.gauge(
+    "kubeflow_manager_admission_queue_depth", "各操作类别排队等待的请求数")
+admission_in_flight = registry.gauge(
+    "kubeflow_manager_admission_in_flight", "各操作类别正在执行的请求数")
+admission_admitted = registry.counter(
+    "kubeflow_manager_admission_admitted_total", "各操作类别获得执行许可的次数")
+admission_wait_seconds = registry.counter(
+    "kubeflow_manager_admission_wait_seconds_total", "各操作类别排队等待的累计时间（秒），除以 admitted_total 为平均等待")
+admission_rejected = registry.counter(
+    "kubeflow_manager_admission_rejected_total", "各操作类别被拒绝的次数（reason=queue_full/tenant_queue_full/timeout）")
+
+# 操作类别：bcrypt 哈希、Dex ConfigMap 写入及重启、Profile 写入、等待命名空间
+OPERATION_CLASSES = ("hash", "dex_write", "profile_write", "namespace_wait")
+
+# 配置中未列出的类别使用默认上限
+_DEFAULT_LIMITS: Dict[str, int] = Settings.model_fields["admission_limits"].default
+
+# 非 HTTP 调用（命令行、后台线程）的调用方标识
+SYSTEM_TENANT = "system"
+
+# 当前请求的调用方标识，由 main.identify_tenant 设置
+current_tenant: contextvars.ContextVar[str] = contextvars.ContextVar("current_tenant", default=SYSTEM_TENANT)
+
+# 估算 Retry-After 时持有时间的平滑系数
+_HOLD_ALPHA = 0.2
+
+
+class AdmissionRejected(Exception):
+    """排队已满或等待超时，请求被拒绝（对应 HTTP 429）"""
+    
+    def __init__(self, op_class: str, reason: str, retry_after: float):
+        self.op_class = op_class
+        self.reason = reason
+        self.retry_after = retry_after
+        messages = {
+            "queue_full": "排队请求过多",
+            "tenant_queue_full": "当前调用方排队请求过多",
+            "timeout": "排队等待超时",
+        }
+        super().__init__(f"{op_class} 操作繁忙（{messages[reason]}），请 {math.ceil(retry_after)} 秒后重试")
+
+
+class _Waiter:
+    __slots__ = ("granted",)
+    
+    def __init__(self):
+        self.granted = False
+
+
+class FairLimiter:
+    """
+    单个操作类别的并发限制和公平排队
+    
+    执行中的请求数达到上限后，后续请求按调用方分别排成 FIFO 队列；
+    有空位时在有请求排队的调用方之间轮转放行，单个调用方的大量请求不会饿死其他调用方。
+    上限、队列长度和等待时间每次读取配置，热加载后立即生效。
+    """
+    
+    def __init__(self, op_class: str):
+        self.op_class = op_class
+        self._cond = threading.Condition()
+        self._active = 0
+        self._queued = 0
+        self._queues: "OrderedDict[str, Deque[_Waiter]]" = OrderedDict()
+        self._hold_seconds = 0.0
+        admission_queue_depth.set(0, op_class=op_class)
+        admission_in_flight.set(0, op_class=op_class)
+    
+    @property
+    def limit(self) -> int:
+        return settings.admission_limits.get(self.op_class, _DEFAULT_LIMITS[self.op_class])
+    
+    def _retry_after(self) -> float:
+        """按平均持有时间估算排在队尾的请求还需等待多久"""
+        return max(1.0, self._hold_seconds * (self._queued + 1) / self.limit)
+    
+    def _publish(self) -> None:
+        admission_queue_depth.set(self._queued, op_class=self.op_class)
+        admission_in_flight.set(self._active, op_class=self.op_class)
+    
+    def _reject(self, reason: str) -> AdmissionRejected:
+        admission_rejected.inc(op_class=self.op_class, reason=reason)
+        return AdmissionRejected(self.op_class, reason, self._retry_after())
+    
+    def _grant(self) -> None:
+        """有空位时按调用方轮转放行排队请求"""
+        granted = False
+        while self._active < self.limit and self._queues:
+            tenant, queue = next(iter(self._queues.items()))
+            queue.popleft().granted = True
+            self._queued -= 1
+            self._active += 1
+            granted = True
+            if queue:
+                self._queues.move_to_end(tenant)
+            else:
+                del self._queues[tenant]
+        if granted:
+            self._cond.notify_all()
+    
+    def acquire(self, tenant: str) -> None:
+        """获取执行许可；排队已满或等待超时时抛出 AdmissionRejected"""
+        started = time.monotonic()
+        with self._cond:
+            if self._active < self.limit and not self._queued:
+                self._active += 1
+                self._publish()
+                admission_admitted.inc(op_class=self.op_class)
+                return
+            if self._queued >= settings.admission_max_queue:
+                raise self._reject("queue_full")
+            queue = self._queues.setdefault(tenant, deque())
+            if len(queue) >= settings.admission_tenant_queue:
+                raise self._reject("tenant_queue_full")
+            
+            waiter = _Waiter()
+            queue.append(waiter)
+            self._queued += 1
+            self._publish()
+            deadline = started + settings.admission_queue_timeout
+            try:
+                while not waiter.granted:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        queue.remove(waiter)
+                        self._queued -= 1
+                        if not queue and self._queues.get(tenant) is queue:
+                            del self._queues[tenant]
+                        raise self._reject("timeout")
+                    self._cond.wait(remaining)
+            finally:
+                self._publish()
+        admission_admitted.inc(op_class=self.op_class)
+        admission_wait_seconds.inc(time.monotonic() - started, op_class=self.op_class)
+    
+    def release(self, held_seconds: float) -> None:
+        with self._cond:
+            self._active -= 1
+            self._hold_seconds += _HOLD_ALPHA * (held_seconds - self._hold_seconds)
+            self._grant()
+            self._publish()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "limit": self.limit,
+                "in_flight": self._active,
+                "queued": self._queued,
+                "tenants_waiting": len(self._queues),
+                "avg_hold_seconds": round(self._hold_seconds, 3),
+            }
+
+
+class AdmissionController:
+    """
+    昂贵修改操作的准入控制
+    
+    每个操作类别独立限制并发（ADMISSION_LIMITS），超出的请求按调用方公平排队；
+    队列已满或等待超过 ADMISSION_QUEUE_TIMEOUT 时抛出 AdmissionRejected，接口返回 429 和 Retry-After。
+    同一线程内已持有某类许可时，再次进入同一类别不重复排队。
+    """
+    
+    def __init__(self):
+        self._limiters = {op_class: FairLimiter(op_class) for op_class in OPERATION_CLASSES}
+        self._held = threading.local()
+    
+    @contextmanager
+    def slot(self, op_class: str) -> Iterator[None]:
+        held = self._held.__dict__.setdefault("classes", set())
+        if not settings.admission_enabled or op_class in held:
+            yield
+            return
+        limiter = self._limiters[op_class]
+        limiter.acquire(current_tenant.get())
+        held.add(op_class)
+        started = time.monotonic()
+        try:
+            yield
+        finally:
+            held.discard(op_class)
+            limiter.release(time.monotonic() - started)
+    
+    def stats(self) -> Dict[str, Dict[str, Any]]:
+        return {op_class: limiter.stats() for op_class, limiter in self._limiters.items()}
+
+
+admission = AdmissionController()
@@ -0,0 +1,389 @@
+import atexit
+import contextvars
+import glob
+import os
+import queue
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, List, Optional
+from urllib.parse import parse_qs
+
+import orjson
+
+import k8s_accounting
+from config import settings
+from metrics import registry
+
+
+audit_records = registry.counter(
+    "kubeflow_manager_audit_records_total", "写入审计日志的记录数")
+audit_dropped = registry.counter(
+    "kubeflow_manager_audit_dropped_total", "审计队列已满被丢弃的记录数")
+
+# 需要审计的 HTTP 方法
+MUTATING_METHODS = {"POST", "PUT", "PATCH", "DELETE"}
+
+# 同一段文件内记录按提交时间写入，并发提交可能有轻微乱序，按时间查找时向前多留的余量（秒）
+_ORDER_SLACK = 1.0
+
+_SEGMENT_GLOB = "audit-*.jsonl"
+_SEGMENT_TIME_FORMAT = "%Y%m%dT%H%M%S.%fZ"
+
+
+def quota_diff(before: Optional[Dict[str, Any]], after: Optional[Dict[str, Any]]) -> Dict[str, Dict[str, Any]]:
+    """配额差异：{资源: {"before": 旧值, "after": 新值}}，只包含有变化的资源"""
+    before = before or {}
+    after = after or {}
+    return {
+        key: {"before": before.get(key), "after": after.get(key)}
+        for key in sorted(set(before) | set(after))
+        if before.get(key) != after.get(key)
+    }
+
+
+def parse_time(value: str) -> float:
+    """解析时间参数：Unix 时间戳（秒）或 ISO 8601（无时区按 UTC）"""
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"无效的时间: {value}，示例：1760000000 或 2025-10-19T08:00:00Z")
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed.timestamp()
+
+
+class AuditEntry:
+    """一次请求的审计上下文：服务层记录的变更列表（可能被多个线程追加）"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.changes: List[Dict[str, Any]] = []
+    
+    def add_change(self, change: Dict[str, Any]) -> None:
+        with self._lock:
+            self.changes.append(change)
+
+
+_current: contextvars.ContextVar[Optional[AuditEntry]] = contextvars.ContextVar("audit_entry", default=None)
+
+
+class AuditLog:
+    """
+    变更审计日志
+    
+    请求线程只把记录放进有界队列（队列满时丢弃并计数，从不阻塞），后台线程批量写入
+    JSONL 文件，按间隔批量 fsync。文件超过 audit_max_bytes 时滚动，文件名为首条记录的 UTC 时间，
+    按时间范围查询时据此跳过无关文件，文件内用二分查找定位起点。
+    """
+    
+    def __init__(self):
+        self._queue: Optional[queue.Queue] = None
+        self._thread: Optional[threading.Thread] = None
+        self._start_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._file = None
+        self._path: Optional[str] = None
+        self._size = 0
+        self._listeners: List[Callable[[Dict[str, Any]], None]] = []
+    
+    # ---------- 提交 ----------
+    
+    def start(self) -> None:
+        """启动后台写入线程（重复调用无副作用）"""
+        with self._start_lock:
+            if self._thread is not None:
+                return
+            os.makedirs(settings.audit_dir, exist_ok=True)
+            self._queue = queue.Queue(maxsize=settings.audit_queue_size)
+            self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+    
+    def submit(self, record: Dict[str, Any]) -> None:
+        if not settings.audit_enabled:
+            return
+        if self._thread is None:
+            self.start()
+        ts = time.time()
+        record = {"ts": ts, "time": datetime.fromtimestamp(ts, timezone.utc).isoformat(), **record}
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            audit_dropped.inc()
+    
+    def begin(self) -> contextvars.Token:
+        """为当前请求创建审计上下文"""
+        return _current.set(AuditEntry())
+    
+    def end(self, token: contextvars.Token) -> AuditEntry:
+        entry = _current.get()
+        _current.reset(token)
+        return entry
+    
+    def add_listener(self, callback: Callable[[Dict[str, Any]], None]) -> None:
+        """注册变更监听：每次 change() 后以变更记录调用 callback（与是否启用审计无关）"""
+        self._listeners.append(callback)
+    
+    def change(
+        self,
+        kind: str,
+        name: str,
+        action: str,
+        before: Optional[Dict[str, Any]] = None,
+        after: Optional[Dict[str, Any]] = None
+    ) -> None:
+        """
+        记录一项变更（kind: user / project；项目配额以 diff 形式记录）
+        不在请求中（命令行、后台任务）时单独写一条记录
+        """
+        from k8s_client import current_cluster
+        change: Dict[str, Any] = {
+            "kind": kind,
+            "name": name,
+            "action": action,
+            "cluster": current_cluster.get() or settings.default_cluster,
+        }
+        if kind == "project" and (before is not None or after is not None):
+            change["diff"] = quota_diff(before, after)
+        else:
+            if before is not None:
+                change["before"] = before
+            if after is not None:
+                change["after"] = after
+        
+        entry = _current.get()
+        if entry is not None:
+            entry.add_change(change)
+        else:
+            self.submit({"actor": "system", "changes": [change]})
+        for callback in self._listeners:
+            try:
+                callback(change)
+            except Exception as e:
+                print(f"警告：变更监听处理失败: {e}")
+    
+    # ---------- 写入 ----------
+    
+    @staticmethod
+    def _segment_path(ts: float) -> str:
+        name = datetime.fromtimestamp(ts, timezone.utc).strftime(_SEGMENT_TIME_FORMAT)
+        return os.path.join(settings.audit_dir, f"audit-{name}.jsonl")
+    
+    def _open_segment(self, ts: float) -> None:
+        if self._file is not None:
+            self._sync()
+            self._file.close()
+        self._path = self._segment_path(ts)
+        self._file = open(self._path, "ab")
+        os.chmod(self._path, 0o600)
+        self._size = self._file.tell()
+        self._prune()
+    
+    def _prune(self) -> None:
+        """只保留最近 audit_backup_count 个已滚动的文件"""
+        segments = sorted(glob.glob(os.path.join(settings.audit_dir, _SEGMENT_GLOB)))
+        rotated = [path for path in segments if path != self._path]
+        for path in rotated[:max(0, len(rotated) - settings.audit_backup_count)]:
+            try:
+                os.remove(path)
+            except OSError as e:
+                print(f"警告：删除审计日志 {path} 失败: {e}")
+    
+    def _sync(self) -> None:
+        self._file.flush()
+        os.fsync(self._file.fileno())
+    
+    def _write(self, batch: List[Dict[str, Any]]) -> None:
+        for record in batch:
+            if self._file is None or self._size >= settings.audit_max_bytes:
+                self._open_segment(record["ts"])
+            line = orjson.dumps(record) + b"\n"
+            self._file.write(line)
+            self._size += len(line)
+        audit_records.inc(len(batch))
+    
+    def _run(self) -> None:
+        dirty = False
+        last_sync = time.monotonic()
+        while True:
+            try:
+                batch = [self._queue.get(timeout=settings.audit_fsync_interval)]
+            except queue.Empty:
+                batch = []
+            # 取出队列中已有的全部记录，一次写入
+            while batch and len(batch) < 1000:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            done = [item for item in batch if isinstance(item, threading.Event)]
+            records = [item for item in batch if not isinstance(item, threading.Event)]
+            try:
+                if records:
+                    self._write(records)
+                    dirty = True
+                if dirty and (done or time.monotonic() - last_sync >= settings.audit_fsync_interval):
+                    self._sync()
+                    dirty = False
+                    last_sync = time.monotonic()
+            except Exception as e:
+                print(f"警告：写入审计日志失败: {e}")
+            for event in done:
+                event.set()
+            if self._stopped.is_set() and self._queue.empty():
+                return
+    
+    def flush(self, timeout: float = 5.0) -> bool:
+        """等待已提交的记录写入并 fsync"""
+        if self._thread is None:
+            return True
+        event = threading.Event()
+        try:
+            self._queue.put(event, timeout=timeout)
+        except queue.Full:
+            return False
+        return event.wait(timeout)
+    
+    def close(self) -> None:
+        if self._thread is None or not self._thread.is_alive():
+            return
+        self.flush()
+        self._stopped.set()
+    
+    # ---------- 查询 ----------
+    
+    @staticmethod
+    def _segment_start(path: str) -> float:
+        name = os.path.basename(path)[len("audit-"):-len(".jsonl")]
+        return datetime.strptime(name, _SEGMENT_TIME_FORMAT).replace(tzinfo=timezone.utc).timestamp()
+    
+    @staticmethod
+    def _seek(f, size: int, ts: float) -> None:
+        """二分查找第一条时间不早于 ts 的记录附近的偏移（按行对齐）"""
+        lo, hi = 0, size
+        while hi - lo > 4096:
+            mid = (lo + hi) // 2
+            f.seek(mid)
+            f.readline()
+            line = f.readline()
+            try:
+                record_ts = orjson.loads(line)["ts"]
+            except Exception:
+                hi = mid
+                continue
+            if record_ts < ts:
+                lo = mid
+            else:
+                hi = mid
+        f.seek(lo)
+        if lo:
+            f.readline()
+    
+    def query(
+        self,
+        since: Optional[float] = None,
+        until: Optional[float] = None,
+        actor: Optional[str] = None,
+        name: Optional[str] = None,
+        limit: int = 1000
+    ) -> List[Dict[str, Any]]:
+        """
+        按时间范围 [since, until) 查询审计记录（按时间升序），可按操作者和变更对象名称过滤
+        最近约 audit_fsync_interval 秒内提交的记录可能尚未写入
+        """
+        segments = sorted(glob.glob(os.path.join(settings.audit_dir, _SEGMENT_GLOB)))
+        starts = []
+        for path in segments:
+            try:
+                starts.append(self._segment_start(path))
+            except ValueError:
+                starts.append(0.0)
+        
+        results: List[Dict[str, Any]] = []
+        for i, path in enumerate(segments):
+            if until is not None and starts[i] >= until + _ORDER_SLACK:
+                break
+            next_start = starts[i + 1] if i + 1 < len(segments) else None
+            if since is not None and next_start is not None and next_start < since - _ORDER_SLACK:
+                continue
+            try:
+                with open(path, "rb") as f:
+                    if since is not None:
+                        self._seek(f, os.fstat(f.fileno()).st_size, since - _ORDER_SLACK)
+                    for line in f:
+                        try:
+                            record = orjson.loads(line)
+                        except orjson.JSONDecodeError:
+                            continue  # 写入中的末行
+                        ts = record.get("ts", 0)
+                        if since is not None and ts < since:
+                            continue
+                        if until is not None and ts >= until:
+                            if ts >= until + _ORDER_SLACK:
+                                break
+                            continue
+                        if actor is not None and record.get("actor") != actor:
+                            continue
+                        if name is not None and not any(c.get("name") == name for c in record.get("changes") or ()):
+                            continue
+                        results.append(record)
+                        if len(results) >= limit:
+                            return results
+            except FileNotFoundError:
+                continue  # 查询期间被滚动删除
+        return results
+
+
+class AuditMiddleware:
+    """
+    为修改类请求（POST/PUT/PATCH/DELETE）记录审计日志：
+    操作者、路由、状态码、耗时、Kubernetes API 调用次数和服务层记录的变更
+    """
+    
+    def __init__(self, app):
+        self.app = app
+    
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] not in MUTATING_METHODS or not settings.audit_enabled:
+            await self.app(scope, receive, send)
+            return
+        
+        started = time.perf_counter()
+        status_code = 500
+        
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+        
+        token = audit_log.begin()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            entry = audit_log.end(token)
+            headers = {k.decode("latin-1").lower(): v.decode("latin-1") for k, v in scope.get("headers") or ()}
+            route = scope.get("route")
+            cluster = parse_qs(scope.get("query_string", b"").decode("latin-1")).get("cluster", [None])[0]
+            stats = k8s_accounting.current_stats()
+            audit_log.submit({
+                "actor": headers.get(settings.audit_actor_header.lower()),
+                "client": (scope.get("client") or (None,))[0],
+                "cluster": cluster or settings.default_cluster,
+                "method": scope["method"],
+                "route": getattr(route, "path", None),
+                "path": scope["path"],
+                "status": status_code,
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+                "k8s_calls": stats.to_dict() if stats is not None else None,
+                "changes": entry.changes,
+            })
+
+
+audit_log = AuditLog()
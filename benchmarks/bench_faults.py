@@ -0,0 +1,128 @@
+"""
+故障注入基准
+
+在不同的故障配置下并发调用经过 resilient（重试 + 熔断）包装的 Kubernetes 方法，
+输出吞吐量、延迟分位（p50/p99/最大）、失败率和平均尝试次数，用于调整超时、重试和熔断参数。
+基准不连接集群：被包装的方法本身只等待 --base-ms 毫秒，模拟正常的 API Server 响应时间。
+
+场景：
+- baseline：无故障
+- slow：对数正态延迟，中位数 30 ms，p99 500 ms
+- flaky：10% 的调用返回 429/500 或 1 秒后读超时
+- conflict：20% 的更新返回 409（刷新 resourceVersion 后重试）
+- brownout：慢且 40% 返回 5xx，熔断器打开后调用被快速拒绝
+
+用法：python benchmarks/bench_faults.py [--duration 5] [--concurrency 16] [--scenarios slow,flaky]
+"""
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("KUBECONFIG_PATH", "/dev/null")
+
+from fault_injection import fault_injector
+from resilience import CircuitOpenError, k8s_retries, resilient
+
+
+# 场景: (调用的方法, 故障规则)
+SCENARIOS = {
+    "baseline": ("get_profile", {}),
+    "slow": ("get_profile", {
+        "kubeflow.org.*": {"latency": {"distribution": "lognormal", "median_ms": 30, "p99_ms": 500}},
+    }),
+    "flaky": ("get_profile", {
+        "kubeflow.org.*": {"error_rate": 0.1, "errors": {"429": 1, "500": 1, "timeout": 1}, "timeout_seconds": 1},
+    }),
+    "conflict": ("update_profile", {
+        "kubeflow.org.update_profile": {"error_rate": 0.2, "errors": {"409": 1}},
+    }),
+    "brownout": ("get_profile", {
+        "kubeflow.org.*": {
+            "latency": {"distribution": "exponential", "mean_ms": 50},
+            "error_rate": 0.4,
+            "errors": {"500": 1, "503": 1},
+        },
+    }),
+}
+
+
+class _BenchClient:
+    """只模拟响应时间的 KubernetesClient，方法经过与真实客户端相同的 resilient 包装"""
+    
+    def __init__(self, cluster_name: str, base_ms: float):
+        # 每个场景使用独立的集群名，熔断器状态互不影响
+        self.cluster_name = cluster_name
+        self._base = base_ms / 1000
+    
+    @resilient("kubeflow.org")
+    def get_profile(self, name: str) -> dict:
+        time.sleep(self._base)
+        return {"metadata": {"name": name}}
+    
+    @resilient("kubeflow.org", idempotent=False, refresh="_refresh_profile")
+    def update_profile(self, name: str, profile_data: dict) -> dict:
+        time.sleep(self._base)
+        return profile_data
+    
+    def _refresh_profile(self, name: str, profile_data: dict):
+        return (name, profile_data), {}
+
+
+def percentile(values: list, q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def bench(scenario: str, duration: float, concurrency: int, base_ms: float) -> None:
+    method, rules = SCENARIOS[scenario]
+    fault_injector.configure(rules, seed=1)
+    kube_client = _BenchClient(f"bench-{scenario}", base_ms)
+    args = ({"spec": {}},) if method == "update_profile" else ()
+    deadline = time.monotonic() + duration
+    
+    def worker(index: int):
+        timings, failed, rejected = [], 0, 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                getattr(kube_client, method)(f"project-{index}", *args)
+            except CircuitOpenError:
+                rejected += 1
+            except Exception:
+                failed += 1
+            timings.append((time.perf_counter() - start) * 1000)
+        return timings, failed, rejected
+    
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(worker, range(concurrency)))
+    elapsed = time.perf_counter() - started
+    
+    timings = sorted(t for result in results for t in result[0])
+    failed = sum(result[1] for result in results)
+    rejected = sum(result[2] for result in results)
+    total = len(timings)
+    retries = k8s_retries.value(cluster=kube_client.cluster_name, group="kubeflow.org", method=method)
+    print(
+        f"{scenario:>10}{total / elapsed:>10.0f}{percentile(timings, 0.5):>10.1f}{percentile(timings, 0.99):>10.1f}"
+        f"{timings[-1]:>10.1f}{failed * 100 / total:>9.1f}%{rejected * 100 / total:>9.1f}%{1 + retries / total:>9.2f}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--duration", type=float, default=5.0)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--base-ms", type=float, default=2.0, help="模拟的正常响应时间（毫秒）")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS))
+    args = parser.parse_args()
+    print(f"{'场景':>10}{'调用/秒':>10}{'p50 (ms)':>10}{'p99 (ms)':>10}{'最大 (ms)':>10}{'失败':>10}{'熔断拒绝':>10}{'尝试次数':>9}")
+    for scenario in args.scenarios.split(","):
+        bench(scenario, args.duration, args.concurrency, args.base_ms)
+    fault_injector.configure(None)
+
+
+if __name__ == "__main__":
+    main()
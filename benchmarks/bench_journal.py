@@ -0,0 +1,52 @@
+"""
+预写日志基准
+
+测量每个步骤写入（op.step）的耗时分布，分别使用 JOURNAL_SYNCHRONOUS=NORMAL（默认，不 fsync）和 FULL（每步 fsync）。
+要求：默认配置下每步增加的耗时低于 1 ms。
+
+用法：python benchmarks/bench_journal.py [--steps 5000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("KUBECONFIG_PATH", "/dev/null")
+
+from config import settings_manager
+from journal import Journal
+
+
+def percentile(values: list, q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def bench(synchronous: str, steps: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        snapshot = settings_manager.active.model_copy(
+            update={"journal_path": os.path.join(tmp, "journal.db"), "journal_synchronous": synchronous})
+        settings_manager._active = snapshot
+        journal = Journal()
+        timings = []
+        with journal.operation("bench", "bench", {"expect": {"user@example.com": "USER_KEY"}}) as op:
+            for i in range(steps):
+                start = time.perf_counter()
+                op.step(f"step-{i}", {"i": i})
+                timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        print(f"{synchronous:>8}{percentile(timings, 0.5):>12.3f}{percentile(timings, 0.99):>12.3f}{timings[-1]:>12.3f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, default=5000)
+    args = parser.parse_args()
+    print(f"{'模式':>8}{'p50 (ms)':>12}{'p99 (ms)':>12}{'最大 (ms)':>12}")
+    for synchronous in ("NORMAL", "FULL"):
+        bench(synchronous, args.steps)
+
+
+if __name__ == "__main__":
+    main()
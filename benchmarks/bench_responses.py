@@ -0,0 +1,100 @@
+"""
+响应序列化与压缩基准
+
+对比 FastAPI 默认路径（response_model 校验 + jsonable_encoder + JSONResponse）
+与 respond()（pydantic-core / orjson 一次序列化）的单次响应 CPU 耗时，
+以及大响应 gzip / zstd 压缩的耗时和压缩率。
+
+用法：python benchmarks/bench_responses.py [--projects 5000]
+"""
+import argparse
+import asyncio
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.responses import JSONResponse
+from fastapi.routing import serialize_response
+from fastapi.utils import create_response_field
+
+from models import ApiResponse, UserResponse
+from responses import respond
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+def cpu_per_call(func, iterations: int) -> float:
+    """返回每次调用的 CPU 时间（微秒）"""
+    func()
+    start = time.process_time()
+    for _ in range(iterations):
+        func()
+    return (time.process_time() - start) / iterations * 1e6
+
+
+def default_path(model_cls, content):
+    """模拟 FastAPI 对返回模型实例的默认处理"""
+    field = create_response_field(name="response", type_=model_cls, mode="serialization")
+    loop = asyncio.new_event_loop()
+    
+    def run():
+        data = loop.run_until_complete(serialize_response(field=field, response_content=content))
+        return JSONResponse(data).body
+    
+    return run
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--projects", type=int, default=5000)
+    parser.add_argument("--iterations", type=int, default=0, help="默认按负载大小自动选择")
+    args = parser.parse_args()
+    
+    user = UserResponse(
+        email="alice@example.com", username="alice", password="abcdefghij",
+        login_url="https://kubeflow.example.com/?ns=alice-example-com"
+    )
+    projects = ApiResponse(
+        success=True,
+        message=f"共 {args.projects} 个项目",
+        data={"projects": [
+            {
+                "name": f"user{i}-example-com",
+                "owner": f"user{i}@example.com",
+                "namespace": f"user{i}-example-com",
+                "resources": {"cpu": "4", "memory": "8Gi", "requests.storage": "20Gi", "requests.nvidia.com/l4": "1"},
+                "cluster": "prod",
+            }
+            for i in range(args.projects)
+        ]}
+    )
+    
+    print(f"{'负载':<24}{'默认路径 (us)':>16}{'respond (us)':>16}{'加速':>8}")
+    for name, model_cls, content, iterations in [
+        ("单个用户", UserResponse, user, args.iterations or 2000),
+        (f"{args.projects} 个项目列表", ApiResponse, projects, args.iterations or 20),
+    ]:
+        before = cpu_per_call(default_path(model_cls, content), iterations)
+        after = cpu_per_call(lambda: respond(content).body, iterations)
+        print(f"{name:<24}{before:>16.1f}{after:>16.1f}{before / after:>7.1f}x")
+    
+    body = respond(projects).body
+    print(f"\n压缩 {len(body) / 1024:.0f} KiB 项目列表：")
+    compressors = [("gzip-6", lambda: zlib.compress(body, 6))]
+    if zstandard is not None:
+        compressors.append(("zstd-3", lambda: zstandard.ZstdCompressor(level=3).compress(body)))
+    else:
+        print("  （未安装 zstandard，跳过 zstd）")
+    for name, func in compressors:
+        cost = cpu_per_call(func, 20)
+        print(f"  {name:<8} {cost / 1000:>8.2f} ms  压缩后 {len(func()) / 1024:.0f} KiB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""
+启动快照基准
+
+对比启动后缓存可用所需的本地耗时（不含 API Server 的响应时间）：
+- 冷启动：解析 Profile list 响应写入 informer，解析 Dex config.yaml 建用户索引
+- 快照：读取并解压快照文件，恢复 informer 和用户索引（不解析 config.yaml）
+
+并输出快照文件大小。
+
+用法：python benchmarks/bench_snapshot.py [--sizes 1000,10000,50000]
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("KUBECONFIG_PATH", "/dev/null")
+
+import orjson
+import yaml
+
+import dex_codec as codec_module
+from config import settings_manager
+from dex_codec import Dumper
+from informer import Informer
+from snapshot import SNAPSHOT_VERSION, SnapshotStore
+from user_index import UserIndex
+
+
+class _FakeClient:
+    cluster_name = "bench"
+    
+    def __init__(self):
+        self.profile_informer = Informer("profiles-bench", self.list_profiles)
+    
+    def list_profiles(self, **kwargs):
+        raise NotImplementedError
+    
+    def list_configmaps(self, namespace, **kwargs):
+        raise NotImplementedError
+
+
+# 基准不连接集群：直接把 list 结果和 ConfigMap 事件交给 informer 与索引
+codec_module.k8s_client = _FakeClient()
+
+
+def build_profiles(count: int) -> bytes:
+    items = [
+        {
+            "apiVersion": "kubeflow.org/v1",
+            "kind": "Profile",
+            "metadata": {"name": f"project-{i}", "resourceVersion": str(i), "labels": {"owner": f"user{i}"}},
+            "spec": {
+                "owner": {"kind": "User", "name": f"user{i}@example.com"},
+                "resourceQuotaSpec": {"hard": {"cpu": "8", "memory": "32Gi", "requests.nvidia.com/gpu": "1"}},
+            },
+        }
+        for i in range(count)
+    ]
+    return orjson.dumps({"items": items, "metadata": {"resourceVersion": str(count)}})
+
+
+def build_configmap(count: int) -> dict:
+    users = [
+        {"email": f"user{i}@example.com", "hashFromEnv": f"USER_{i:08d}", "username": f"user_{i}"}
+        for i in range(count)
+    ]
+    text = yaml.dump({"issuer": "https://kubeflow.example.com/dex", "staticPasswords": users}, Dumper=Dumper)
+    return {
+        "metadata": {"name": "dex", "namespace": "auth", "resourceVersion": str(count)},
+        "data": {"config.yaml": text},
+    }
+
+
+def cold_start(profiles: bytes, configmap: dict) -> UserIndex:
+    kube_client = _FakeClient()
+    index = UserIndex(kube_client)
+    data = orjson.loads(profiles)
+    kube_client.profile_informer._replace(
+        {item["metadata"]["name"]: item for item in data["items"]}, data["metadata"]["resourceVersion"])
+    index._dex_informer._replace({"dex": configmap}, configmap["metadata"]["resourceVersion"])
+    return index
+
+
+def warm_start() -> UserIndex:
+    snapshot = SnapshotStore.load()["clusters"]["bench"]
+    kube_client = _FakeClient()
+    kube_client.profile_informer.restore(snapshot["profiles"])
+    index = UserIndex(kube_client)
+    index.restore(snapshot["user_index"])
+    return index
+
+
+def bench(count: int) -> None:
+    profiles = build_profiles(count)
+    configmap = build_configmap(count)
+    
+    start = time.perf_counter()
+    index = cold_start(profiles, configmap)
+    cold_ms = (time.perf_counter() - start) * 1000
+    
+    snapshot = {
+        "version": SNAPSHOT_VERSION,
+        "created_at": time.time(),
+        "clusters": {"bench": {"profiles": index._client.profile_informer.dump(), "user_index": index.dump()}},
+    }
+    SnapshotStore.collect = staticmethod(lambda: snapshot)
+    store = SnapshotStore()
+    start = time.perf_counter()
+    store.save()
+    save_ms = (time.perf_counter() - start) * 1000
+    
+    start = time.perf_counter()
+    restored = warm_start()
+    warm_ms = (time.perf_counter() - start) * 1000
+    
+    assert restored.search("user1", limit=count) == index.search("user1", limit=count), "快照恢复的索引与冷启动不一致"
+    print(f"{count:>8}{cold_ms:>14.1f}{warm_ms:>14.1f}{cold_ms / warm_ms:>9.1f}x{save_ms:>14.1f}{store.last_size / 1024:>12.0f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        settings_manager._active = settings_manager.active.model_copy(
+            update={"snapshot_path": os.path.join(tmp, "snapshot.bin")})
+        print(f"{'规模':>8}{'冷启动 (ms)':>14}{'快照 (ms)':>14}{'加速':>10}{'写入 (ms)':>14}{'大小 (KB)':>12}")
+        for size in args.sizes.split(","):
+            bench(int(size))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+用户搜索索引基准
+
+对比单次查询耗时：
+- 线性扫描：遍历 staticPasswords 逐个比较（get_user 的做法）
+- user_index：前缀走有序数组二分查找，子串走三元组倒排求交
+
+并校验两者结果一致。
+
+用法：python benchmarks/bench_user_index.py [--sizes 1000,10000,50000]
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("KUBECONFIG_PATH", "/dev/null")
+
+import yaml
+
+import dex_codec as codec_module
+from dex_codec import Dumper
+from user_index import UserIndex
+
+
+SURNAMES = ["zhang", "wang", "li", "zhao", "liu", "chen", "yang", "huang", "zhou", "wu"]
+QUERIES = [("zhang", "prefix"), ("li_12", "prefix"), ("ng12", "substring"), ("4321", "substring"), ("ao", "substring")]
+LIMIT = 50
+
+
+class _FakeInformer:
+    synced = type("_Synced", (), {"is_set": lambda self: True})()
+    
+    def add_handler(self, handler) -> None:
+        pass
+
+
+class _FakeClient:
+    cluster_name = "bench"
+    profile_informer = _FakeInformer()
+    
+    def list_configmaps(self, namespace, **kwargs):
+        raise NotImplementedError
+
+
+# 基准不连接集群：直接把 ConfigMap 事件交给索引
+codec_module.k8s_client = _FakeClient()
+
+
+def build_users(count: int) -> list:
+    rng = random.Random(count)
+    return [
+        {
+            "email": f"{rng.choice(SURNAMES)}{i}@example.com",
+            "hashFromEnv": f"USER_{i:08d}",
+            "username": f"{rng.choice(SURNAMES)}_{i}",
+        }
+        for i in range(count)
+    ]
+
+
+def linear_search(users: list, q: str, mode: str) -> list:
+    matches = []
+    for user in users:
+        email, username = user["email"].lower(), user["username"].lower()
+        if mode == "prefix":
+            hit = email.startswith(q) or username.startswith(q)
+        else:
+            hit = q in email or q in username
+        if hit:
+            matches.append(email)
+    return sorted(matches)[:LIMIT]
+
+
+def timed(func, repeat: int) -> float:
+    """返回平均耗时（毫秒）"""
+    start = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def bench(count: int) -> None:
+    users = build_users(count)
+    text = yaml.dump({"issuer": "https://kubeflow.example.com/dex", "staticPasswords": users}, Dumper=Dumper)
+    event = {
+        "metadata": {"name": "dex", "namespace": "auth", "resourceVersion": str(count)},
+        "data": {"config.yaml": text},
+    }
+    index = UserIndex(_FakeClient())
+    start = time.perf_counter()
+    index._on_dex_configmap("ADDED", event, None)
+    build_ms = (time.perf_counter() - start) * 1000
+    
+    for q, mode in QUERIES:
+        expected = linear_search(users, q, mode)
+        got = sorted(user["email"] for user in index.search(q, mode=mode, limit=count))[:LIMIT]
+        assert got == expected, f"{q} ({mode}) 结果与线性扫描不一致"
+        baseline = timed(lambda: linear_search(users, q, mode), repeat=5)
+        indexed = timed(lambda: index.search(q, mode=mode, limit=LIMIT), repeat=200)
+        print(f"{count:>8}{q + ' (' + mode + ')':>22}{baseline:>14.2f}{indexed:>14.3f}{baseline / indexed:>9.0f}x")
+    print(f"{count:>8}{'建索引':>22}{build_ms:>14.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    args = parser.parse_args()
+    print(f"{'用户数':>8}{'查询':>22}{'线性扫描 (ms)':>14}{'索引 (ms)':>14}{'加速':>9}")
+    for size in args.sizes.split(","):
+        bench(int(size))
+
+
+if __name__ == "__main__":
+    main()
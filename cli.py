@@ -0,0 +1,164 @@
+"""
+Kubeflow Manager 命令行工具
+
+使用方法：
+    python cli.py reconcile desired.yaml            # 只输出变更计划
+    python cli.py reconcile users.csv --apply       # 执行变更
+    python cli.py onboard cohort.csv [--dry-run]    # 批量开通用户和项目，显示进度和统计
+    python cli.py gc [--apply]                      # 清理孤立的 Dex 密码键
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+
+def _detect_format(path: str, fmt: str = None) -> str:
+    if fmt:
+        return fmt
+    return "csv" if os.path.splitext(path)[1].lower() == ".csv" else "yaml"
+
+
+def cmd_reconcile(args: argparse.Namespace) -> int:
+    """按期望状态文件同步用户和项目"""
+    from reconcile import reconciler, load_desired_state
+    
+    with open(args.file, encoding="utf-8") as f:
+        desired = load_desired_state(f.read(), _detect_format(args.file, args.format))
+    
+    plan = reconciler.plan(desired)
+    if not args.apply:
+        print(json.dumps({"plan": plan}, ensure_ascii=False, indent=2))
+        return 0
+    
+    result = reconciler.apply(desired, plan)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 1 if result["results"]["errors"] else 0
+
+
+def _percentile(values, q: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))] if ordered else 0
+
+
+def _progress_printer():
+    """在 stderr 上原地刷新进度（非终端时每 10% 输出一行）"""
+    interactive = sys.stderr.isatty()
+    started = time.monotonic()
+    last = {}
+    
+    def progress(stage: str, done: int, total: int) -> None:
+        elapsed = time.monotonic() - started
+        line = f"[{stage}] {done}/{total}  {done / elapsed if elapsed else 0:.1f}/s  {elapsed:.1f}s"
+        if interactive:
+            print(f"\r{line}", end="\n" if done == total else "", file=sys.stderr, flush=True)
+        elif done == total or done * 10 // total != last.get(stage):
+            print(line, file=sys.stderr, flush=True)
+        last[stage] = done * 10 // total
+    
+    return progress
+
+
+def cmd_onboard(args: argparse.Namespace) -> int:
+    """
+    批量开通：创建（或更新）文件中的用户和项目，不删除未列出的资源
+    用户按批合并 Dex 写入，项目并行创建，结束时输出吞吐量和延迟统计
+    """
+    from reconcile import reconciler, load_desired_state
+    
+    with open(args.file, encoding="utf-8") as f:
+        desired = load_desired_state(f.read(), _detect_format(args.file, args.format))
+    desired["prune"] = False
+    
+    plan = reconciler.plan(desired)
+    counts = {
+        kind: {action: len(items) for action, items in plan[kind].items() if action != "delete"}
+        for kind in ("users", "projects")
+    }
+    print(f"计划：用户 {counts['users']}，项目 {counts['projects']}，未变化 {plan['unchanged']}", file=sys.stderr)
+    if args.dry_run:
+        print(json.dumps({"plan": plan}, ensure_ascii=False, indent=2))
+        return 0
+    
+    result = reconciler.apply(
+        desired, plan,
+        user_batch_size=args.batch_size,
+        concurrency=args.concurrency,
+        progress=_progress_printer()
+    )
+    results = result["results"]
+    
+    # 结果包含新用户的明文密码：写入文件（权限 0600）或输出到 stdout
+    output = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output:
+        with open(os.open(args.output, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+            f.write(output)
+    else:
+        print(output)
+    
+    elapsed = result["elapsed_ms"] / 1000
+    project_ms = [item["elapsed_ms"] for item in results["projects"] + results["errors"]]
+    batch_ms = [batch["elapsed_ms"] for batch in results["user_batches"]]
+    processed = len(results["users"]) + len(project_ms)
+    print(
+        f"完成：用户 {len(results['users'])}（{len(batch_ms)} 批，每批 p50 {_percentile(batch_ms, 0.5)} ms，"
+        f"最大 {max(batch_ms, default=0)} ms），"
+        f"项目 {len(results['projects'])} 成功 / {len(results['errors'])} 失败"
+        f"（p50 {_percentile(project_ms, 0.5)} ms，p95 {_percentile(project_ms, 0.95)} ms，"
+        f"最大 {max(project_ms, default=0)} ms）；"
+        f"总耗时 {elapsed:.1f}s，吞吐 {processed / elapsed if elapsed else 0:.1f} 项/秒",
+        file=sys.stderr
+    )
+    for error in results["errors"]:
+        print(f"  失败：{error['name']}（{error['action']}）: {error['error']}", file=sys.stderr)
+    return 1 if results["errors"] else 0
+
+
+def cmd_gc(args: argparse.Namespace) -> int:
+    """清理孤立的 Dex 密码键"""
+    from dex_gc import dex_gc
+    
+    result = dex_gc.collect(dry_run=not args.apply)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="kubeflow-manager", description="Kubeflow 用户和项目管理工具")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    
+    reconcile = subparsers.add_parser("reconcile", help="按期望状态文件（YAML/CSV）同步用户和项目")
+    reconcile.add_argument("file", help="期望状态文件路径")
+    reconcile.add_argument("--apply", action="store_true", help="执行变更（默认只输出计划）")
+    reconcile.add_argument("--format", choices=["yaml", "csv"], help="文件格式（默认按扩展名判断）")
+    reconcile.set_defaults(func=cmd_reconcile)
+    
+    onboard = subparsers.add_parser("onboard", help="批量开通文件（YAML/CSV）中的用户和项目")
+    onboard.add_argument("file", help="用户及配额文件路径，格式同 reconcile")
+    onboard.add_argument("--dry-run", action="store_true", help="只输出变更计划，不修改集群")
+    onboard.add_argument("--format", choices=["yaml", "csv"], help="文件格式（默认按扩展名判断）")
+    onboard.add_argument("--concurrency", type=int, default=None, help="并行创建项目的线程数（默认 PROFILE_CONCURRENCY）")
+    onboard.add_argument("--batch-size", type=int, default=200, help="每次 Dex 写入的用户数，0 表示全部一次写入（默认 200）")
+    onboard.add_argument("--output", help="结果（含新用户密码）写入该文件，权限 0600；默认输出到 stdout")
+    onboard.set_defaults(func=cmd_onboard)
+    
+    gc = subparsers.add_parser("gc", help="清理 dex-passwords Secret 中的孤立密码键")
+    gc.add_argument("--apply", action="store_true", help="执行删除（默认只报告）")
+    gc.set_defaults(func=cmd_gc)
+    
+    return parser
+
+
+def main(argv=None) -> int:
+    args = build_parser().parse_args(argv)
+    try:
+        return args.func(args)
+    except ValueError as e:
+        print(f"错误：{e}", file=sys.stderr)
+        return 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
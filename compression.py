@@ -0,0 +1,131 @@
+import zlib
+from typing import Optional
+
+from starlette.datastructures import Headers, MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import settings
+
+try:
+    import zstandard
+except ImportError:  # 可选依赖，未安装时只支持 gzip
+    zstandard = None
+
+
+def choose_encoding(accept_encoding: str) -> Optional[str]:
+    """按 Accept-Encoding 选择压缩算法：优先 zstd（需安装 zstandard），其次 gzip"""
+    accepted = set()
+    for item in accept_encoding.lower().split(","):
+        name, _, params = item.strip().partition(";")
+        if params.strip().replace(" ", "") in ("q=0", "q=0.0", "q=0.00", "q=0.000"):
+            continue
+        accepted.add(name.strip())
+    if zstandard is not None and "zstd" in accepted:
+        return "zstd"
+    if "gzip" in accepted:
+        return "gzip"
+    return None
+
+
+class _Compressor:
+    """增量压缩器，流式响应逐块压缩"""
+    
+    def __init__(self, encoding: str):
+        if encoding == "zstd":
+            self._obj = zstandard.ZstdCompressor(level=settings.zstd_level).compressobj()
+        else:
+            # wbits=31 输出 gzip 格式
+            self._obj = zlib.compressobj(settings.gzip_level, zlib.DEFLATED, 31)
+    
+    def compress(self, data: bytes) -> bytes:
+        return self._obj.compress(data)
+    
+    def flush(self) -> bytes:
+        return self._obj.flush()
+
+
+class CompressionMiddleware:
+    """
+    响应压缩中间件（gzip / zstd）
+    
+    只压缩大于 compression_min_size 的响应；流式响应（如导出）总是压缩。
+    已设置 Content-Encoding 的响应和 text/event-stream 不处理。
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http" or not settings.compression_enabled:
+            await self.app(scope, receive, send)
+            return
+        encoding = choose_encoding(Headers(scope=scope).get("accept-encoding", ""))
+        if encoding is None:
+            await self.app(scope, receive, send)
+            return
+        await _CompressionResponder(self.app, encoding)(scope, receive, send)
+
+
+class _CompressionResponder:
+    def __init__(self, app: ASGIApp, encoding: str):
+        self.app = app
+        self.encoding = encoding
+        self.send: Optional[Send] = None
+        self.initial_message: Message = {}
+        self.started = False
+        self.passthrough = False
+        self.compressor: Optional[_Compressor] = None
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.send = send
+        await self.app(scope, receive, self.send_compressed)
+    
+    def _start_compression(self) -> None:
+        headers = MutableHeaders(raw=self.initial_message["headers"])
+        headers["Content-Encoding"] = self.encoding
+        headers.add_vary_header("Accept-Encoding")
+        if "content-length" in headers:
+            del headers["Content-Length"]
+        self.compressor = _Compressor(self.encoding)
+    
+    async def send_compressed(self, message: Message) -> None:
+        if message["type"] == "http.response.start":
+            # 确定是否压缩之前先不发送响应头
+            self.initial_message = message
+            headers = Headers(raw=message["headers"])
+            self.passthrough = (
+                "content-encoding" in headers
+                or headers.get("content-type", "").startswith("text/event-stream")
+            )
+            return
+        if message["type"] != "http.response.body":
+            await self.send(message)
+            return
+        
+        body = message.get("body", b"")
+        more_body = message.get("more_body", False)
+        
+        if not self.started:
+            self.started = True
+            if self.passthrough or (not more_body and len(body) < settings.compression_min_size):
+                self.passthrough = True
+                await self.send(self.initial_message)
+                await self.send(message)
+                return
+            self._start_compression()
+            if not more_body:
+                body = self.compressor.compress(body) + self.compressor.flush()
+                MutableHeaders(raw=self.initial_message["headers"])["Content-Length"] = str(len(body))
+            else:
+                body = self.compressor.compress(body)
+            await self.send(self.initial_message)
+            await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
+            return
+        
+        if self.passthrough:
+            await self.send(message)
+            return
+        body = self.compressor.compress(body)
+        if not more_body:
+            body += self.compressor.flush()
+        await self.send({"type": "http.response.body", "body": body, "more_body": more_body})
@@ -1,5 +1,15 @@
+import contextvars
+import hashlib
+import json
+import threading
+import time
+from types import MappingProxyType
+from pydantic import PrivateAttr, model_validator
 from pydantic_settings import BaseSettings
-from typing import Optional
+from typing import Any, Dict, List, Mapping, Optional
+
+from fault_injection import FaultRule, parse_fault_rules
+from quantity import normalize_hard
 
 
 class Settings(BaseSettings):
@@ -8,6 +18,10 @@ class Settings(BaseSettings):
     # Kubernetes 配置
     kubeconfig_path: Optional[str] = None  # 为 None 时使用集群内配置
     
+    # 多集群：{名称: kubeconfig 路径}，路径为空表示集群内配置；为空时只管理 default_cluster
+    clusters: dict = {}
+    default_cluster: str = "default"
+    
     # Dex 配置
     dex_namespace: str = "auth"
     dex_configmap_name: str = "dex"
@@ -30,6 +44,139 @@ class Settings(BaseSettings):
         "requests.nvidia.com/t4",
     ]
     
+    # 配额档位：{名称: hard 配额}，创建或更新项目时通过 tier 选用，例如
+    # {"small": {"cpu": "2", "memory": "4Gi"}, "l4-1": {"cpu": "8", "memory": "32Gi", "requests.nvidia.com/l4": "1"}}
+    # 未列出的 cpu/memory/requests.storage 使用上面的默认值，未列出的 gpu_resource_keys 为 0
+    quota_tiers: dict = {}
+    
+    # GPU 容量校验：off（关闭）/ warn（仅警告）/ reject（拒绝超额分配）
+    gpu_capacity_mode: str = "warn"
+    # 各 GPU 资源键的超售比例（配额总和允许达到集群容量的倍数），未配置的键使用默认值
+    gpu_overcommit_ratios: dict = {}
+    gpu_overcommit_default_ratio: float = 1.0
+    
+    # Kubernetes API 重试与熔断
+    k8s_retry_max_attempts: int = 3       # 含首次调用的最大尝试次数
+    k8s_retry_base_delay: float = 0.2     # 指数退避基础延迟（秒）
+    k8s_retry_max_delay: float = 5.0      # 单次退避上限（秒）
+    circuit_window_seconds: int = 30      # 错误率统计窗口
+    circuit_min_requests: int = 20        # 窗口内请求数达到该值才判断错误率
+    circuit_error_threshold: float = 0.5  # 错误率阈值
+    circuit_open_seconds: int = 15        # 熔断打开后的冷却时间
+    
+    # 配额使用量采样（默认每 5 分钟一次，保留 2016 个点即 7 天）
+    usage_sampler_enabled: bool = True
+    usage_sample_interval: int = 300
+    usage_retention_points: int = 2016
+    usage_storage_dir: Optional[str] = None  # 设置后使用内存映射文件持久化历史
+    
+    # 批量操作（reconcile）并发度
+    hash_concurrency: int = 8        # 并行 bcrypt 哈希的线程数
+    profile_concurrency: int = 8     # 并行创建/更新 Profile 的线程数
+    
+    # 清理孤立密码键时只处理该前缀的 Secret 键（由本服务写入）
+    dex_gc_key_prefix: str = "USER_"
+    
+    # 导出/导入
+    export_page_size: int = 500      # 导出时每页读取的 Profile 数量
+    import_batch_size: int = 1000    # 导入时每批应用的记录数
+    
+    # Dex 重启后是否等待滚动更新完成再返回：等待时返回的登录信息立即可用，但请求耗时增加
+    dex_rollout_wait: bool = False
+    dex_rollout_timeout: int = 120   # 等待上限（秒），超时返回 ready=false
+    
+    # Idempotency-Key 响应缓存
+    idempotency_backend: str = "memory"             # memory / sqlite
+    idempotency_sqlite_path: str = "idempotency.db"
+    idempotency_ttl_seconds: int = 86400
+    idempotency_max_entries: int = 10000
+    
+    # 响应压缩：超过阈值（字节）的响应按 Accept-Encoding 使用 zstd（需安装 zstandard）或 gzip
+    compression_enabled: bool = True
+    compression_min_size: int = 1024
+    gzip_level: int = 6
+    zstd_level: int = 3
+    
+    # 配置热加载：轮询 .env 的间隔（秒，0 关闭）；设置 ConfigMap 名称后同时 watch 该 ConfigMap
+    config_reload_interval: int = 5
+    config_configmap_name: Optional[str] = None
+    config_configmap_namespace: Optional[str] = None  # 为 None 时使用 dex_namespace
+    
+    # 项目删除：等待命名空间终止的上限（秒），保留已结束操作记录的数量
+    project_deletion_timeout: int = 600
+    project_operation_history: int = 1000
+    
+    # 审计日志：JSONL 文件目录、滚动大小、保留文件数、队列长度、fsync 间隔（秒）、操作者请求头
+    audit_enabled: bool = True
+    audit_dir: str = "audit"
+    audit_max_bytes: int = 64 * 1024 * 1024
+    audit_backup_count: int = 20
+    audit_queue_size: int = 10000
+    audit_fsync_interval: float = 1.0
+    audit_actor_header: str = "X-Forwarded-Email"
+    
+    # 用户搜索索引：启动时建立，搜索请求最多等待索引同步的时间（秒）
+    user_index_enabled: bool = True
+    user_index_sync_timeout: int = 10
+    
+    # 准入控制：各操作类别的并发上限，超出时按调用方（请求头，缺省为客户端 IP）公平排队
+    # 总队列或单个调用方队列已满、排队超过 admission_queue_timeout 秒时返回 429
+    admission_enabled: bool = True
+    admission_limits: dict = {"hash": 4, "dex_write": 1, "profile_write": 8, "namespace_wait": 16}
+    admission_max_queue: int = 32        # 每个类别的排队上限
+    admission_tenant_queue: int = 16     # 每个调用方在每个类别的排队上限
+    admission_queue_timeout: float = 30.0
+    admission_tenant_header: str = "X-Forwarded-Email"
+    
+    # Kubernetes API 调用统计：响应头 X-K8s-Calls / Server-Timing，以及按路由的调用预算
+    # 预算键为 "方法 路由模板"（如 "POST /api/users"），值为单个请求允许的调用次数
+    # 超出预算：warn 打印警告并计数，fail 在超出的调用发出前抛出异常（用于测试中发现 N+1 调用），off 不检查
+    k8s_accounting_headers: bool = True
+    k8s_call_budgets: dict = {}
+    k8s_call_budget_mode: str = "warn"
+    
+    # 多步操作的预写日志（SQLite WAL）：启动时恢复进程崩溃时未完成的操作
+    # synchronous 为 NORMAL 时每步不 fsync（进程崩溃安全）；FULL 每步 fsync（断电安全）
+    journal_enabled: bool = True
+    journal_path: str = "journal.db"
+    journal_synchronous: str = "NORMAL"
+    journal_recovery_concurrency: int = 8
+    journal_retention_seconds: int = 7 * 86400
+    
+    # 启动快照：设置路径后定期保存 Profile/Node 缓存和用户索引，启动时先从快照恢复再继续 watch
+    snapshot_path: Optional[str] = None
+    snapshot_interval: int = 60          # 保存间隔（秒），缓存未变化时跳过
+    snapshot_max_age: int = 86400        # 超过该时间（秒）的快照不使用
+    
+    # 变更事件流：修改接口和 Profile watch 的事件写入内存环形缓冲区，/api/events 以 SSE 推送
+    # event_webhooks 为 {名称: URL}，事件按批 gzip 压缩后 POST，设置 event_webhook_secret 时附带 HMAC-SHA256 签名
+    events_enabled: bool = True
+    event_buffer_size: int = 10000       # 缓冲区保留的事件数，断线续传只能回溯到这里
+    event_watch_profiles: bool = True    # 集群外部对 Profile 的修改（kubectl 等）也产生事件
+    event_webhooks: dict = {}
+    event_webhook_secret: Optional[str] = None
+    event_webhook_batch_size: int = 100
+    event_webhook_linger: float = 1.0    # 凑批的最长等待时间（秒）
+    event_webhook_max_attempts: int = 5
+    event_webhook_timeout: float = 10.0
+    
+    # 就绪探针 /ready：后台每 readiness_interval 秒检查一次依赖，探针请求只读取缓存的结果
+    readiness_interval: int = 15
+    readiness_timeout: float = 3.0       # 单项检查的请求超时（秒）
+    readiness_max_staleness: int = 600   # informer 超过该时间（秒）没有收到 API Server 的响应视为缓存过期
+    
+    # 诊断接口 /debug/profile（调用栈采样）和 /debug/memory（tracemalloc），需要管理令牌，默认关闭
+    debug_endpoints_enabled: bool = False
+    profile_max_seconds: int = 60        # 单次采样或内存跟踪的最长时间（秒）
+    profile_interval_ms: float = 10.0    # 采样间隔（毫秒）
+    
+    # 故障注入（仅用于测试）：为匹配 "API 组.方法名" 的 Kubernetes 调用注入延迟、错误和卡住的 watch
+    # 如 {"kubeflow.org.*": {"latency": {"distribution": "lognormal", "median_ms": 30, "p99_ms": 800}, "error_rate": 0.05}}
+    fault_injection: dict = {}
+    
+    # 管理接口令牌（请求头 X-Admin-Token），为 None 时不校验
+    admin_token: Optional[str] = None
+    
     # API 配置
     api_title: str = "Kubeflow User Management API"
     api_version: str = "1.0.0"
@@ -38,7 +185,183 @@ class Settings(BaseSettings):
     class Config:
         env_file = ".env"
         case_sensitive = False
+    
+    # 加载配置时由 quota_tiers 生成的完整 hard 配额（只读）
+    _tier_hard: Dict[str, Mapping[str, str]] = PrivateAttr(default_factory=dict)
+    # 加载配置时由 fault_injection 解析的故障规则
+    _fault_rules: List[FaultRule] = PrivateAttr(default_factory=list)
+    
+    @model_validator(mode="after")
+    def check_values(self) -> "Settings":
+        """取值校验，热加载时不合法的配置不会生效"""
+        if self.gpu_capacity_mode not in ("off", "warn", "reject"):
+            raise ValueError(f"gpu_capacity_mode 只能是 off/warn/reject: {self.gpu_capacity_mode}")
+        if self.k8s_call_budget_mode not in ("off", "warn", "fail"):
+            raise ValueError(f"k8s_call_budget_mode 只能是 off/warn/fail: {self.k8s_call_budget_mode}")
+        if self.journal_synchronous not in ("OFF", "NORMAL", "FULL"):
+            raise ValueError(f"journal_synchronous 只能是 OFF/NORMAL/FULL: {self.journal_synchronous}")
+        if self.idempotency_backend not in ("memory", "sqlite"):
+            raise ValueError(f"idempotency_backend 只能是 memory/sqlite: {self.idempotency_backend}")
+        if self.clusters and self.default_cluster not in self.clusters:
+            raise ValueError(f"default_cluster {self.default_cluster} 不在 clusters 中")
+        for key in self.gpu_resource_keys:
+            if not isinstance(key, str) or not key.startswith("requests."):
+                raise ValueError(f"gpu_resource_keys 中的键必须以 requests. 开头: {key}")
+        for name in ("hash_concurrency", "profile_concurrency", "k8s_retry_max_attempts",
+                     "export_page_size", "import_batch_size", "usage_retention_points",
+                     "admission_max_queue", "admission_tenant_queue", "journal_recovery_concurrency",
+                     "profile_max_seconds", "readiness_interval", "event_buffer_size",
+                     "event_webhook_batch_size", "event_webhook_max_attempts"):
+            if getattr(self, name) < 1:
+                raise ValueError(f"{name} 必须大于 0")
+        if self.profile_interval_ms < 1:
+            raise ValueError(f"profile_interval_ms 不能小于 1: {self.profile_interval_ms}")
+        for op_class, limit in self.admission_limits.items():
+            if not isinstance(limit, int) or limit < 1:
+                raise ValueError(f"admission_limits 中 {op_class} 的上限必须是正整数: {limit}")
+        self._tier_hard = {name: MappingProxyType(self._build_tier(name, hard)) for name, hard in self.quota_tiers.items()}
+        self._fault_rules = parse_fault_rules(self.fault_injection)
+        return self
+    
+    def _build_tier(self, name: str, hard: Any) -> Dict[str, str]:
+        if not isinstance(hard, dict) or not hard:
+            raise ValueError(f"quota_tiers 中 {name} 必须是非空的配额字典")
+        tier = {
+            "cpu": self.default_cpu_limit,
+            "memory": f"{self.default_memory_limit}Gi",
+            "requests.storage": f"{self.default_storage_size}Gi",
+        }
+        tier.update(dict.fromkeys(self.gpu_resource_keys, "0"))
+        tier.update(hard)
+        try:
+            return normalize_hard(tier)
+        except ValueError as e:
+            raise ValueError(f"quota_tiers 中 {name} 无效: {e}")
+    
+    def quota_tier(self, name: str) -> Mapping[str, str]:
+        """返回档位的完整 hard 配额（只读），未知档位抛出 ValueError"""
+        tier = self._tier_hard.get(name)
+        if tier is None:
+            available = "、".join(self._tier_hard) or "无"
+            raise ValueError(f"未知的配额档位: {name}（可用档位：{available}）")
+        return tier
+    
+    def fault_rules(self) -> List[FaultRule]:
+        return self._fault_rules
+
+
+# 修改后需要重启进程才能完全生效的配置（已创建的客户端、缓存后端、监听端口等）
+RESTART_REQUIRED = {
+    "kubeconfig_path", "idempotency_backend", "idempotency_sqlite_path",
+    "usage_storage_dir", "api_title", "api_version", "api_port",
+    "config_configmap_name", "config_configmap_namespace",
+    "audit_dir", "audit_queue_size", "journal_path", "journal_synchronous",
+    "event_watch_profiles", "event_webhooks",
+}
+
+# 请求开始时固定的配置快照，同一请求内（包括线程池中的调用）读取到一致的配置
+_pinned: contextvars.ContextVar[Optional[Settings]] = contextvars.ContextVar("settings_snapshot", default=None)
+
+
+def _parse_overrides(data: Dict[str, str]) -> Dict[str, Any]:
+    """把 ConfigMap 中的字符串值转换为字段需要的类型（list/dict 字段为 JSON）"""
+    overrides = {}
+    for key, value in data.items():
+        name = key.lower()
+        field = Settings.model_fields.get(name)
+        if field is not None and field.annotation in (list, dict) and isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError as e:
+                raise ValueError(f"{key} 不是合法的 JSON: {e}")
+        overrides[name] = value
+    return overrides
+
+
+class SettingsManager:
+    """
+    可热加载的配置
+    
+    重新加载时构造新的 Settings（.env + 环境变量 + ConfigMap 覆盖项），校验通过后整体替换；
+    已经开始的请求继续使用自己固定的旧快照。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._overrides: Dict[str, Any] = {}
+        self._active = Settings()
+        self.version = 1
+        self.loaded_at = time.time()
+        self.source = "startup"
+        self.last_error: Optional[str] = None
+    
+    @property
+    def active(self) -> Settings:
+        return _pinned.get() or self._active
+    
+    def pin(self) -> None:
+        """为当前请求固定配置快照"""
+        _pinned.set(self._active)
+    
+    @staticmethod
+    def _digest(snapshot: Settings) -> str:
+        data = json.dumps(snapshot.model_dump(), sort_keys=True, default=str)
+        return hashlib.sha256(data.encode()).hexdigest()[:12]
+    
+    def reload(self, source: str = "manual", overrides: Optional[Dict[str, str]] = None) -> Dict[str, Any]:
+        """
+        重新加载配置；overrides 为 ConfigMap 数据（None 表示沿用上次的覆盖项）
+        校验失败抛出 ValueError，当前配置保持不变
+        返回: {"version": int, "changed": [...], "restart_required": [...]}
+        """
+        with self._lock:
+            try:
+                merged = self._overrides if overrides is None else _parse_overrides(overrides)
+                new = Settings(**merged)
+            except Exception as e:
+                self.last_error = f"{source}: {e}"
+                raise ValueError(f"配置校验失败: {e}")
+            
+            old_values, new_values = self._active.model_dump(), new.model_dump()
+            changed = sorted(k for k in new_values if new_values[k] != old_values.get(k))
+            self._overrides = merged
+            self.last_error = None
+            if changed:
+                self._active = new
+                self.version += 1
+                self.loaded_at = time.time()
+                self.source = source
+            return {
+                "version": self.version,
+                "changed": changed,
+                "restart_required": sorted(RESTART_REQUIRED.intersection(changed)),
+            }
+    
+    def info(self) -> Dict[str, Any]:
+        """当前生效配置的版本信息（敏感字段打码）"""
+        snapshot = self._active
+        values = snapshot.model_dump()
+        for name in ("admin_token", "event_webhook_secret"):
+            if values.get(name):
+                values[name] = "******"
+        return {
+            "version": self.version,
+            "digest": self._digest(snapshot),
+            "loaded_at": self.loaded_at,
+            "source": self.source,
+            "overrides": sorted(self._overrides),
+            "last_error": self.last_error,
+            "settings": values,
+        }
+
+
+class SettingsProxy:
+    """全局 settings：属性访问转发到当前请求的快照（请求外为最新配置）"""
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(settings_manager.active, name)
 
 
-settings = Settings()
+settings_manager = SettingsManager()
+settings = SettingsProxy()
 
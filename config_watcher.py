@@ -0,0 +1,83 @@
+import os
+import threading
+from typing import Any, Dict, Optional
+
+from config import Settings, settings, settings_manager
+from informer import Informer
+from k8s_client import cluster_registry
+
+
+class ConfigWatcher:
+    """
+    监听配置来源并热加载
+    
+    - .env：按 config_reload_interval 轮询修改时间（不依赖 inotify，容器挂载的文件同样适用）
+    - ConfigMap：设置 config_configmap_name 时 watch 该 ConfigMap，data 中的键作为覆盖项
+    校验失败只打印警告，继续使用旧配置。
+    """
+    
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._informer: Optional[Informer] = None
+        self._env_mtime: Optional[float] = None
+    
+    @staticmethod
+    def _env_file() -> str:
+        return Settings.model_config.get("env_file") or ".env"
+    
+    def _mtime(self) -> Optional[float]:
+        try:
+            return os.stat(self._env_file()).st_mtime
+        except OSError:
+            return None
+    
+    def _reload(self, source: str, overrides: Optional[Dict[str, str]] = None) -> None:
+        try:
+            result = settings_manager.reload(source, overrides)
+        except ValueError as e:
+            print(f"警告：{source} 配置未生效: {e}")
+            return
+        if result["changed"]:
+            print(f"配置已更新（版本 {result['version']}，来源 {source}）: {', '.join(result['changed'])}")
+        if result["restart_required"]:
+            print(f"警告：以下配置需要重启后生效: {', '.join(result['restart_required'])}")
+    
+    def _on_configmap(self, event_type: str, obj: Optional[Dict[str, Any]], old: Optional[Dict[str, Any]]) -> None:
+        data = (obj or {}).get("data") or {}
+        self._reload(f"configmap/{settings.config_configmap_name}", data)
+    
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        if settings.config_configmap_name:
+            namespace = settings.config_configmap_namespace or settings.dex_namespace
+            selector = f"metadata.name={settings.config_configmap_name}"
+            kube_client = cluster_registry.client()
+            self._informer = Informer(
+                "settings-configmap",
+                lambda **kwargs: kube_client.list_configmaps(namespace, field_selector=selector, **kwargs)
+            )
+            self._informer.add_handler(self._on_configmap)
+            self._informer.start()
+        self._env_mtime = self._mtime()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="config-watcher", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        self._stop.set()
+        if self._informer:
+            self._informer.stop()
+    
+    def _run(self) -> None:
+        while not self._stop.wait(settings.config_reload_interval or 5):
+            if not settings.config_reload_interval:
+                continue
+            mtime = self._mtime()
+            if mtime != self._env_mtime:
+                self._env_mtime = mtime
+                self._reload(self._env_file())
+
+
+config_watcher = ConfigWatcher()
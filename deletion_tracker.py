@@ -0,0 +1,266 @@
+import asyncio
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, AsyncIterator, Dict, List, Optional, Set, Tuple
+
+import orjson
+from kubernetes.client.rest import ApiException
+
+from config import settings
+from admission import admission
+from audit import audit_log
+from gpu_capacity import gpu_capacity_indexes
+from informer import Informer
+from k8s_client import k8s_client, cluster_registry, current_cluster
+
+
+# 终止阶段，操作进入这些阶段后不再变化
+TERMINAL_PHASES = {"completed", "failed", "timeout"}
+
+# 删除请求等待命名空间 watch 首次同步的上限（秒）
+_SYNC_TIMEOUT = 10
+
+
+def _namespace_phase(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """命名空间缓存只保留名称和 phase"""
+    return {
+        "metadata": {"name": obj["metadata"]["name"]},
+        "phase": (obj.get("status") or {}).get("phase"),
+    }
+
+
+class DeletionOperation:
+    """
+    一次项目删除操作
+    
+    阶段依次为 deleting（Profile 已删除）→ terminating（命名空间 Terminating）→ completed，
+    失败或超时时为 failed / timeout。每次阶段变化追加一个事件，事件序号从 1 开始。
+    """
+    
+    def __init__(self, cluster: str, name: str):
+        self.id = uuid.uuid4().hex
+        self.cluster = cluster
+        self.name = name
+        self.phase: Optional[str] = None
+        self.events: List[Dict[str, Any]] = []
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+        self._changed = threading.Condition()
+        # 等待新事件的 SSE 连接：(事件循环, asyncio.Event)，在 record 中跨线程唤醒
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+    
+    @property
+    def done(self) -> bool:
+        return self.phase in TERMINAL_PHASES
+    
+    @property
+    def state(self) -> str:
+        return self.phase if self.done else "running"
+    
+    def record(self, phase: str, message: str) -> None:
+        with self._changed:
+            if self.done:
+                return
+            self.phase = phase
+            self.events.append({"seq": len(self.events) + 1, "phase": phase, "message": message, "time": time.time()})
+            if self.done:
+                self.finished_at = time.time()
+            self._changed.notify_all()
+            waiters = list(self._waiters)
+        for loop, wakeup in waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+    
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """阻塞直到操作结束，超时返回 False"""
+        with self._changed:
+            return self._changed.wait_for(lambda: self.done, timeout)
+    
+    async def stream(self, after: int = 0, keepalive: float = 15.0) -> AsyncIterator[str]:
+        """
+        以 SSE 格式逐个输出操作事件（id 为事件序号，可配合 Last-Event-ID 续传）
+        在事件循环中等待，不占用线程池；操作结束且事件输出完毕后停止，长时间无事件时输出注释行保持连接
+        """
+        wakeup = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), wakeup)
+        with self._changed:
+            self._waiters.add(waiter)
+        try:
+            seq = after
+            while True:
+                wakeup.clear()
+                with self._changed:
+                    events = self.events[seq:]
+                    done = self.done
+                for event in events:
+                    seq = event["seq"]
+                    yield f"id: {seq}\nevent: {event['phase']}\ndata: {orjson.dumps(event).decode()}\n\n"
+                if done:
+                    return
+                if events:
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            with self._changed:
+                self._waiters.discard(waiter)
+    
+    def to_dict(self) -> Dict[str, Any]:
+        with self._changed:
+            end = self.finished_at or time.time()
+            return {
+                "id": self.id,
+                "type": "delete_project",
+                "cluster": self.cluster,
+                "name": self.name,
+                "state": self.state,
+                "phase": self.phase,
+                "started_at": self.started_at,
+                "finished_at": self.finished_at,
+                "elapsed_seconds": round(end - self.started_at, 3),
+                "events": list(self.events),
+            }
+
+
+class DeletionTracker:
+    """
+    项目删除的后台跟踪
+    
+    删除 Profile 后命名空间会 Terminating 数分钟，期间无法重建同名项目。
+    每个集群共用一个命名空间 watch（首次删除时启动），命名空间消失时把对应操作标记为完成；
+    同名项目的重复删除返回同一个操作，创建时可以排队等待删除完成。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._operations: "OrderedDict[str, DeletionOperation]" = OrderedDict()
+        self._pending: Dict[Tuple[str, str], DeletionOperation] = {}
+        self._timers: Dict[str, threading.Timer] = {}
+        self._informers: Dict[str, Informer] = {}
+    
+    def _informer(self) -> Informer:
+        """当前集群的命名空间 informer"""
+        kube_client = cluster_registry.client(current_cluster.get())
+        cluster = kube_client.cluster_name
+        with self._lock:
+            informer = self._informers.get(cluster)
+            if informer is None:
+                informer = self._informers[cluster] = Informer(
+                    f"namespaces-{cluster}", kube_client.list_namespaces, transform=_namespace_phase)
+                informer.add_handler(
+                    lambda event_type, obj, old: self._on_namespace(cluster, event_type, obj, old))
+                informer.start()
+            return informer
+    
+    def _on_namespace(self, cluster: str, event_type: str, obj: Optional[Dict[str, Any]], old: Optional[Dict[str, Any]]) -> None:
+        name = (obj or old)["metadata"]["name"]
+        with self._lock:
+            operation = self._pending.get((cluster, name))
+        if operation is None:
+            return
+        if event_type == "DELETED":
+            self._finish(operation, "completed", f"命名空间 {name} 已删除")
+        elif obj.get("phase") == "Terminating" and operation.phase == "deleting":
+            operation.record("terminating", f"命名空间 {name} 正在终止")
+    
+    def _finish(self, operation: DeletionOperation, phase: str, message: str) -> None:
+        operation.record(phase, message)
+        with self._lock:
+            if self._pending.get((operation.cluster, operation.name)) is operation:
+                del self._pending[(operation.cluster, operation.name)]
+            timer = self._timers.pop(operation.id, None)
+        if timer is not None:
+            timer.cancel()
+    
+    def _register(self, operation: DeletionOperation) -> DeletionOperation:
+        """登记操作；同名项目已有进行中的操作时不登记，返回已有的操作（检查和登记在同一把锁内）"""
+        with self._lock:
+            existing = self._pending.get((operation.cluster, operation.name))
+            if existing is not None:
+                return existing
+            self._operations[operation.id] = operation
+            self._pending[(operation.cluster, operation.name)] = operation
+            # 只淘汰已结束的旧操作
+            excess = len(self._operations) - settings.project_operation_history
+            for op_id in [op_id for op_id, op in self._operations.items() if op.done][:max(0, excess)]:
+                del self._operations[op_id]
+        return operation
+    
+    def delete(self, profile_name: str) -> DeletionOperation:
+        """
+        删除 Profile 并在后台跟踪命名空间终止
+        同名项目已在删除中时直接返回进行中的操作；项目不存在时抛出 ValueError
+        """
+        pending = self.pending(profile_name)
+        if pending is not None:
+            return pending
+        profile = k8s_client.get_profile(profile_name)
+        if not profile:
+            raise ValueError(f"项目 {profile_name} 不存在")
+        
+        # 先启动 watch，保证能收到本次删除引起的命名空间事件
+        informer = self._informer()
+        operation = DeletionOperation(cluster_registry.validate(current_cluster.get()), profile_name)
+        registered = self._register(operation)
+        if registered is not operation:
+            # 并发的删除请求已先登记
+            return registered
+        try:
+            with admission.slot("profile_write"):
+                k8s_client.delete_profile(profile_name)
+        except ApiException as e:
+            if e.status != 404:
+                self._finish(operation, "failed", f"删除 Profile 失败: {e}")
+                raise
+            # Profile 已被其他副本或集群外部删除：不再记录审计，继续跟踪命名空间终止
+            operation.record("deleting", f"Profile {profile_name} 已被删除，等待命名空间终止")
+        except Exception as e:
+            self._finish(operation, "failed", f"删除 Profile 失败: {e}")
+            raise
+        else:
+            audit_log.change(
+                "project", profile_name, "delete",
+                before=(profile.get('spec') or {}).get('resourceQuotaSpec', {}).get('hard', {}), after={})
+            operation.record("deleting", f"Profile {profile_name} 已删除，等待命名空间终止")
+        gpu_capacity_indexes.get().record_profile(profile_name, None)
+        
+        timeout = settings.project_deletion_timeout
+        timer = threading.Timer(
+            timeout, self._finish, (operation, "timeout", f"等待命名空间终止超时（{timeout} 秒）"))
+        timer.daemon = True
+        with self._lock:
+            self._timers[operation.id] = timer
+        timer.start()
+        
+        # 命名空间不存在（或在 watch 同步前已删除完）时直接完成；未同步时由后续事件或超时结束
+        if informer.wait_for_sync(_SYNC_TIMEOUT):
+            namespace = informer.get(profile_name)
+            if namespace is None:
+                self._finish(operation, "completed", f"命名空间 {profile_name} 已删除")
+            elif namespace.get("phase") == "Terminating":
+                operation.record("terminating", f"命名空间 {profile_name} 正在终止")
+        return operation
+    
+    def pending(self, profile_name: str) -> Optional[DeletionOperation]:
+        """当前集群中同名项目进行中的删除操作"""
+        cluster = cluster_registry.validate(current_cluster.get())
+        with self._lock:
+            return self._pending.get((cluster, profile_name))
+    
+    def get(self, operation_id: str) -> Optional[DeletionOperation]:
+        with self._lock:
+            return self._operations.get(operation_id)
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._operations)
+
+
+deletion_tracker = DeletionTracker()
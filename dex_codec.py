@@ -0,0 +1,215 @@
+import copy
+import re
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+import yaml
+
+from k8s_client import k8s_client
+
+
+# 优先使用 libyaml 的 C 实现，未编译 libyaml 时退回纯 Python 实现
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+_BLOCK_START = re.compile(r"^staticPasswords:[ \t]*(\[[ \t]*\])?[ \t]*(#.*)?$", re.MULTILINE)
+
+
+def _dump_entry(entry: Dict[str, Any], indent: str) -> str:
+    """序列化单个用户条目，按原文档的缩进对齐"""
+    text = yaml.dump([entry], Dumper=Dumper, default_flow_style=False)
+    if indent:
+        text = "".join(indent + line + "\n" for line in text.splitlines())
+    return text
+
+
+class _Document:
+    """
+    一份已解析的 config.yaml
+    
+    文本被切成三段：staticPasswords 之前（head）、staticPasswords 块、之后（tail）；
+    块内每个用户条目对应一段原始文本（chunks，以条目的 items 元组为键），未修改的条目写回时直接复用。
+    条目以 items 元组保存（rows），读取时再构造 dict 副本。
+    """
+    
+    def __init__(self, text: str, data: Dict[str, Any]):
+        self.text = text
+        self.others = {k: v for k, v in data.items() if k != "staticPasswords"}
+        self.rows: List[Tuple] = [tuple(entry.items()) for entry in data.get("staticPasswords") or []]
+        self.has_entries = "staticPasswords" in data
+        self.chunks: Dict[Tuple, str] = {}
+        self.plain = True  # 所有条目的值都是标量（可哈希）
+        self.indent = ""
+        self.prefix = ""
+        self.spliceable = False
+        
+        match = _BLOCK_START.search(text)
+        if match is None:
+            # 没有 staticPasswords 键：块追加在末尾（要求根节点为块格式的映射）
+            if "staticPasswords" not in data and not text.lstrip().startswith("{"):
+                self.head = text if not text or text.endswith("\n") else text + "\n"
+                self.tail = ""
+                self.spliceable = True
+            return
+        
+        self.head = text[:match.start()]
+        lines = text[match.end():].split("\n")
+        block_lines: List[str] = []
+        i = 1  # lines[0] 是块起始行的剩余部分（空）
+        while i < len(lines):
+            line = lines[i]
+            if line and not line[0] in " \t-#":
+                break
+            block_lines.append(line)
+            i += 1
+        # 末尾的空行归入 tail
+        while block_lines and not block_lines[-1].strip():
+            block_lines.pop()
+            i -= 1
+        self.tail = "\n".join(lines[i:])
+        if match.group(1) is not None and block_lines:
+            return
+        
+        starts = [n for n, line in enumerate(block_lines) if line.lstrip(" ").startswith("- ") or line.strip() == "-"]
+        if starts:
+            first = block_lines[starts[0]]
+            self.indent = first[:len(first) - len(first.lstrip(" "))]
+            starts = [n for n in starts if block_lines[n].startswith(self.indent + "-")]
+        if len(starts) != len(self.rows):
+            return
+        self.prefix = "".join(line + "\n" for line in block_lines[:starts[0]]) if starts else ""
+        bounds = starts + [len(block_lines)]
+        chunks = [
+            "".join(line + "\n" for line in block_lines[begin:end])
+            for begin, end in zip(bounds, bounds[1:])
+        ]
+        # 抽查首尾条目，确认文本切分与解析结果一一对应
+        for n in {0, len(chunks) - 1} if chunks else ():
+            if yaml.load(chunks[n], Loader=Loader) != [dict(self.rows[n])]:
+                return
+        for row, chunk in zip(self.rows, chunks):
+            try:
+                self.chunks[row] = chunk
+            except TypeError:  # 含列表等不可哈希的值，不缓存
+                self.plain = False
+        self.spliceable = True
+    
+    def entries(self) -> List[Dict[str, Any]]:
+        """staticPasswords 的 dict 副本"""
+        if self.plain:
+            return [dict(row) for row in self.rows]
+        return [copy.deepcopy(dict(row)) for row in self.rows]
+    
+    def render(self, data: Dict[str, Any]) -> Optional[Tuple[str, "_Document"]]:
+        """
+        把 data 拼接回文本，只序列化新增或修改过的用户条目
+        非 staticPasswords 部分有变化时返回 None（由调用方整体序列化）
+        """
+        if not self.spliceable:
+            return None
+        others = {k: v for k, v in data.items() if k != "staticPasswords"}
+        if others != self.others:
+            return None
+        
+        # 新文档沿用同一个 chunks 字典，只插入新条目；已删除条目的文本积累过多时再重建
+        chunks = self.chunks
+        rows: List[Tuple] = []
+        plain = True
+        parts = ["staticPasswords:\n", self.prefix]
+        for entry in data.get("staticPasswords") or []:
+            row = tuple(entry.items())
+            try:
+                chunk = chunks.get(row)
+                if chunk is None:
+                    chunk = chunks[row] = _dump_entry(entry, self.indent)
+            except TypeError:
+                chunk = _dump_entry(entry, self.indent)
+                row = tuple(copy.deepcopy(entry).items())
+                plain = False
+            rows.append(row)
+            parts.append(chunk)
+        if plain and len(chunks) > 2 * len(rows) + 1000:
+            chunks = {row: chunks[row] for row in rows if row in chunks}
+        body = "".join(parts) if rows else "staticPasswords: []\n"
+        text = self.head + body + self.tail
+        
+        document = _Document.__new__(_Document)
+        document.text = text
+        document.others = self.others
+        document.rows = rows
+        document.plain = plain
+        document.has_entries = "staticPasswords" in data
+        document.chunks = chunks
+        document.indent = self.indent
+        document.prefix = self.prefix
+        document.head = self.head
+        document.tail = self.tail
+        document.spliceable = True
+        return text, document
+
+
+class DexConfigCodec:
+    """
+    Dex config.yaml 编解码
+    
+    - 解析结果按 (集群, 命名空间, 名称, resourceVersion) 缓存，ConfigMap 未变化时不再解析
+    - 写回时只序列化变化的 staticPasswords 条目，其余部分原样拼接
+    - 本进程写入的文本在下次读取时直接复用，无需重新解析
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._documents: Dict[Tuple[str, str, str], Tuple[Optional[str], _Document]] = {}
+    
+    @staticmethod
+    def _key(configmap: Any) -> Tuple[str, str, str]:
+        metadata = configmap.metadata
+        return (k8s_client.cluster_name, metadata.namespace or "", metadata.name or "")
+    
+    def _document(self, configmap: Any) -> _Document:
+        key = self._key(configmap)
+        resource_version = configmap.metadata.resource_version
+        text = (configmap.data or {}).get("config.yaml", "{}")
+        with self._lock:
+            cached = self._documents.get(key)
+        if cached is not None:
+            cached_version, document = cached
+            if (resource_version and cached_version == resource_version) or document.text == text:
+                if cached_version != resource_version:
+                    with self._lock:
+                        self._documents[key] = (resource_version, document)
+                return document
+        
+        data = yaml.load(text, Loader=Loader) or {}
+        document = _Document(text, data)
+        with self._lock:
+            self._documents[key] = (resource_version, document)
+        return document
+    
+    def loads(self, configmap: Any) -> Dict[str, Any]:
+        """
+        解析 ConfigMap 中的 config.yaml
+        返回值为副本，可以直接修改
+        """
+        document = self._document(configmap)
+        data = copy.deepcopy(document.others)
+        if document.has_entries:
+            data["staticPasswords"] = document.entries()
+        return data
+    
+    def dumps(self, configmap: Any, data: Dict[str, Any]) -> str:
+        """序列化 config.yaml；能拼接时只序列化变化的条目，否则整体序列化"""
+        key = self._key(configmap)
+        with self._lock:
+            cached = self._documents.get(key)
+        rendered = cached[1].render(data) if cached is not None else None
+        if rendered is None:
+            return yaml.dump(data, Dumper=Dumper, default_flow_style=False)
+        text, document = rendered
+        with self._lock:
+            # resourceVersion 在写入后才知道，先记为 None，下次读取时按文本比对认领
+            self._documents[key] = (None, document)
+        return text
+
+
+dex_codec = DexConfigCodec()
@@ -0,0 +1,88 @@
+import base64
+from typing import Any, Dict
+
+
+from config import settings
+from k8s_client import k8s_client
+from dex_codec import dex_codec
+from project_service import project_service
+from user_service import pending_keys
+
+
+class DexGarbageCollector:
+    """
+    清理 dex-passwords Secret 中的孤立密码键
+    
+    孤立键 = Secret 中以 dex_gc_key_prefix 开头的键 - staticPasswords 中 hashFromEnv 引用的键。
+    同时标记 owner 在 Dex 中不存在的 Profile（只报告，不删除）。
+    """
+    
+    @staticmethod
+    def _referenced() -> Dict[str, Any]:
+        configmap = k8s_client.get_configmap(settings.dex_configmap_name, settings.dex_namespace)
+        if not configmap:
+            raise ValueError(f"ConfigMap {settings.dex_configmap_name} 不存在")
+        config_data = dex_codec.loads(configmap)
+        users = config_data.get('staticPasswords') or []
+        return {
+            "keys": {u.get('hashFromEnv') for u in users if u.get('hashFromEnv')},
+            "emails": {u.get('email') for u in users},
+        }
+    
+    def collect(self, dry_run: bool = True) -> Dict[str, Any]:
+        """
+        计算并（非 dry_run 时）删除孤立键，返回统计信息
+        
+        用户变更先写 Secret 再写 ConfigMap，两次写入之间新键看起来是孤立的，因此：
+        - 排除 pending_keys 中进行中的键（写 Secret 前登记，ConfigMap 写入后才移除）；
+        - 之后重新读取 ConfigMap，排除期间已写入 ConfigMap 的键（先读登记再读 ConfigMap，中间完成的变更不会漏掉）；
+        - 以首次读取的 Secret resourceVersion 作为 patch 前置条件，之后才开始的变更会使 patch 返回 409。
+        进行中的键只在本进程内登记，多副本部署时应只在一个副本上执行清理。
+        """
+        secret = k8s_client.get_secret(settings.dex_secret_name, settings.dex_namespace)
+        if not secret:
+            raise ValueError(f"Secret {settings.dex_secret_name} 不存在")
+        secret_data = secret.data or {}
+        
+        referenced = self._referenced()
+        prefix = settings.dex_gc_key_prefix
+        managed_keys = {key for key in secret_data if key.startswith(prefix)}
+        orphan_keys = managed_keys - referenced["keys"]
+        missing_keys = referenced["keys"] - set(secret_data)
+        
+        orphan_profiles = [
+            {"name": project["name"], "owner": project["owner"]}
+            for project in project_service.list_projects()
+            if project["owner"] not in referenced["emails"]
+        ]
+        
+        orphan_keys -= pending_keys.keys()
+        if orphan_keys and not dry_run:
+            orphan_keys -= self._referenced()["keys"]
+        
+        bytes_reclaimed = sum(
+            len(key.encode()) + len(base64.b64decode(secret_data[key] or ""))
+            for key in orphan_keys
+        )
+        
+        if orphan_keys and not dry_run:
+            k8s_client.patch_secret(
+                settings.dex_secret_name,
+                settings.dex_namespace,
+                {key: None for key in orphan_keys},
+                resource_version=secret.metadata.resource_version
+            )
+        
+        return {
+            "dry_run": dry_run,
+            "secret_keys": len(secret_data),
+            "referenced_keys": len(referenced["keys"]),
+            "orphan_keys": sorted(orphan_keys),
+            "missing_keys": sorted(missing_keys),
+            "orphan_profiles": orphan_profiles,
+            "bytes_reclaimed": bytes_reclaimed if not dry_run else 0,
+            "bytes_reclaimable": bytes_reclaimed,
+        }
+
+
+dex_gc = DexGarbageCollector()
@@ -0,0 +1,117 @@
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from config import settings
+from informer import Informer
+from k8s_client import k8s_client, current_cluster, cluster_registry
+from metrics import registry
+from admission import admission
+
+
+rollout_seconds = registry.gauge(
+    "kubeflow_manager_dex_rollout_seconds", "最近一次 Dex 重启到新 Pod 全部可用的耗时")
+rollout_timeouts = registry.counter(
+    "kubeflow_manager_dex_rollout_timeouts_total", "等待 Dex 就绪超时次数")
+
+
+def _rollout_status(obj: Dict[str, Any]) -> Dict[str, Any]:
+    """只保留判断滚动更新进度需要的字段"""
+    metadata = obj.get("metadata") or {}
+    spec = obj.get("spec") or {}
+    status = obj.get("status") or {}
+    return {
+        "metadata": {"name": metadata.get("name"), "generation": metadata.get("generation") or 0},
+        "replicas": spec.get("replicas", 1),
+        "observedGeneration": status.get("observedGeneration") or 0,
+        "statusReplicas": status.get("replicas") or 0,
+        "updatedReplicas": status.get("updatedReplicas") or 0,
+        "availableReplicas": status.get("availableReplicas") or 0,
+    }
+
+
+def rollout_complete(status: Optional[Dict[str, Any]], generation: int) -> bool:
+    """与 kubectl rollout status 相同的判断：新版本 Pod 全部更新、可用，且旧 Pod 已退出"""
+    if not status or status["observedGeneration"] < generation:
+        return False
+    return (
+        status["updatedReplicas"] >= status["replicas"]
+        and status["statusReplicas"] <= status["updatedReplicas"]
+        and status["availableReplicas"] >= status["updatedReplicas"]
+    )
+
+
+class DexRolloutWatcher:
+    """
+    重启 Dex 并等待滚动更新完成
+    
+    同一集群的所有等待者共用一个 Deployment watch（首次等待时启动），每个事件唤醒全部等待者，
+    各自比较 observedGeneration 与自己重启后的 generation。
+    """
+    
+    def __init__(self):
+        self._changed = threading.Condition()
+        self._informers: Dict[str, Informer] = {}
+        self._informer_lock = threading.Lock()
+    
+    @property
+    def informer(self) -> Informer:
+        """当前集群的 Dex Deployment informer"""
+        kube_client = cluster_registry.client(current_cluster.get())
+        with self._informer_lock:
+            informer = self._informers.get(kube_client.cluster_name)
+            if informer is None:
+                selector = f"metadata.name={settings.dex_deployment_name}"
+                informer = self._informers[kube_client.cluster_name] = Informer(
+                    f"dex-deployment-{kube_client.cluster_name}",
+                    lambda **kwargs: kube_client.list_deployments(
+                        settings.dex_namespace, field_selector=selector, **kwargs),
+                    transform=_rollout_status
+                )
+                informer.add_handler(self._on_event)
+                informer.start()
+            return informer
+    
+    def _on_event(self, event_type: str, obj: Optional[Dict[str, Any]], old: Optional[Dict[str, Any]]) -> None:
+        with self._changed:
+            self._changed.notify_all()
+    
+    def wait_for(self, generation: int, timeout: float) -> bool:
+        """阻塞直到 Deployment 的 generation 版本滚动完成，超时返回 False"""
+        deadline = time.monotonic() + timeout
+        informer = self.informer
+        if not informer.wait_for_sync(timeout):
+            return False
+        with self._changed:
+            while True:
+                if rollout_complete(informer.get(settings.dex_deployment_name), generation):
+                    return True
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return False
+                self._changed.wait(remaining)
+    
+    def restart(self, wait_ready: Optional[bool] = None) -> Dict[str, Any]:
+        """
+        重启 Dex；wait_ready 为 None 时使用 settings.dex_rollout_wait
+        返回: {"ready": bool|None, "rollout_seconds": float|None}，不等待时均为 None
+        """
+        if wait_ready is None:
+            wait_ready = settings.dex_rollout_wait
+        started = time.monotonic()
+        with admission.slot("dex_write"):
+            deployment = k8s_client.restart_deployment(settings.dex_deployment_name, settings.dex_namespace)
+        if not wait_ready:
+            return {"ready": None, "rollout_seconds": None}
+        
+        ready = self.wait_for(deployment.metadata.generation or 0, settings.dex_rollout_timeout)
+        elapsed = round(time.monotonic() - started, 3)
+        if ready:
+            rollout_seconds.set(elapsed)
+        else:
+            rollout_timeouts.inc()
+            print(f"警告：等待 Dex 滚动更新超时（{settings.dex_rollout_timeout} 秒）")
+        return {"ready": ready, "rollout_seconds": elapsed}
+
+
+dex_rollout = DexRolloutWatcher()
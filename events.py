@@ -0,0 +1,333 @@
+import asyncio
+import gzip
+import hashlib
+import hmac
+import threading
+import time
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from itertools import islice
+from typing import Any, AsyncIterator, Deque, Dict, List, Optional, Set, Tuple
+
+import orjson
+import urllib3
+
+from config import settings
+from informer import Informer
+from k8s_client import cluster_registry
+from metrics import registry
+
+
+events_published = registry.counter(
+    "kubeflow_manager_events_published_total", "发布到变更事件流的事件数")
+webhook_deliveries = registry.counter(
+    "kubeflow_manager_webhook_deliveries_total", "webhook 批量投递次数（result=success/retry/failed）")
+webhook_events_dropped = registry.counter(
+    "kubeflow_manager_webhook_events_dropped_total", "webhook 未能投递的事件数（重试耗尽或落后于缓冲区）")
+webhook_lag = registry.gauge(
+    "kubeflow_manager_webhook_lag_events", "webhook 尚未投递的事件数")
+
+
+def _matches(event_type: str, types: Optional[Set[str]]) -> bool:
+    """types 中的 "user" 匹配 user.create、user.delete 等"""
+    return not types or event_type in types or event_type.split(".", 1)[0] in types
+
+
+class EventFeed:
+    """
+    变更事件流
+    
+    修改接口（经由 audit_log.change）和 Profile watch 产生的事件按序号追加到有界的内存环形缓冲区，
+    /api/events 以 SSE 推送，webhook 由后台线程批量投递。事件 id 为 "进程标识-序号"，
+    作为续传令牌（Last-Event-ID）使用；令牌对应的事件已被覆盖或来自重启前的进程时，先推送 reset 事件，
+    消费方应通过查询接口重新同步。
+    """
+    
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._events: Deque[Dict[str, Any]] = deque()
+        self._seq = 0
+        self._waiters: Set[Tuple[asyncio.AbstractEventLoop, asyncio.Event]] = set()
+        self._webhooks: Dict[str, "WebhookDelivery"] = {}
+        self._started = False
+        self.epoch = uuid.uuid4().hex[:8]
+    
+    # ---------- 发布 ----------
+    
+    def publish(self, event_type: str, cluster: str, name: str, data: Dict[str, Any], source: str = "api") -> None:
+        if not settings.events_enabled:
+            return
+        ts = time.time()
+        with self._cond:
+            self._seq += 1
+            self._events.append({
+                "id": f"{self.epoch}-{self._seq}",
+                "seq": self._seq,
+                "type": event_type,
+                "time": datetime.fromtimestamp(ts, timezone.utc).isoformat(),
+                "cluster": cluster,
+                "name": name,
+                "source": source,
+                "data": data,
+            })
+            while len(self._events) > settings.event_buffer_size:
+                self._events.popleft()
+            self._cond.notify_all()
+            waiters = list(self._waiters)
+        events_published.inc(type=event_type)
+        for loop, wakeup in waiters:
+            try:
+                loop.call_soon_threadsafe(wakeup.set)
+            except RuntimeError:
+                # 事件循环已关闭
+                pass
+    
+    def on_change(self, change: Dict[str, Any]) -> None:
+        """audit_log 的变更监听：kind.action 作为事件类型（如 user.create、project.update）"""
+        data = {key: value for key, value in change.items() if key not in ("kind", "name", "action", "cluster")}
+        self.publish(f"{change['kind']}.{change['action']}", change["cluster"], change["name"], data)
+    
+    def attach(self, informer: Informer, cluster: str) -> None:
+        """
+        订阅 Profile watch：集群外部（kubectl、其他控制器）的创建、删除和 spec 变化同样产生事件
+        首次同步时的全量 ADDED 和只有 status 变化的 MODIFIED 不产生事件
+        """
+        replaying = threading.get_ident()
+        
+        def on_profile(event_type: str, obj: Optional[Dict[str, Any]], old: Optional[Dict[str, Any]]) -> None:
+            # add_handler 在当前线程补发已有对象的 ADDED，不是变更
+            if not informer.synced.is_set() or threading.get_ident() == replaying:
+                return
+            profile = obj or old
+            spec = profile.get("spec") or {}
+            if event_type == "MODIFIED" and old is not None and old.get("spec") == spec:
+                return
+            self.publish(f"profile.{event_type.lower()}", cluster, profile["metadata"]["name"], {
+                "owner": (spec.get("owner") or {}).get("name"),
+                "hard": (spec.get("resourceQuotaSpec") or {}).get("hard") or {},
+            }, source="watch")
+        
+        informer.add_handler(on_profile)
+        replaying = None
+    
+    # ---------- 读取 ----------
+    
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+    
+    def parse_token(self, token: Optional[str]) -> int:
+        """
+        续传令牌转换为序号：None 表示只接收之后的新事件；
+        其他进程（重启前）的令牌或格式错误的令牌返回 -1，从缓冲区最早的事件开始并推送 reset
+        """
+        if not token:
+            return self.last_seq
+        epoch, _, seq = token.rpartition("-")
+        if epoch != self.epoch or not seq.isdigit():
+            return -1
+        return min(int(seq), self._seq)
+    
+    def read(self, after: int, limit: int) -> Tuple[List[Dict[str, Any]], bool]:
+        """序号 after 之后的事件（最多 limit 个）；第二个返回值表示中间是否有事件已被覆盖"""
+        with self._cond:
+            return self._read(after, limit)
+    
+    def _read(self, after: int, limit: int) -> Tuple[List[Dict[str, Any]], bool]:
+        oldest = self._events[0]["seq"] if self._events else self._seq + 1
+        missed = after < 0 or after + 1 < oldest
+        start = max(0, after + 1 - oldest)
+        return list(islice(self._events, start, start + limit)), missed
+    
+    def collect(self, after: int, limit: int, linger: float, timeout: float) -> Tuple[List[Dict[str, Any]], bool]:
+        """
+        等待 after 之后的事件（最多 timeout 秒），有事件后再最多等待 linger 秒凑满一批
+        供 webhook 线程批量投递
+        """
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            while self._seq <= after:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    return [], False
+                self._cond.wait(remaining)
+            linger_deadline = time.monotonic() + linger
+            while self._seq - after < limit:
+                remaining = linger_deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._read(after, limit)
+    
+    async def stream(self, after: int, types: Optional[Set[str]] = None, keepalive: float = 15.0) -> AsyncIterator[str]:
+        """
+        以 SSE 格式持续输出事件（在事件循环中等待，不占用线程池）
+        长时间无事件时输出注释行保持连接
+        """
+        wakeup = asyncio.Event()
+        waiter = (asyncio.get_running_loop(), wakeup)
+        with self._cond:
+            self._waiters.add(waiter)
+        try:
+            seq = after
+            while True:
+                wakeup.clear()
+                events, missed = self.read(seq, 500)
+                if missed:
+                    oldest = events[0]["seq"] if events else self._seq + 1
+                    yield f"event: reset\ndata: {orjson.dumps({'oldest': oldest, 'epoch': self.epoch}).decode()}\n\n"
+                for event in events:
+                    seq = event["seq"]
+                    if _matches(event["type"], types):
+                        yield f"id: {event['id']}\nevent: {event['type']}\ndata: {orjson.dumps(event).decode()}\n\n"
+                if missed and not events:
+                    seq = self._seq
+                if events:
+                    continue
+                try:
+                    await asyncio.wait_for(wakeup.wait(), keepalive)
+                except asyncio.TimeoutError:
+                    yield ": keep-alive\n\n"
+        finally:
+            with self._cond:
+                self._waiters.discard(waiter)
+    
+    # ---------- 生命周期 ----------
+    
+    def start(self) -> None:
+        """订阅修改接口和各集群的 Profile watch，启动 webhook 投递线程"""
+        from audit import audit_log
+        
+        if self._started:
+            return
+        self._started = True
+        audit_log.add_listener(self.on_change)
+        if settings.event_watch_profiles:
+            for name in cluster_registry.names():
+                informer = cluster_registry.client(name).profile_informer
+                self.attach(informer, name)
+                informer.start()
+        for name, url in settings.event_webhooks.items():
+            self._webhooks[name] = WebhookDelivery(self, name, url)
+            self._webhooks[name].start()
+    
+    def stop(self) -> None:
+        for webhook in self._webhooks.values():
+            webhook.stop()
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            seq = self._seq
+            buffered = len(self._events)
+            oldest = self._events[0]["seq"] if self._events else None
+            subscribers = len(self._waiters)
+        return {
+            "epoch": self.epoch,
+            "last_seq": seq,
+            "buffered": buffered,
+            "oldest_seq": oldest,
+            "subscribers": subscribers,
+            "webhooks": {name: webhook.stats(seq) for name, webhook in self._webhooks.items()},
+        }
+
+
+class WebhookDelivery:
+    """
+    单个 webhook 的投递线程
+    
+    从事件流按批读取事件（最多 event_webhook_batch_size 个，凑批最多等待 event_webhook_linger 秒），
+    gzip 压缩后 POST；网络错误、408、429 和 5xx 按指数退避重试，最多 event_webhook_max_attempts 次，
+    其他 4xx 或重试耗尽时丢弃该批并计数。同一 webhook 的批次按顺序投递，投递成功后才读取下一批。
+    """
+    
+    def __init__(self, feed: EventFeed, name: str, url: str):
+        self._feed = feed
+        self.name = name
+        self.url = url
+        self.cursor = feed.last_seq
+        self.delivered = 0
+        self.dropped = 0
+        self.last_error: Optional[str] = None
+        self.last_delivery_at: Optional[float] = None
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._http = urllib3.PoolManager(retries=False)
+    
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name=f"webhook-{self.name}", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        self._stop.set()
+    
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            events, missed = self._feed.collect(
+                self.cursor, settings.event_webhook_batch_size, settings.event_webhook_linger, timeout=1.0)
+            if missed:
+                lost = (events[0]["seq"] if events else self._feed.last_seq + 1) - self.cursor - 1
+                self._drop(lost, "投递落后，部分事件已被缓冲区覆盖")
+                if not events:
+                    self.cursor = self._feed.last_seq
+            if not events:
+                continue
+            if not self._deliver(events):
+                self._drop(len(events), self.last_error)
+            self.cursor = events[-1]["seq"]
+            webhook_lag.set(self._feed.last_seq - self.cursor, webhook=self.name)
+    
+    def _drop(self, count: int, reason: Optional[str]) -> None:
+        self.dropped += count
+        webhook_events_dropped.inc(count, webhook=self.name)
+        print(f"警告：webhook {self.name} 丢弃 {count} 个事件: {reason}")
+    
+    def _deliver(self, events: List[Dict[str, Any]]) -> bool:
+        body = gzip.compress(orjson.dumps({"webhook": self.name, "events": events}), compresslevel=6)
+        headers = {
+            "Content-Type": "application/json",
+            "Content-Encoding": "gzip",
+            "X-Event-Count": str(len(events)),
+            "X-Event-Last-Id": events[-1]["id"],
+        }
+        if settings.event_webhook_secret:
+            digest = hmac.new(settings.event_webhook_secret.encode(), body, hashlib.sha256).hexdigest()
+            headers["X-Signature-256"] = f"sha256={digest}"
+        
+        for attempt in range(settings.event_webhook_max_attempts):
+            if attempt:
+                # 指数退避：1、2、4… 秒，最长 60 秒；停止时不再重试
+                if self._stop.wait(min(2 ** (attempt - 1), 60)):
+                    return False
+            try:
+                response = self._http.request(
+                    "POST", self.url, body=body, headers=headers, timeout=settings.event_webhook_timeout)
+            except Exception as e:
+                self.last_error = str(e)
+                webhook_deliveries.inc(webhook=self.name, result="retry")
+                continue
+            if 200 <= response.status < 300:
+                self.delivered += len(events)
+                self.last_delivery_at = time.time()
+                self.last_error = None
+                webhook_deliveries.inc(webhook=self.name, result="success")
+                return True
+            self.last_error = f"HTTP {response.status}"
+            if response.status not in (408, 429) and response.status < 500:
+                break
+            webhook_deliveries.inc(webhook=self.name, result="retry")
+        webhook_deliveries.inc(webhook=self.name, result="failed")
+        return False
+    
+    def stats(self, last_seq: int) -> Dict[str, Any]:
+        return {
+            "url": self.url,
+            "lag": last_seq - self.cursor,
+            "delivered": self.delivered,
+            "dropped": self.dropped,
+            "last_delivery_at": self.last_delivery_at,
+            "last_error": self.last_error,
+        }
+
+
+event_feed = EventFeed()
@@ -0,0 +1,197 @@
+import fnmatch
+import math
+import random
+import threading
+import time
+from collections import Counter
+from typing import Any, Callable, Dict, List, Optional
+
+from kubernetes.client.rest import ApiException
+from urllib3.exceptions import ReadTimeoutError
+
+from metrics import registry
+
+
+faults_injected = registry.counter(
+    "kubeflow_manager_faults_injected_total", "注入的故障次数（fault=latency/状态码/timeout/watch_stall）")
+
+# 标准正态分布的 99 分位，用于由中位数和 p99 推出对数正态分布的参数
+_Z99 = 2.3263
+
+_FIELDS = {
+    "clusters", "latency", "error_rate", "errors", "timeout_seconds", "watch_stall_rate", "watch_stall_seconds",
+}
+
+_REASONS = {409: "Conflict", 429: "Too Many Requests", 500: "Internal Server Error", 503: "Service Unavailable"}
+
+
+def _number(pattern: str, field: str, value: Any, upper: Optional[float] = None) -> float:
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or value < 0 or (upper is not None and value > upper):
+        bound = f"0~{upper}" if upper is not None else "非负数"
+        raise ValueError(f"故障规则 {pattern} 的 {field} 必须是 {bound}: {value!r}")
+    return float(value)
+
+
+def _latency_sampler(pattern: str, spec: Any) -> Optional[Callable[[random.Random], float]]:
+    """
+    延迟分布，返回按分布抽取延迟（秒）的函数：
+    - {"fixed_ms": 100}
+    - {"distribution": "uniform", "min_ms": 10, "max_ms": 200}
+    - {"distribution": "exponential", "mean_ms": 50}
+    - {"distribution": "lognormal", "median_ms": 30, "p99_ms": 800}（长尾，最接近真实 API Server）
+    """
+    if spec is None:
+        return None
+    if not isinstance(spec, dict):
+        raise ValueError(f"故障规则 {pattern} 的 latency 必须是字典")
+    
+    def field(name: str) -> float:
+        return _number(pattern, f"latency.{name}", spec.get(name)) / 1000
+    
+    distribution = spec.get("distribution", "fixed")
+    if distribution == "fixed":
+        fixed = field("fixed_ms")
+        return lambda rng: fixed
+    if distribution == "uniform":
+        low, high = field("min_ms"), field("max_ms")
+        if high < low:
+            raise ValueError(f"故障规则 {pattern} 的 latency.max_ms 不能小于 min_ms")
+        return lambda rng: rng.uniform(low, high)
+    if distribution == "exponential":
+        mean = field("mean_ms")
+        return lambda rng: rng.expovariate(1 / mean) if mean else 0.0
+    if distribution == "lognormal":
+        median, p99 = field("median_ms"), field("p99_ms")
+        if median <= 0 or p99 < median:
+            raise ValueError(f"故障规则 {pattern} 的 latency 需要 0 < median_ms <= p99_ms")
+        mu, sigma = math.log(median), math.log(p99 / median) / _Z99
+        return lambda rng: rng.lognormvariate(mu, sigma)
+    raise ValueError(f"故障规则 {pattern} 的 latency.distribution 只能是 fixed/uniform/exponential/lognormal: {distribution}")
+
+
+class FaultRule:
+    """
+    一条故障规则：匹配 "API 组.方法名"（fnmatch 通配，如 "kubeflow.org.*"、"*.list_*"）的调用
+    
+    - latency: 每次调用前增加的延迟分布
+    - error_rate / errors: 以 error_rate 的概率失败，失败类型按 errors 中的权重抽取：
+      状态码（如 "409"、"429"、"500"）抛出 ApiException，"timeout" 等待 timeout_seconds 后抛出读超时
+    - watch_stall_rate / watch_stall_seconds: watch 请求以该概率卡住 watch_stall_seconds 秒（期间收不到任何事件），然后读超时断开
+    - clusters: 只对这些集群生效（默认全部）
+    """
+    
+    def __init__(self, pattern: str, spec: Any):
+        if not isinstance(spec, dict):
+            raise ValueError(f"故障规则 {pattern} 必须是字典")
+        unknown = set(spec) - _FIELDS
+        if unknown:
+            raise ValueError(f"故障规则 {pattern} 中有未知字段: {', '.join(sorted(unknown))}")
+        self.pattern = pattern
+        self.spec = spec
+        self.clusters = set(spec.get("clusters") or ())
+        self.latency = _latency_sampler(pattern, spec.get("latency"))
+        self.error_rate = _number(pattern, "error_rate", spec.get("error_rate", 0), 1)
+        self.errors: List[str] = []
+        self.weights: List[float] = []
+        for kind, weight in (spec.get("errors") or {"500": 1}).items():
+            kind = str(kind)
+            if kind != "timeout" and not (kind.isdigit() and 400 <= int(kind) < 600):
+                raise ValueError(f"故障规则 {pattern} 的 errors 只能是 4xx/5xx 状态码或 timeout: {kind}")
+            self.errors.append(kind)
+            self.weights.append(_number(pattern, f"errors.{kind}", weight))
+        if self.error_rate and not sum(self.weights):
+            raise ValueError(f"故障规则 {pattern} 的 errors 权重之和必须大于 0")
+        self.timeout_seconds = _number(pattern, "timeout_seconds", spec.get("timeout_seconds", 5.0))
+        self.watch_stall_rate = _number(pattern, "watch_stall_rate", spec.get("watch_stall_rate", 0), 1)
+        self.watch_stall_seconds = _number(pattern, "watch_stall_seconds", spec.get("watch_stall_seconds", 60))
+    
+    def matches(self, cluster: str, method: str) -> bool:
+        return (not self.clusters or cluster in self.clusters) and fnmatch.fnmatchcase(method, self.pattern)
+
+
+def parse_fault_rules(rules: Dict[str, Any]) -> List[FaultRule]:
+    """解析 {方法通配: 规则} 配置，非法规则抛出 ValueError"""
+    if not isinstance(rules, dict):
+        raise ValueError("fault_injection 必须是 {方法通配: 规则} 字典")
+    return [FaultRule(pattern, spec) for pattern, spec in rules.items()]
+
+
+class FaultInjector:
+    """
+    Kubernetes 调用的故障注入（仅用于测试，复现缓慢或不稳定的 API Server）
+    
+    由 resilient 在每次尝试前调用，注入的错误与真实错误一样经过重试和熔断，可用于调整超时、
+    重试和批量参数。规则来自 settings.fault_injection，或通过管理接口临时覆盖；
+    按配置顺序取第一个匹配的规则。未配置规则时只有一次列表判断，没有额外开销。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._rng = random.Random()
+        self._override: Optional[List[FaultRule]] = None
+        self.injected: Counter = Counter()
+    
+    def configure(self, rules: Optional[Dict[str, Any]], seed: Optional[int] = None) -> None:
+        """覆盖配置中的规则（rules 为 None 时恢复使用配置）；指定 seed 时故障序列可重现"""
+        parsed = parse_fault_rules(rules) if rules is not None else None
+        with self._lock:
+            self._override = parsed
+            self._rng = random.Random(seed)
+            self.injected = Counter()
+    
+    def active_rules(self) -> List[FaultRule]:
+        if self._override is not None:
+            return self._override
+        # config 在加载时依赖本模块校验规则，这里延迟导入
+        from config import settings
+        return settings.fault_rules()
+    
+    def inject(self, cluster: str, method: str, watch: bool = False) -> None:
+        """按匹配的规则等待和/或抛出异常；没有匹配的规则时直接返回"""
+        rules = self.active_rules()
+        if not rules:
+            return
+        rule = next((rule for rule in rules if rule.matches(cluster, method)), None)
+        if rule is None:
+            return
+        with self._lock:
+            rng = self._rng
+            delay = rule.latency(rng) if rule.latency else 0.0
+            stalled = watch and rng.random() < rule.watch_stall_rate
+            error = rng.choices(rule.errors, rule.weights)[0] if rng.random() < rule.error_rate else None
+        
+        if delay:
+            self._record(cluster, method, "latency")
+            time.sleep(delay)
+        if stalled:
+            self._record(cluster, method, "watch_stall")
+            time.sleep(rule.watch_stall_seconds)
+            raise ReadTimeoutError(None, method, f"注入的故障：watch 卡住 {rule.watch_stall_seconds:g} 秒")
+        if error is None:
+            return
+        self._record(cluster, method, error)
+        if error == "timeout":
+            time.sleep(rule.timeout_seconds)
+            raise ReadTimeoutError(None, method, f"注入的故障：读超时（{rule.timeout_seconds:g} 秒）")
+        status = int(error)
+        raise ApiException(status=status, reason=f"{_REASONS.get(status, 'Injected')}（注入的故障）")
+    
+    def _record(self, cluster: str, method: str, fault: str) -> None:
+        faults_injected.inc(cluster=cluster, method=method, fault=fault)
+        with self._lock:
+            self.injected[(cluster, method, fault)] += 1
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            injected = dict(self.injected)
+        summary: Dict[str, Dict[str, Dict[str, int]]] = {}
+        for (cluster, method, fault), count in sorted(injected.items()):
+            summary.setdefault(cluster, {}).setdefault(method, {})[fault] = count
+        return {
+            "source": "api" if self._override is not None else "settings",
+            "rules": {rule.pattern: rule.spec for rule in self.active_rules()},
+            "injected": summary,
+        }
+
+
+fault_injector = FaultInjector()
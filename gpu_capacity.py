@@ -0,0 +1,258 @@
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import lru_cache
+from typing import Any, Dict, Iterator, List, Optional
+
+from config import settings
+from k8s_client import cluster_registry, current_cluster
+from quantity import parse_quantity
+
+
+# GPU 键识别模式（ProjectService 的 GPU 置零逻辑同样使用 is_gpu_key）
+GPU_PATTERNS = ('nvidia.com', 'amd.com/gpu', 'gpu')
+
+
+@lru_cache(maxsize=1024)
+def is_gpu_key(key: str) -> bool:
+    """判断资源键是否为 GPU 资源（资源键种类有限，结果缓存）"""
+    key = key.lower()
+    return any(pattern in key for pattern in GPU_PATTERNS)
+
+
+def quota_key_to_resource(key: str) -> Optional[str]:
+    """
+    将 ResourceQuota 键映射为 Node 上的扩展资源名
+    例如 requests.nvidia.com/l4 -> nvidia.com/l4；limits.* 不参与统计
+    """
+    if key.startswith("limits."):
+        return None
+    if key.startswith("requests."):
+        key = key[len("requests."):]
+    return key if is_gpu_key(key) else None
+
+
+def parse_gpu_count(value: Any) -> int:
+    """解析 GPU 数量，非法值抛出 ValueError"""
+    try:
+        return int(parse_quantity(str(value)))
+    except Exception:
+        raise ValueError(f"无效的 GPU 数量: {value}")
+
+
+class GpuCapacityIndex:
+    """
+    单个集群的 GPU 容量索引
+    
+    从 Node allocatable 汇总集群各类 GPU 的容量，从 Profile 汇总已分配的 GPU 配额，
+    两者都由 informer 事件增量维护，因此每次配额校验只需按资源键做 O(1) 的查表。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._node_gpus: Dict[str, Dict[str, int]] = {}
+        self._profile_gpus: Dict[str, Dict[str, int]] = {}
+        self._capacity: Dict[str, int] = defaultdict(int)
+        self._committed: Dict[str, int] = defaultdict(int)
+        self._node_informer = None
+        self._profile_informer = None
+    
+    # ---------- 事件处理 ----------
+    
+    @staticmethod
+    def _node_counts(node: Dict[str, Any]) -> Dict[str, int]:
+        allocatable = (node.get("status") or {}).get("allocatable") or {}
+        counts = {}
+        for key, value in allocatable.items():
+            if is_gpu_key(key):
+                try:
+                    counts[key] = parse_gpu_count(value)
+                except ValueError:
+                    continue
+        return counts
+    
+    @staticmethod
+    def _quota_counts(hard: Dict[str, Any]) -> Dict[str, int]:
+        counts: Dict[str, int] = {}
+        for key, value in (hard or {}).items():
+            resource = quota_key_to_resource(key)
+            if resource is None:
+                continue
+            try:
+                counts[resource] = counts.get(resource, 0) + parse_gpu_count(value)
+            except ValueError:
+                continue
+        return counts
+    
+    @staticmethod
+    def _apply_delta(totals: Dict[str, int], old: Dict[str, int], new: Dict[str, int]) -> None:
+        for key, value in old.items():
+            totals[key] -= value
+        for key, value in new.items():
+            totals[key] += value
+    
+    def on_node_event(self, event_type: str, node: Optional[Dict[str, Any]], old: Optional[Dict[str, Any]]) -> None:
+        name = (node or old)["metadata"]["name"]
+        new_counts = {} if event_type == "DELETED" else self._node_counts(node)
+        with self._lock:
+            old_counts = self._node_gpus.pop(name, {})
+            if new_counts:
+                self._node_gpus[name] = new_counts
+            self._apply_delta(self._capacity, old_counts, new_counts)
+    
+    def on_profile_event(self, event_type: str, profile: Optional[Dict[str, Any]], old: Optional[Dict[str, Any]]) -> None:
+        name = (profile or old)["metadata"]["name"]
+        if event_type == "DELETED":
+            self.record_profile(name, None)
+        else:
+            hard = (profile.get("spec") or {}).get("resourceQuotaSpec", {}).get("hard", {})
+            self.record_profile(name, hard)
+    
+    def record_profile(self, profile_name: str, hard: Optional[Dict[str, Any]]) -> None:
+        """
+        记录 Profile 的 GPU 配额（hard 为 None 表示删除）
+        写入成功后立即调用，避免 watch 事件到达前的并发请求超额
+        """
+        new_counts = self._quota_counts(hard) if hard is not None else {}
+        with self._lock:
+            self._swap(profile_name, new_counts)
+    
+    def _swap(self, profile_name: str, new_counts: Dict[str, int]) -> Dict[str, int]:
+        """替换 Profile 的 GPU 配额记录并返回原记录（调用方持有锁）"""
+        old_counts = self._profile_gpus.pop(profile_name, {})
+        if new_counts:
+            self._profile_gpus[profile_name] = new_counts
+        self._apply_delta(self._committed, old_counts, new_counts)
+        return old_counts
+    
+    def attach(self, node_informer, profile_informer) -> None:
+        """注册到 informer 并记录同步状态"""
+        node_informer.add_handler(self.on_node_event)
+        profile_informer.add_handler(self.on_profile_event)
+        self._node_informer = node_informer
+        self._profile_informer = profile_informer
+    
+    @property
+    def ready(self) -> bool:
+        # informer 定义了 __len__，空的 informer 为假值，必须与 None 比较
+        return (
+            self._node_informer is not None and self._profile_informer is not None
+            and self._node_informer.synced.is_set()
+            and self._profile_informer.synced.is_set()
+        )
+    
+    # ---------- 校验 ----------
+    
+    @staticmethod
+    def overcommit_ratio(resource: str) -> float:
+        """获取资源的超售比例，支持以 Node 资源名或配额键配置"""
+        ratios = settings.gpu_overcommit_ratios or {}
+        for key in (resource, f"requests.{resource}"):
+            if key in ratios:
+                return float(ratios[key])
+        return float(settings.gpu_overcommit_default_ratio)
+    
+    def _problems(self, profile_name: str, requested: Dict[str, int]) -> List[str]:
+        """Profile 的 GPU 配额改为 requested 后超出允许上限的资源（调用方持有锁）"""
+        problems = []
+        current = self._profile_gpus.get(profile_name, {})
+        for resource, count in requested.items():
+            if count <= 0:
+                continue
+            capacity = self._capacity.get(resource, 0)
+            allowed = int(capacity * self.overcommit_ratio(resource))
+            committed = self._committed.get(resource, 0) - current.get(resource, 0) + count
+            if committed > allowed:
+                problems.append(
+                    f"{resource} 配额超出集群容量：分配后合计 {committed}，"
+                    f"集群容量 {capacity}，允许上限 {allowed}"
+                )
+        return problems
+    
+    @contextmanager
+    def reserve(self, profile_name: str, hard: Dict[str, Any], check: bool = True) -> Iterator[List[str]]:
+        """
+        校验并预占 Profile 新的 GPU 配额，在 with 块内写入 Profile，产出警告列表
+        
+        校验与预占在同一把锁内完成，并发的创建或修改不会同时通过同一份剩余容量；
+        gpu_capacity_mode 为 reject 时超额直接抛出 ValueError。块内抛出异常（写入失败）时撤销预占。
+        check 为 False 时只预占不校验（按导出数据恢复项目）。
+        """
+        mode = settings.gpu_capacity_mode
+        requested = self._quota_counts(hard)
+        warnings: List[str] = []
+        check = check and mode != "off" and bool(requested)
+        if check and not self.ready:
+            warnings.append("GPU 容量索引尚未同步，跳过容量校验")
+            check = False
+        
+        with self._lock:
+            if check:
+                warnings = self._problems(profile_name, requested)
+                if warnings and mode == "reject":
+                    raise ValueError("；".join(warnings))
+            previous = self._swap(profile_name, requested)
+        try:
+            yield warnings
+        except BaseException:
+            with self._lock:
+                # 期间 watch 事件已写入实际配额时不再撤销
+                if self._profile_gpus.get(profile_name, {}) == requested:
+                    self._swap(profile_name, previous)
+            raise
+    
+    def summary(self) -> Dict[str, Dict[str, Any]]:
+        """各 GPU 资源的容量与分配情况"""
+        with self._lock:
+            resources = set(self._capacity) | set(self._committed)
+            result = {}
+            for resource in sorted(resources):
+                capacity = self._capacity.get(resource, 0)
+                ratio = self.overcommit_ratio(resource)
+                allowed = int(capacity * ratio)
+                committed = self._committed.get(resource, 0)
+                result[resource] = {
+                    "capacity": capacity,
+                    "committed": committed,
+                    "overcommit_ratio": ratio,
+                    "allowed": allowed,
+                    "available": allowed - committed,
+                }
+        return result
+
+
+class GpuCapacityRegistry:
+    """
+    按集群管理 GPU 容量索引
+    
+    首次使用时创建；gpu_capacity_mode 不为 off 时注册到该集群的 Node/Profile informer 并启动 informer，
+    各集群的容量和已分配配额互不影响。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, GpuCapacityIndex] = {}
+    
+    def get(self, cluster: Optional[str] = None) -> GpuCapacityIndex:
+        """返回集群（默认为当前集群）的索引"""
+        name = cluster_registry.validate(cluster or current_cluster.get())
+        with self._lock:
+            index = self._indexes.get(name)
+            if index is None:
+                index = self._indexes[name] = GpuCapacityIndex()
+            attach = settings.gpu_capacity_mode != "off" and index._node_informer is None
+            if attach:
+                kube_client = cluster_registry.client(name)
+                index.attach(kube_client.node_informer, kube_client.profile_informer)
+        if attach:
+            kube_client.node_informer.start()
+            kube_client.profile_informer.start()
+        return index
+    
+    def loaded(self) -> Dict[str, GpuCapacityIndex]:
+        """已创建的索引"""
+        with self._lock:
+            return dict(self._indexes)
+
+
+gpu_capacity_indexes = GpuCapacityRegistry()
@@ -0,0 +1,220 @@
+import asyncio
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.encoders import jsonable_encoder
+from starlette.concurrency import run_in_threadpool
+
+from config import settings
+from k8s_client import current_cluster
+from responses import FastJSONResponse
+
+
+# 缓存的响应：(fingerprint, status_code, body)
+CachedResponse = Tuple[str, int, Any]
+
+# 不缓存的 4xx：超时和限流是暂时性的，客户端应当可以用同一个键重试
+UNCACHED_STATUSES = {408, 429}
+
+
+class MemoryBackend:
+    """进程内 LRU + TTL 缓存"""
+    
+    def __init__(self, max_entries: int, ttl: int):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, Tuple[float, CachedResponse]]" = OrderedDict()
+    
+    def get(self, key: str) -> Optional[CachedResponse]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+    
+    def set(self, key: str, value: CachedResponse) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self._ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+    
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class SqliteBackend:
+    """SQLite 持久化缓存，进程重启后仍可重放（文件中包含响应内容，权限设为 0600）"""
+    
+    def __init__(self, path: str, max_entries: int, ttl: int):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        os.chmod(path, 0o600)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS idempotency ("
+            " key TEXT PRIMARY KEY, fingerprint TEXT, status INTEGER, body TEXT,"
+            " expires_at REAL, used_at REAL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_used_at ON idempotency(used_at)")
+    
+    def get(self, key: str) -> Optional[CachedResponse]:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT fingerprint, status, body, expires_at FROM idempotency WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[3] < now:
+                self._conn.execute("DELETE FROM idempotency WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE idempotency SET used_at = ? WHERE key = ?", (now, key))
+        return row[0], row[1], json.loads(row[2])
+    
+    def set(self, key: str, value: CachedResponse) -> None:
+        now = time.time()
+        fingerprint, status_code, body = value
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO idempotency VALUES (?, ?, ?, ?, ?, ?)",
+                (key, fingerprint, status_code, json.dumps(body, ensure_ascii=False), now + self._ttl, now)
+            )
+            self._conn.execute("DELETE FROM idempotency WHERE expires_at < ?", (now,))
+            self._conn.execute(
+                "DELETE FROM idempotency WHERE key IN ("
+                " SELECT key FROM idempotency ORDER BY used_at DESC LIMIT -1 OFFSET ?)",
+                (self._max_entries,)
+            )
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM idempotency").fetchone()[0]
+
+
+class IdempotencyManager:
+    """
+    Idempotency-Key 支持
+    
+    同一个键的请求只执行一次：结果（2xx/4xx）写入缓存，重放时直接返回原响应，
+    不再访问 Kubernetes 或重新哈希密码；执行中的重复请求等待第一个请求的结果。
+    5xx、408、429 不缓存，客户端可以用同一个键重试。
+    """
+    
+    def __init__(self):
+        self._backend = None
+        self._inflight: Dict[str, asyncio.Future] = {}
+    
+    @property
+    def backend(self):
+        if self._backend is None:
+            if settings.idempotency_backend == "sqlite":
+                self._backend = SqliteBackend(
+                    settings.idempotency_sqlite_path,
+                    settings.idempotency_max_entries,
+                    settings.idempotency_ttl_seconds
+                )
+            else:
+                self._backend = MemoryBackend(settings.idempotency_max_entries, settings.idempotency_ttl_seconds)
+        return self._backend
+    
+    @staticmethod
+    def _fingerprint(payload: Any) -> str:
+        data = json.dumps(jsonable_encoder(payload), sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(data.encode()).hexdigest()
+    
+    @staticmethod
+    def _replay(cached: CachedResponse) -> FastJSONResponse:
+        _, status_code, body = cached
+        if status_code >= 400:
+            raise HTTPException(status_code=status_code, detail=body, headers={"Idempotent-Replayed": "true"})
+        return FastJSONResponse(content=body, status_code=status_code, headers={"Idempotent-Replayed": "true"})
+    
+    async def run(
+        self,
+        scope: str,
+        key: Optional[str],
+        payload: Any,
+        func: Callable[[], Any],
+        status_code: int = status.HTTP_200_OK
+    ) -> FastJSONResponse:
+        """
+        在线程池中执行 func；提供 key 时按 (集群, scope, key) 去重
+        func 返回响应模型，或抛出 HTTPException
+        """
+        if not key:
+            return FastJSONResponse(await run_in_threadpool(func), status_code=status_code)
+        
+        cache_key = f"{current_cluster.get() or settings.default_cluster}:{scope}:{key}"
+        fingerprint = self._fingerprint(payload)
+        
+        while True:
+            cached = self.backend.get(cache_key)
+            if cached is not None:
+                if cached[0] != fingerprint:
+                    raise HTTPException(
+                        status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+                        detail="Idempotency-Key 已被用于不同的请求内容"
+                    )
+                return self._replay(cached)
+            
+            pending = self._inflight.get(cache_key)
+            if pending is None:
+                break
+            # 等待正在执行的同键请求，然后重新检查缓存
+            try:
+                await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if not pending.cancelled():
+                    # 被取消的是当前请求本身
+                    raise
+                # 第一个请求被取消（如客户端断开）且未缓存结果：重新检查缓存，必要时由当前请求执行
+                continue
+            except Exception:
+                pass
+            if cache_key not in self._inflight and self.backend.get(cache_key) is None:
+                # 第一个请求失败（5xx）且未缓存：把同样的结果返回给等待者
+                return FastJSONResponse(await pending, status_code=status_code)
+        
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            result = await run_in_threadpool(func)
+            body = result.model_dump(mode="json")
+            self.backend.set(cache_key, (fingerprint, status_code, body))
+            future.set_result(body)
+            return FastJSONResponse(body, status_code=status_code)
+        except HTTPException as e:
+            if e.status_code < 500 and e.status_code not in UNCACHED_STATUSES:
+                self.backend.set(cache_key, (fingerprint, e.status_code, e.detail))
+            future.set_exception(e)
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._inflight.pop(cache_key, None)
+            # 请求被取消（CancelledError 不经过上面的分支）时取消 future，唤醒等待者重新执行
+            if not future.done():
+                future.cancel()
+            # 没有等待者时避免 "exception was never retrieved" 警告
+            if future.done() and not future.cancelled():
+                future.exception()
+
+
+idempotency = IdempotencyManager()
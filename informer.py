@@ -0,0 +1,239 @@
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import orjson
+from kubernetes import watch
+from kubernetes.client.rest import ApiException
+
+
+Handler = Callable[[str, Optional[Dict[str, Any]], Optional[Dict[str, Any]]], None]
+
+
+def object_name(obj: Dict[str, Any]) -> str:
+    """默认缓存键：metadata.name"""
+    return obj["metadata"]["name"]
+
+
+class Informer:
+    """
+    基于 list+watch 的资源缓存
+    
+    首次启动时分页 list 全量对象，之后从 list 返回的 resourceVersion 开始 watch，
+    收到 410 Gone 时重新 list。缓存中保存原始 dict（camelCase 字段），
+    可通过 transform 只保留需要的字段以减少内存。
+    """
+    
+    def __init__(
+        self,
+        name: str,
+        list_func: Callable[..., Any],
+        transform: Optional[Callable[[Dict[str, Any]], Dict[str, Any]]] = None,
+        key_func: Callable[[Dict[str, Any]], str] = object_name,
+        watch_timeout: int = 300,
+        page_size: int = 500,
+    ):
+        self.name = name
+        self._list_func = list_func
+        self._transform = transform
+        self._key_func = key_func
+        self._watch_timeout = watch_timeout
+        self._page_size = page_size
+        
+        self._lock = threading.RLock()
+        self._store: Dict[str, Dict[str, Any]] = {}
+        self._handlers: List[Handler] = []
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        
+        self.resource_version: Optional[str] = None
+        self.synced = threading.Event()
+        self.last_event_at: Optional[float] = None
+        # 最近一次收到 API Server 响应（list、事件、BOOKMARK 或 watch 正常结束）的时间，用于判断缓存是否过期
+        self.last_contact_at: Optional[float] = None
+        self.restored_from_snapshot = False
+    
+    # ---------- 读取 ----------
+    
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """按键读取缓存对象"""
+        with self._lock:
+            return self._store.get(key)
+    
+    def items(self) -> List[Dict[str, Any]]:
+        """返回缓存对象列表（浅拷贝）"""
+        with self._lock:
+            return list(self._store.values())
+    
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._store)
+    
+    def add_handler(self, handler: Handler) -> None:
+        """
+        注册事件回调：handler(event_type, new_obj, old_obj)
+        event_type 为 ADDED / MODIFIED / DELETED
+        """
+        with self._lock:
+            self._handlers.append(handler)
+            # 已同步的对象补发 ADDED，保证后注册的回调状态完整
+            existing = list(self._store.values())
+        for obj in existing:
+            handler("ADDED", obj, None)
+    
+    # ---------- 快照 ----------
+    
+    def dump(self) -> Optional[Dict[str, Any]]:
+        """导出缓存对象和 resourceVersion，未同步时返回 None"""
+        with self._lock:
+            if not self.synced.is_set() or self.resource_version is None:
+                return None
+            return {"resource_version": self.resource_version, "items": list(self._store.values())}
+    
+    def restore(self, snapshot: Dict[str, Any], notify: bool = True) -> None:
+        """
+        从快照恢复缓存（在 start 之前调用），启动后从快照的 resourceVersion 继续 watch，
+        resourceVersion 已过期（410 Gone）时才重新 list
+        notify 为 False 时不向已注册的回调补发 ADDED（由回调方自行恢复状态）
+        """
+        items = {self._key_func(obj): obj for obj in snapshot["items"]}
+        with self._lock:
+            self._store = items
+            self.resource_version = snapshot["resource_version"]
+            handlers = list(self._handlers) if notify else []
+        for obj in items.values():
+            self._dispatch(handlers, "ADDED", obj, None)
+        self.restored_from_snapshot = True
+        self.synced.set()
+    
+    # ---------- 生命周期 ----------
+    
+    def start(self) -> None:
+        """启动后台 list+watch 线程（重复调用无副作用）"""
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"informer-{self.name}", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        self._stop.set()
+    
+    def wait_for_sync(self, timeout: Optional[float] = None) -> bool:
+        return self.synced.wait(timeout)
+    
+    def status(self) -> Dict[str, Any]:
+        return {
+            "running": bool(self._thread and self._thread.is_alive()),
+            "synced": self.synced.is_set(),
+            "objects": len(self._store),
+            "resource_version": self.resource_version,
+            "last_event_at": self.last_event_at,
+            "last_contact_at": self.last_contact_at,
+        }
+    
+    # ---------- 内部实现 ----------
+    
+    def _run(self) -> None:
+        backoff = 1.0
+        while not self._stop.is_set():
+            try:
+                if self.resource_version is None:
+                    self._relist()
+                self._watch()
+                self.last_contact_at = time.time()
+                backoff = 1.0
+            except ApiException as e:
+                if e.status == 410:
+                    # resourceVersion 过期，重新 list
+                    self.resource_version = None
+                    continue
+                print(f"警告：{self.name} watch 失败: {e.status} {e.reason}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+            except Exception as e:
+                print(f"警告：{self.name} watch 异常: {e}")
+                self._stop.wait(backoff)
+                backoff = min(backoff * 2, 30.0)
+    
+    def _relist(self) -> None:
+        items: Dict[str, Dict[str, Any]] = {}
+        continue_token = None
+        resource_version = None
+        while True:
+            kwargs = {"limit": self._page_size, "_preload_content": False}
+            if continue_token:
+                kwargs["_continue"] = continue_token
+            resp = self._list_func(**kwargs)
+            data = orjson.loads(resp.data)
+            for obj in data.get("items") or []:
+                obj = self._transform(obj) if self._transform else obj
+                items[self._key_func(obj)] = obj
+            metadata = data.get("metadata") or {}
+            resource_version = metadata.get("resourceVersion")
+            continue_token = metadata.get("continue")
+            if not continue_token:
+                break
+        self._replace(items, resource_version)
+    
+    def _replace(self, items: Dict[str, Dict[str, Any]], resource_version: Optional[str]) -> None:
+        """用一次全量结果替换缓存，并向回调补发差异事件"""
+        with self._lock:
+            old_store = self._store
+            self._store = items
+            self.resource_version = resource_version
+            handlers = list(self._handlers)
+        for key, obj in items.items():
+            old = old_store.get(key)
+            if old is None:
+                self._dispatch(handlers, "ADDED", obj, None)
+            elif old != obj:
+                self._dispatch(handlers, "MODIFIED", obj, old)
+        for key, old in old_store.items():
+            if key not in items:
+                self._dispatch(handlers, "DELETED", None, old)
+        self.last_event_at = self.last_contact_at = time.time()
+        self.synced.set()
+    
+    def _watch(self) -> None:
+        w = watch.Watch()
+        stream = w.stream(
+            self._list_func,
+            resource_version=self.resource_version,
+            timeout_seconds=self._watch_timeout,
+            allow_watch_bookmarks=True,
+        )
+        for event in stream:
+            if self._stop.is_set():
+                w.stop()
+                break
+            event_type = event["type"]
+            raw = event["raw_object"]
+            rv = (raw.get("metadata") or {}).get("resourceVersion")
+            if event_type == "BOOKMARK":
+                self.resource_version = rv
+                self.last_contact_at = time.time()
+                continue
+            obj = self._transform(raw) if self._transform else raw
+            key = self._key_func(obj)
+            with self._lock:
+                old = self._store.get(key)
+                if event_type == "DELETED":
+                    self._store.pop(key, None)
+                else:
+                    self._store[key] = obj
+                if rv:
+                    self.resource_version = rv
+                handlers = list(self._handlers)
+            self.last_event_at = self.last_contact_at = time.time()
+            if event_type == "DELETED":
+                self._dispatch(handlers, event_type, None, old)
+            else:
+                self._dispatch(handlers, "ADDED" if old is None else "MODIFIED", obj, old)
+    
+    def _dispatch(self, handlers: List[Handler], event_type: str, obj, old) -> None:
+        for handler in handlers:
+            try:
+                handler(event_type, obj, old)
+            except Exception as e:
+                print(f"警告：{self.name} 事件处理失败: {e}")
@@ -0,0 +1,191 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterator, List, Tuple
+
+import orjson
+
+from config import settings
+from k8s_client import k8s_client, bind_cluster
+from dex_codec import dex_codec
+from user_service import pending_keys, user_service
+from project_service import project_service
+
+
+EXPORT_VERSION = 1
+_MAX_REPORTED_ERRORS = 100
+
+
+def _line(record: Dict[str, Any]) -> bytes:
+    return orjson.dumps(record) + b"\n"
+
+
+def iter_export() -> Iterator[bytes]:
+    """
+    以 NDJSON 流式导出全部 Dex 静态用户和 Profile
+    
+    每行一条记录：
+        {"kind": "Header", "version": 1, "exported_at": ...}
+        {"kind": "User", "email", "username", "hashFromEnv", "hash"}   # hash 为 Secret 中的 base64 值
+        {"kind": "Project", "name", "owner", "resources"}
+    Profile 分页读取，逐页输出，不在内存中构建完整清单。
+    """
+    yield _line({"kind": "Header", "version": EXPORT_VERSION, "exported_at": int(time.time())})
+    
+    configmap = k8s_client.get_configmap(settings.dex_configmap_name, settings.dex_namespace)
+    secret = k8s_client.get_secret(settings.dex_secret_name, settings.dex_namespace)
+    secret_data = (secret.data if secret else None) or {}
+    if configmap:
+        config_data = dex_codec.loads(configmap)
+        for user in config_data.get('staticPasswords') or []:
+            env_key = user.get('hashFromEnv')
+            yield _line({
+                "kind": "User",
+                "email": user.get('email'),
+                "username": user.get('username'),
+                "hashFromEnv": env_key,
+                "hash": secret_data.get(env_key),
+            })
+        del config_data
+    
+    continue_token = None
+    while True:
+        kwargs = {"limit": settings.export_page_size, "_preload_content": False}
+        if continue_token:
+            kwargs["_continue"] = continue_token
+        page = orjson.loads(k8s_client.list_profiles(**kwargs).data)
+        for profile in page.get("items") or []:
+            spec = profile.get("spec") or {}
+            yield _line({
+                "kind": "Project",
+                "name": profile["metadata"]["name"],
+                "owner": (spec.get("owner") or {}).get("name"),
+                "resources": (spec.get("resourceQuotaSpec") or {}).get("hard") or {},
+            })
+        continue_token = (page.get("metadata") or {}).get("continue")
+        if not continue_token:
+            break
+
+
+class InventoryImporter:
+    """
+    NDJSON 导入器
+    
+    逐行接收记录，按 settings.import_batch_size 分批应用：
+    - 用户：每批一次 Secret patch 写入哈希，全部读完后一次 ConfigMap 写入、一次 Dex 重启
+    - 项目：每批并行创建或覆盖配额
+    """
+    
+    def __init__(self):
+        self._buffer = b""
+        self._user_batch: List[Dict[str, str]] = []
+        self._user_entries: List[Dict[str, str]] = []
+        self._project_batch: List[Dict[str, Any]] = []
+        self._pending_keys: List[Tuple[str, str]] = []
+        self.stats = {
+            "lines": 0,
+            "users": {"created": 0, "updated": 0, "unchanged": 0},
+            "projects": {"created": 0, "updated": 0, "unchanged": 0},
+            "errors": [],
+        }
+    
+    def _error(self, message: str) -> None:
+        errors = self.stats["errors"]
+        if len(errors) < _MAX_REPORTED_ERRORS:
+            errors.append(message)
+    
+    def feed(self, chunk: bytes) -> None:
+        """接收一段上传数据，解析其中完整的行"""
+        self._buffer += chunk
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            self._add_line(line)
+    
+    def _add_line(self, line: bytes) -> None:
+        line = line.strip()
+        if not line:
+            return
+        self.stats["lines"] += 1
+        try:
+            record = orjson.loads(line)
+        except ValueError:
+            self._error(f"第 {self.stats['lines']} 行不是合法 JSON")
+            return
+        
+        kind = record.get("kind")
+        if kind == "Header":
+            if record.get("version") != EXPORT_VERSION:
+                raise ValueError(f"不支持的导出版本: {record.get('version')}")
+        elif kind == "User":
+            if not record.get("email") or not record.get("hashFromEnv") or not record.get("hash"):
+                self._error(f"用户记录缺少 email/hashFromEnv/hash: {record.get('email')}")
+                return
+            self._user_batch.append(record)
+            if len(self._user_batch) >= settings.import_batch_size:
+                self._flush_users()
+        elif kind == "Project":
+            if not record.get("name") or not record.get("owner"):
+                self._error(f"项目记录缺少 name/owner: {record.get('name')}")
+                return
+            self._project_batch.append(record)
+            if len(self._project_batch) >= settings.import_batch_size:
+                self._flush_projects()
+        else:
+            self._error(f"未知记录类型: {kind}")
+    
+    def _flush_users(self) -> None:
+        if not self._user_batch:
+            return
+        secret_data = {u["hashFromEnv"]: u["hash"] for u in self._user_batch}
+        # 在 finish() 写入 ConfigMap 之前，孤立键清理不会删除这些键
+        self._pending_keys.extend(pending_keys.acquire(secret_data))
+        k8s_client.patch_secret(settings.dex_secret_name, settings.dex_namespace, secret_data)
+        # 只保留 staticPasswords 条目所需字段，哈希写入 Secret 后即可释放
+        self._user_entries.extend(
+            {"email": u["email"], "username": u.get("username"), "hashFromEnv": u["hashFromEnv"]}
+            for u in self._user_batch
+        )
+        self._user_batch = []
+    
+    def _flush_projects(self) -> None:
+        batch, self._project_batch = self._project_batch, []
+        if not batch:
+            return
+        
+        def restore(record):
+            try:
+                return project_service.restore_project(record["name"], record["owner"], record["resources"]), None
+            except Exception as e:
+                return None, f"项目 {record['name']} 恢复失败: {e}"
+        
+        with ThreadPoolExecutor(max_workers=min(len(batch), settings.profile_concurrency)) as pool:
+            for action, error in pool.map(bind_cluster(restore), batch):
+                if error:
+                    self._error(error)
+                else:
+                    self.stats["projects"][action] += 1
+    
+    def flush(self) -> None:
+        """应用当前未满一批的记录（项目）"""
+        self._flush_users()
+        self._flush_projects()
+    
+    def finish(self) -> Dict[str, Any]:
+        """处理剩余数据，一次性写入 Dex 配置并返回统计"""
+        if self._buffer:
+            self._add_line(self._buffer)
+            self._buffer = b""
+        try:
+            self.flush()
+            if self._user_entries:
+                counts = user_service.restore_users(self._user_entries)
+                for key, value in counts.items():
+                    self.stats["users"][key] += value
+                self._user_entries = []
+        finally:
+            self.close()
+        return self.stats
+    
+    def close(self) -> None:
+        """释放已写入 Secret 的密码键（导入中断时同样需要调用）"""
+        pending_keys.release(self._pending_keys)
+        self._pending_keys = []
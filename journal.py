@@ -0,0 +1,254 @@
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import orjson
+
+from config import settings
+from k8s_client import cluster_registry, current_cluster
+
+
+# 操作状态：running（进行中或进程崩溃）、completed、failed（抛出异常），恢复后为 resumed / rolled_back
+FINAL_STATUSES = ("completed", "resumed", "rolled_back")
+
+# 恢复函数：接收未完成的操作，完成剩余步骤或撤销已完成的步骤，返回 "resumed" / "rolled_back"
+Recoverer = Callable[["JournalOperation"], str]
+
+
+class JournalOperation:
+    """一次多步操作的日志记录：意图（intent）和已完成的步骤"""
+    
+    def __init__(
+        self,
+        journal: Optional["Journal"],
+        op_id: str,
+        kind: str,
+        cluster: str,
+        target: str,
+        intent: Dict[str, Any],
+        status: str = "running",
+        steps: Optional[Dict[str, Any]] = None,
+        error: Optional[str] = None,
+        created_at: Optional[float] = None,
+        updated_at: Optional[float] = None
+    ):
+        self._journal = journal
+        self.id = op_id
+        self.kind = kind
+        self.cluster = cluster
+        self.target = target
+        self.intent = intent
+        self.status = status
+        self.steps: Dict[str, Any] = steps or {}
+        self.error = error
+        self.created_at = created_at or time.time()
+        self.updated_at = updated_at or self.created_at
+    
+    def step(self, name: str, data: Any = None) -> None:
+        """记录一个已完成的步骤（在对应的 API 调用成功之后调用）"""
+        self.steps[name] = data
+        if self._journal is not None:
+            self._journal._append_step(self, name, data)
+    
+    def done(self, name: str) -> bool:
+        return name in self.steps
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "cluster": self.cluster,
+            "target": self.target,
+            "status": self.status,
+            "steps": list(self.steps),
+            "error": self.error,
+            "created_at": self.created_at,
+            "updated_at": self.updated_at,
+        }
+
+
+class Journal:
+    """
+    多步操作的预写日志（SQLite WAL）
+    
+    操作开始时写入意图，每完成一步追加一条步骤记录，结束时更新状态。
+    进程崩溃后，启动时的恢复流程并行处理未完成（running）或中途失败（failed）的操作：
+    由各操作类型注册的恢复函数根据意图和已完成的步骤继续执行或回滚。
+    
+    WAL 模式下 synchronous=NORMAL 的提交只写入日志文件、不 fsync，每步耗时在 0.1 ms 量级，
+    进程崩溃不丢记录；需要防范断电时设置 JOURNAL_SYNCHRONOUS=FULL（每步一次 fsync）。
+    日志中包含密码键名，文件权限设为 0600。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._recoverers: Dict[str, Recoverer] = {}
+    
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(settings.journal_path, check_same_thread=False, isolation_level=None)
+            os.chmod(settings.journal_path, 0o600)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={settings.journal_synchronous}")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS operations ("
+                " id TEXT PRIMARY KEY, kind TEXT, cluster TEXT, target TEXT, intent BLOB,"
+                " status TEXT, error TEXT, created_at REAL, updated_at REAL)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS steps ("
+                " op_id TEXT, step TEXT, data BLOB, at REAL, PRIMARY KEY (op_id, step))"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_operations_status ON operations(status, updated_at)")
+            self._conn = conn
+        return self._conn
+    
+    def _execute(self, sql: str, params: tuple = ()) -> List[tuple]:
+        with self._lock:
+            return self._connection().execute(sql, params).fetchall()
+    
+    # ---------- 写入 ----------
+    
+    def register(self, kind: str, recoverer: Recoverer) -> None:
+        """注册操作类型的恢复函数"""
+        self._recoverers[kind] = recoverer
+    
+    @contextmanager
+    def operation(self, kind: str, target: str, intent: Dict[str, Any]) -> Iterator[JournalOperation]:
+        """
+        在 with 块内执行一次多步操作：块内通过 op.step() 记录每个完成的步骤
+        正常结束标记为 completed，抛出异常标记为 failed（已完成部分步骤时，下次启动会被恢复）
+        """
+        cluster = cluster_registry.validate(current_cluster.get())
+        if not settings.journal_enabled:
+            yield JournalOperation(None, uuid.uuid4().hex, kind, cluster, target, intent)
+            return
+        
+        op = JournalOperation(self, uuid.uuid4().hex, kind, cluster, target, intent)
+        self._execute(
+            "INSERT INTO operations VALUES (?, ?, ?, ?, ?, 'running', NULL, ?, ?)",
+            (op.id, kind, cluster, target, orjson.dumps(intent), op.created_at, op.created_at)
+        )
+        try:
+            yield op
+        except Exception as e:
+            self._set_status(op, "failed", str(e))
+            raise
+        self._set_status(op, "completed")
+    
+    def _append_step(self, op: JournalOperation, name: str, data: Any) -> None:
+        now = time.time()
+        self._execute("INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?)", (op.id, name, orjson.dumps(data), now))
+        op.updated_at = now
+    
+    def _set_status(self, op: JournalOperation, status: str, error: Optional[str] = None) -> None:
+        op.status = status
+        op.error = error
+        op.updated_at = time.time()
+        self._execute(
+            "UPDATE operations SET status = ?, error = ?, updated_at = ? WHERE id = ?",
+            (status, error, op.updated_at, op.id)
+        )
+    
+    # ---------- 查询 ----------
+    
+    def _load(self, rows: List[tuple]) -> List[JournalOperation]:
+        operations = [
+            JournalOperation(self, row[0], row[1], row[2], row[3], orjson.loads(row[4]), row[5], None, row[6], row[7], row[8])
+            for row in rows
+        ]
+        by_id = {op.id: op for op in operations}
+        if by_id:
+            placeholders = ",".join("?" * len(by_id))
+            for op_id, step, data in self._execute(
+                f"SELECT op_id, step, data FROM steps WHERE op_id IN ({placeholders}) ORDER BY at", tuple(by_id)
+            ):
+                by_id[op_id].steps[step] = orjson.loads(data)
+        return operations
+    
+    def list(self, status: Optional[str] = None, limit: int = 100) -> List[JournalOperation]:
+        """按更新时间倒序列出操作"""
+        columns = "id, kind, cluster, target, intent, status, error, created_at, updated_at"
+        if status:
+            rows = self._execute(
+                f"SELECT {columns} FROM operations WHERE status = ? ORDER BY updated_at DESC LIMIT ?", (status, limit))
+        else:
+            rows = self._execute(f"SELECT {columns} FROM operations ORDER BY updated_at DESC LIMIT ?", (limit,))
+        return self._load(rows)
+    
+    def pending(self) -> List[JournalOperation]:
+        """需要恢复的操作：running，以及已完成部分步骤的 failed"""
+        rows = self._execute(
+            "SELECT id, kind, cluster, target, intent, status, error, created_at, updated_at FROM operations o"
+            " WHERE status = 'running'"
+            " OR (status = 'failed' AND EXISTS (SELECT 1 FROM steps s WHERE s.op_id = o.id))"
+            " ORDER BY created_at"
+        )
+        return self._load(rows)
+    
+    # ---------- 恢复 ----------
+    
+    def _recover_one(self, op: JournalOperation) -> str:
+        recoverer = self._recoverers.get(op.kind)
+        if recoverer is None:
+            print(f"警告：操作 {op.id}（{op.kind}）没有注册恢复函数，跳过")
+            return "skipped"
+        try:
+            with cluster_registry.use(op.cluster):
+                outcome = recoverer(op)
+        except Exception as e:
+            # 保持原状态，下次启动重试
+            print(f"警告：恢复操作 {op.id}（{op.kind} {op.target}）失败: {e}")
+            return "error"
+        self._set_status(op, outcome, op.error)
+        print(f"恢复操作 {op.id}（{op.kind} {op.target}）：{outcome}")
+        return outcome
+    
+    def recover(self) -> Dict[str, int]:
+        """并行恢复未完成的操作，并清理超过保留期的已结束记录；返回各结果的数量"""
+        if not settings.journal_enabled:
+            return {}
+        counts: Dict[str, int] = {}
+        operations = self.pending()
+        if operations:
+            with ThreadPoolExecutor(max_workers=min(len(operations), settings.journal_recovery_concurrency)) as pool:
+                for outcome in pool.map(self._recover_one, operations):
+                    counts[outcome] = counts.get(outcome, 0) + 1
+        self.prune()
+        return counts
+    
+    def start_recovery(self) -> threading.Thread:
+        """在后台线程中执行恢复，不阻塞服务启动"""
+        thread = threading.Thread(target=self.recover, name="journal-recovery", daemon=True)
+        thread.start()
+        return thread
+    
+    def prune(self) -> None:
+        """删除超过保留期的已结束操作（包括未执行任何步骤就失败的操作）"""
+        cutoff = time.time() - settings.journal_retention_seconds
+        placeholders = ",".join("?" * len(FINAL_STATUSES))
+        expired = (
+            f"SELECT id FROM operations o WHERE updated_at < ? AND (status IN ({placeholders})"
+            " OR (status = 'failed' AND NOT EXISTS (SELECT 1 FROM steps s WHERE s.op_id = o.id)))"
+        )
+        with self._lock:
+            conn = self._connection()
+            conn.execute("BEGIN")
+            try:
+                ids = [row[0] for row in conn.execute(expired, (cutoff, *FINAL_STATUSES))]
+                conn.executemany("DELETE FROM steps WHERE op_id = ?", [(op_id,) for op_id in ids])
+                conn.executemany("DELETE FROM operations WHERE id = ?", [(op_id,) for op_id in ids])
+            except Exception:
+                # 回滚，避免未结束的事务留在共享连接上，使之后的写入都失败
+                conn.execute("ROLLBACK")
+                raise
+            conn.execute("COMMIT")
+
+
+journal = Journal()
@@ -0,0 +1,230 @@
+import contextvars
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+from starlette.datastructures import MutableHeaders
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
+
+from config import settings
+from metrics import registry
+
+
+route_requests = registry.counter(
+    "kubeflow_manager_route_requests_total", "各路由的请求数")
+route_k8s_calls = registry.counter(
+    "kubeflow_manager_route_k8s_calls_total", "各路由调用 Kubernetes API 的次数（含重试）")
+route_k8s_seconds = registry.counter(
+    "kubeflow_manager_route_k8s_seconds_total", "各路由等待 Kubernetes API 响应的累计时间（秒）")
+route_k8s_bytes = registry.counter(
+    "kubeflow_manager_route_k8s_bytes_total", "各路由与 Kubernetes API 之间传输的字节数（direction=sent/received）")
+budget_exceeded = registry.counter(
+    "kubeflow_manager_k8s_budget_exceeded_total", "Kubernetes API 调用次数超出路由预算的请求数")
+
+
+class K8sCallBudgetExceeded(RuntimeError):
+    """k8s_call_budget_mode=fail 时，路由的 Kubernetes API 调用次数超出预算（用于在测试中发现 N+1 调用）"""
+
+
+class RequestStats:
+    """一次请求的 Kubernetes API 调用统计（线程池中的调用共享同一对象）"""
+    
+    def __init__(self, scope: Optional[Scope] = None):
+        self._lock = threading.Lock()
+        self._scope = scope
+        self.calls = 0
+        self.by_method: Dict[str, int] = {}
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.seconds = 0.0
+    
+    @property
+    def route(self) -> Optional[str]:
+        """'方法 路由模板'，路由匹配前为 None"""
+        route = (self._scope or {}).get("route")
+        if route is None:
+            return None
+        return f"{self._scope['method']} {route.path}"
+    
+    @property
+    def budget(self) -> Optional[int]:
+        route = self.route
+        return settings.k8s_call_budgets.get(route) if route else None
+    
+    def check_budget(self, name: str) -> None:
+        """k8s_call_budget_mode=fail 时，在发出超出预算的调用之前抛出 K8sCallBudgetExceeded"""
+        if settings.k8s_call_budget_mode != "fail":
+            return
+        budget = self.budget
+        if budget is not None and self.calls >= budget:
+            raise K8sCallBudgetExceeded(
+                f"{self.route} 的 Kubernetes API 调用次数超出预算（{budget}），本次调用：{name}")
+    
+    def record(self, name: str, sent: int, received: int, seconds: float) -> None:
+        with self._lock:
+            self.calls += 1
+            self.by_method[name] = self.by_method.get(name, 0) + 1
+            self.bytes_sent += sent
+            self.bytes_received += received
+            self.seconds += seconds
+    
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "total": self.calls,
+                "by_method": dict(self.by_method),
+                "bytes_sent": self.bytes_sent,
+                "bytes_received": self.bytes_received,
+                "seconds": round(self.seconds, 6),
+            }
+
+
+_current: contextvars.ContextVar[Optional[RequestStats]] = contextvars.ContextVar("k8s_request_stats", default=None)
+
+# 当前进行中的 KubernetesClient 方法（API 组.方法名），由 resilient 包装器设置
+_operation: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("k8s_operation", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _current.get()
+
+
+def begin(scope: Optional[Scope] = None) -> contextvars.Token:
+    """为当前请求（或命令行等其他调用）开始统计"""
+    return _current.set(RequestStats(scope))
+
+
+def end(token: contextvars.Token) -> RequestStats:
+    stats = _current.get()
+    _current.reset(token)
+    return stats
+
+
+def set_operation(name: str) -> contextvars.Token:
+    return _operation.set(name)
+
+
+def reset_operation(token: contextvars.Token) -> None:
+    _operation.reset(token)
+
+
+def instrument(api_client: Any) -> None:
+    """
+    包装 ApiClient 底层连接池的 request：每次 HTTP 往返记入当前请求的统计
+    不在请求中（informer 的 watch、后台线程）时直接调用，没有额外开销
+    """
+    pool_manager = api_client.rest_client.pool_manager
+    original = pool_manager.request
+    
+    def request(method, url, *args, **kwargs):
+        stats = _current.get()
+        if stats is None:
+            return original(method, url, *args, **kwargs)
+        name = _operation.get() or f"{method} {urlsplit(url).path}"
+        stats.check_budget(name)
+        body = kwargs.get("body")
+        # kubernetes 客户端以 ensure_ascii 的 JSON 字符串发送请求体，字符数即字节数
+        sent = len(body) if body else 0
+        started = time.perf_counter()
+        try:
+            response = original(method, url, *args, **kwargs)
+        except Exception:
+            stats.record(name, sent, 0, time.perf_counter() - started)
+            raise
+        # 流式响应（watch）不预读内容，只统计到响应头返回
+        received = len(response.data) if kwargs.get("preload_content", True) else 0
+        stats.record(name, sent, received, time.perf_counter() - started)
+        return response
+    
+    pool_manager.request = request
+
+
+class RouteStats:
+    """按路由汇总的调用统计，供 /api/admin/k8s-calls 查询"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._routes: Dict[str, Dict[str, float]] = {}
+    
+    def add(self, route: str, stats: RequestStats) -> None:
+        with self._lock:
+            item = self._routes.get(route)
+            if item is None:
+                item = self._routes[route] = {
+                    "requests": 0, "calls": 0, "max_calls": 0, "seconds": 0.0,
+                    "bytes_sent": 0, "bytes_received": 0,
+                }
+            item["requests"] += 1
+            item["calls"] += stats.calls
+            item["max_calls"] = max(item["max_calls"], stats.calls)
+            item["seconds"] += stats.seconds
+            item["bytes_sent"] += stats.bytes_sent
+            item["bytes_received"] += stats.bytes_received
+    
+    def snapshot(self) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            routes = {route: dict(item) for route, item in self._routes.items()}
+        for route, item in routes.items():
+            item["avg_calls"] = round(item["calls"] / item["requests"], 2)
+            item["avg_seconds"] = round(item["seconds"] / item["requests"], 6)
+            item["seconds"] = round(item["seconds"], 6)
+            item["budget"] = settings.k8s_call_budgets.get(route)
+        return dict(sorted(routes.items()))
+
+
+route_stats = RouteStats()
+
+
+class K8sAccountingMiddleware:
+    """
+    统计每个请求的 Kubernetes API 调用次数、传输字节数和耗时
+    
+    响应头 X-K8s-Calls 为调用次数，Server-Timing 的 k8s 项为累计耗时；
+    请求结束后按路由模板汇总到指标，超出 k8s_call_budgets 中的预算时按 k8s_call_budget_mode 警告。
+    """
+    
+    def __init__(self, app: ASGIApp):
+        self.app = app
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        
+        token = begin(scope)
+        stats = _current.get()
+        
+        async def send_wrapper(message: Message) -> None:
+            if message["type"] == "http.response.start" and settings.k8s_accounting_headers:
+                headers = MutableHeaders(scope=message)
+                headers["X-K8s-Calls"] = str(stats.calls)
+                headers.append(
+                    "Server-Timing",
+                    f'k8s;dur={stats.seconds * 1000:.1f};desc="{stats.calls} calls, '
+                    f'{stats.bytes_sent} B sent, {stats.bytes_received} B received"'
+                )
+            await send(message)
+        
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            end(token)
+            route = stats.route
+            if route is not None:
+                self._aggregate(route, stats)
+    
+    @staticmethod
+    def _aggregate(route: str, stats: RequestStats) -> None:
+        route_requests.inc(route=route)
+        route_k8s_calls.inc(stats.calls, route=route)
+        route_k8s_seconds.inc(stats.seconds, route=route)
+        route_k8s_bytes.inc(stats.bytes_sent, route=route, direction="sent")
+        route_k8s_bytes.inc(stats.bytes_received, route=route, direction="received")
+        route_stats.add(route, stats)
+        
+        budget = stats.budget
+        if budget is not None and stats.calls > budget:
+            budget_exceeded.inc(route=route)
+            if settings.k8s_call_budget_mode == "warn":
+                print(f"警告：{route} 调用 Kubernetes API {stats.calls} 次，超出预算 {budget}：{stats.by_method}")
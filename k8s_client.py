@@ -1,30 +1,57 @@
 import base64
+import contextvars
 import os
 import re
+import threading
 import yaml
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from kubernetes import client, config
 from kubernetes.client.rest import ApiException
-from typing import Optional, Dict, Any
+from typing import Optional, Dict, Any, Callable, Iterable, List
 from config import settings
+from informer import Informer
+from resilience import resilient
+import k8s_accounting
+
+
+def _node_allocatable(node: Dict[str, Any]) -> Dict[str, Any]:
+    """Node 缓存只保留名称和 allocatable，减少内存占用"""
+    return {
+        "metadata": {"name": node["metadata"]["name"]},
+        "status": {"allocatable": (node.get("status") or {}).get("allocatable") or {}},
+    }
 
 
 class KubernetesClient:
     """Kubernetes 客户端封装"""
     
-    def __init__(self):
-        """初始化 Kubernetes 客户端"""
+    def __init__(self, kubeconfig_path: Optional[str] = None, cluster_name: str = "default"):
+        """
+        初始化 Kubernetes 客户端
+        每个实例使用独立的 ApiClient（独立的配置和连接池），kubeconfig_path 为空时使用集群内配置
+        """
+        self.cluster_name = cluster_name
+        configuration = client.Configuration()
         try:
-            if settings.kubeconfig_path:
-                config.load_kube_config(config_file=settings.kubeconfig_path)
+            if kubeconfig_path:
+                config.load_kube_config(config_file=kubeconfig_path, client_configuration=configuration)
             else:
-                config.load_incluster_config()
+                config.load_incluster_config(client_configuration=configuration)
         except Exception:
-            config.load_kube_config()
+            config.load_kube_config(client_configuration=configuration)
         
-        self.core_v1 = client.CoreV1Api()
-        self.custom_objects = client.CustomObjectsApi()
-        self.apps_v1 = client.AppsV1Api()
+        self.api_client = client.ApiClient(configuration)
+        k8s_accounting.instrument(self.api_client)
+        self.core_v1 = client.CoreV1Api(self.api_client)
+        self.custom_objects = client.CustomObjectsApi(self.api_client)
+        self.apps_v1 = client.AppsV1Api(self.api_client)
+        
+        # list+watch 缓存，由 main.py 在启动时按需启动
+        self.profile_informer = Informer("profiles", self.list_profiles)
+        self.node_informer = Informer("nodes", self.list_nodes, transform=_node_allocatable)
     
+    @resilient("core")
     def get_configmap(self, name: str, namespace: str) -> Optional[client.V1ConfigMap]:
         """获取 ConfigMap"""
         try:
@@ -34,10 +61,20 @@ class KubernetesClient:
                 return None
             raise
     
+    @resilient("core")
+    def list_configmaps(self, namespace: str, **kwargs) -> Any:
+        """列出命名空间内的 ConfigMap（支持 watch 参数）"""
+        return self.core_v1.list_namespaced_config_map(namespace, **kwargs)
+    
+    @resilient("core", idempotent=False)
     def update_configmap(self, name: str, namespace: str, configmap: client.V1ConfigMap) -> client.V1ConfigMap:
-        """更新 ConfigMap"""
+        """
+        更新 ConfigMap
+        409 冲突不自动重试：调用方需重新读取并基于最新内容修改
+        """
         return self.core_v1.replace_namespaced_config_map(name, namespace, configmap)
     
+    @resilient("core")
     def get_secret(self, name: str, namespace: str) -> Optional[client.V1Secret]:
         """获取 Secret"""
         try:
@@ -47,11 +84,24 @@ class KubernetesClient:
                 return None
             raise
     
-    def patch_secret(self, name: str, namespace: str, data: Dict[str, str]) -> client.V1Secret:
-        """更新 Secret"""
-        body = {"data": data}
+    @resilient("core", idempotent=False)
+    def patch_secret(
+        self,
+        name: str,
+        namespace: str,
+        data: Dict[str, Optional[str]],
+        resource_version: Optional[str] = None
+    ) -> client.V1Secret:
+        """
+        更新 Secret（值为 None 的键会被删除）
+        指定 resource_version 时，Secret 在此期间被修改会返回 409
+        """
+        body: Dict[str, Any] = {"data": data}
+        if resource_version:
+            body["metadata"] = {"resourceVersion": resource_version}
         return self.core_v1.patch_namespaced_secret(name, namespace, body)
     
+    @resilient("kubeflow.org", idempotent=False)
     def create_profile(self, profile_data: Dict[str, Any]) -> Dict[str, Any]:
         """创建 Kubeflow Profile"""
         return self.custom_objects.create_cluster_custom_object(
@@ -61,6 +111,7 @@ class KubernetesClient:
             body=profile_data
         )
     
+    @resilient("kubeflow.org")
     def get_profile(self, name: str) -> Optional[Dict[str, Any]]:
         """获取 Kubeflow Profile"""
         try:
@@ -75,6 +126,17 @@ class KubernetesClient:
                 return None
             raise
     
+    @resilient("kubeflow.org")
+    def list_profiles(self, **kwargs) -> Any:
+        """列出 Kubeflow Profile（支持 watch 参数）"""
+        return self.custom_objects.list_cluster_custom_object(
+            group="kubeflow.org",
+            version="v1beta1",
+            plural="profiles",
+            **kwargs
+        )
+    
+    @resilient("kubeflow.org", idempotent=False, refresh="_refresh_profile")
     def update_profile(self, name: str, profile_data: Dict[str, Any]) -> Dict[str, Any]:
         """更新 Kubeflow Profile"""
         return self.custom_objects.replace_cluster_custom_object(
@@ -85,6 +147,21 @@ class KubernetesClient:
             body=profile_data
         )
     
+    def _refresh_profile(self, name: str, profile_data: Dict[str, Any]) -> Any:
+        """
+        update_profile 遇到 409 时刷新 resourceVersion：
+        以最新对象为基础，只覆盖本服务管理的 resourceQuotaSpec
+        """
+        current = self.custom_objects.get_cluster_custom_object(
+            group="kubeflow.org",
+            version="v1beta1",
+            plural="profiles",
+            name=name
+        )
+        current.setdefault('spec', {})['resourceQuotaSpec'] = profile_data['spec'].get('resourceQuotaSpec', {})
+        return (name, current), {}
+    
+    @resilient("kubeflow.org", idempotent=False)
     def delete_profile(self, name: str) -> Dict[str, Any]:
         """删除 Kubeflow Profile"""
         return self.custom_objects.delete_cluster_custom_object(
@@ -94,6 +171,7 @@ class KubernetesClient:
             name=name
         )
     
+    @resilient("security.istio.io", idempotent=False)
     def create_authorization_policy(self, namespace: str) -> Dict[str, Any]:
         """创建 Istio AuthorizationPolicy"""
         policy_data = {
@@ -117,6 +195,7 @@ class KubernetesClient:
             body=policy_data
         )
     
+    @resilient("apps", idempotent=False)
     def restart_deployment(self, name: str, namespace: str) -> client.V1Deployment:
         """重启 Deployment"""
         deployment = self.apps_v1.read_namespaced_deployment(name, namespace)
@@ -129,6 +208,27 @@ class KubernetesClient:
         
         return self.apps_v1.patch_namespaced_deployment(name, namespace, deployment)
     
+    @resilient("apps")
+    def list_deployments(self, namespace: str, **kwargs) -> Any:
+        """列出命名空间内的 Deployment（支持 watch 参数）"""
+        return self.apps_v1.list_namespaced_deployment(namespace, **kwargs)
+    
+    @resilient("core")
+    def list_nodes(self, **kwargs) -> Any:
+        """列出 Node（支持 watch 参数）"""
+        return self.core_v1.list_node(**kwargs)
+    
+    @resilient("core")
+    def list_resource_quotas(self, **kwargs) -> Any:
+        """列出所有命名空间的 ResourceQuota"""
+        return self.core_v1.list_resource_quota_for_all_namespaces(**kwargs)
+    
+    @resilient("core")
+    def list_namespaces(self, **kwargs) -> Any:
+        """列出命名空间（支持 watch 参数）"""
+        return self.core_v1.list_namespace(**kwargs)
+    
+    @resilient("core")
     def namespace_exists(self, namespace: str) -> bool:
         """检查命名空间是否存在"""
         try:
@@ -140,5 +240,103 @@ class KubernetesClient:
             raise
 
 
-k8s_client = KubernetesClient()
+# 当前请求操作的集群，None 表示默认集群；由 main.py 的依赖按 ?cluster= 设置
+current_cluster: contextvars.ContextVar[Optional[str]] = contextvars.ContextVar("current_cluster", default=None)
+
+
+class ClusterRegistry:
+    """
+    按名称管理多个集群的 KubernetesClient
+    
+    settings.clusters 为 {名称: kubeconfig 路径}，路径为空表示集群内配置；
+    未配置时只有一个 default_cluster，使用 settings.kubeconfig_path。
+    客户端在首次访问时创建。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[str, KubernetesClient] = {}
+    
+    @staticmethod
+    def configured() -> Dict[str, Optional[str]]:
+        return dict(settings.clusters) or {settings.default_cluster: settings.kubeconfig_path}
+    
+    def names(self) -> List[str]:
+        return list(self.configured())
+    
+    def validate(self, name: Optional[str]) -> str:
+        """返回规范化的集群名，未知集群抛出 ValueError"""
+        name = name or settings.default_cluster
+        if name not in self.configured():
+            raise ValueError(f"集群 {name} 不存在，可选: {', '.join(self.names())}")
+        return name
+    
+    def client(self, name: Optional[str] = None) -> KubernetesClient:
+        name = self.validate(name)
+        with self._lock:
+            kube_client = self._clients.get(name)
+            if kube_client is None:
+                kube_client = self._clients[name] = KubernetesClient(self.configured()[name], name)
+            return kube_client
+    
+    def initialized(self) -> List[str]:
+        with self._lock:
+            return list(self._clients)
+    
+    @contextmanager
+    def use(self, name: Optional[str]):
+        """在 with 块内切换当前集群"""
+        token = current_cluster.set(self.validate(name))
+        try:
+            yield
+        finally:
+            current_cluster.reset(token)
+    
+    def fan_out(self, func: Callable[[], Any], clusters: Optional[Iterable[str]] = None) -> Dict[str, Any]:
+        """
+        在多个集群上并发执行 func（在各自的集群上下文中），合并结果
+        返回: {"results": {集群: 结果}, "errors": {集群: 错误信息}}
+        """
+        names = [self.validate(name) for name in clusters] if clusters else self.names()
+        
+        def run(name):
+            with self.use(name):
+                try:
+                    return name, func(), None
+                except Exception as e:
+                    return name, None, str(e)
+        
+        results, errors = {}, {}
+        # 各线程在调用方上下文的副本中执行，保留配置快照和请求的 Kubernetes 调用统计
+        with ThreadPoolExecutor(max_workers=len(names)) as pool:
+            for name, result, error in pool.map(bind_cluster(run), names):
+                if error is None:
+                    results[name] = result
+                else:
+                    errors[name] = error
+        return {"results": results, "errors": errors}
+
+
+def bind_cluster(func: Callable) -> Callable:
+    """
+    绑定调用时的上下文（当前集群、配置快照、审计上下文），供提交到线程池的任务使用（线程池不继承 contextvars）
+    每次调用在上下文的副本中执行，可以被多个线程同时调用
+    """
+    context = contextvars.copy_context()
+    
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    
+    return wrapper
+
+
+class ClusterClientProxy:
+    """k8s_client 代理：属性访问转发到当前集群的 KubernetesClient"""
+    
+    def __getattr__(self, name: str) -> Any:
+        return getattr(cluster_registry.client(current_cluster.get()), name)
+
+
+cluster_registry = ClusterRegistry()
+k8s_client = ClusterClientProxy()
 
@@ -1,25 +1,92 @@
-from fastapi import FastAPI, HTTPException, status
-from fastapi.responses import JSONResponse
+from fastapi import Depends, FastAPI, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse, PlainTextResponse, Response
+from starlette.concurrency import run_in_threadpool, iterate_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
-from typing import List
+from typing import List, Optional
+import math
+import secrets
 import uvicorn
 
-from config import settings
+from config import settings, settings_manager
+from config_watcher import config_watcher
 from models import (
     UserCreate, UserPasswordReset, UserResponse,
     ProjectCreate, ProjectUpdate, ProjectResponse,
-    ApiResponse
+    FaultInjectionUpdate, ApiResponse
 )
 from user_service import user_service
 from project_service import project_service
+from k8s_client import k8s_client, cluster_registry, current_cluster
+from gpu_capacity import gpu_capacity_indexes
+from usage_sampler import usage_sampler, summarize_quotas, merge_quota_summaries
+from reconcile import reconciler, load_desired_state
+from inventory import iter_export, InventoryImporter
+from dex_gc import dex_gc
+from kubernetes.client.rest import ApiException
+from resilience import CircuitOpenError, breaker_states
+from metrics import registry
+from responses import FastJSONResponse, respond
+from compression import CompressionMiddleware
+from idempotency import idempotency
+from user_index import user_indexes
+from deletion_tracker import deletion_tracker
+from audit import AuditMiddleware, audit_log, parse_time
+from admission import AdmissionRejected, admission, current_tenant
+from k8s_accounting import K8sAccountingMiddleware, route_stats
+from journal import journal
+from snapshot import snapshot_store
+from readiness import readiness
+from events import event_feed
+from fault_injection import fault_injector
+from profiler import ProfilerBusy, memory_report, profiler, render_collapsed, render_flamegraph
+
+
+async def pin_settings() -> None:
+    """固定本次请求使用的配置快照，热加载不会影响进行中的请求"""
+    settings_manager.pin()
+
+
+async def require_admin(x_admin_token: Optional[str] = Header(None)) -> None:
+    """校验管理接口令牌（未配置 admin_token 时不校验）"""
+    if settings.admin_token and not secrets.compare_digest(x_admin_token or "", settings.admin_token):
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="管理令牌无效")
+
+
+async def select_cluster(
+    cluster: Optional[str] = Query(None, description="目标集群名称，不提供则使用默认集群")
+) -> None:
+    """按 ?cluster= 设置本次请求操作的集群（线程池中的调用同样生效）"""
+    try:
+        current_cluster.set(cluster_registry.validate(cluster))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+async def identify_tenant(request: Request) -> None:
+    """按 ADMISSION_TENANT_HEADER 请求头（缺省为客户端 IP）确定调用方，用于准入控制的公平排队"""
+    tenant = request.headers.get(settings.admission_tenant_header)
+    if not tenant:
+        tenant = request.client.host if request.client else "unknown"
+    current_tenant.set(tenant)
 
 
 app = FastAPI(
     title=settings.api_title,
     version=settings.api_version,
-    description="基于 Kubeflow 1.10 的用户和项目管理 API"
+    description="基于 Kubeflow 1.10 的用户和项目管理 API",
+    dependencies=[Depends(pin_settings), Depends(select_cluster), Depends(identify_tenant)],
+    default_response_class=FastJSONResponse
 )
 
+# 修改类请求的审计日志
+app.add_middleware(AuditMiddleware)
+
+# 每个请求的 Kubernetes API 调用统计（审计日志读取其结果，需在审计中间件外层）
+app.add_middleware(K8sAccountingMiddleware)
+
+# 大响应压缩（gzip / zstd）
+app.add_middleware(CompressionMiddleware)
+
 # CORS 配置
 app.add_middleware(
     CORSMiddleware,
@@ -30,10 +97,66 @@ app.add_middleware(
 )
 
 
+def server_error(e: Exception) -> HTTPException:
+    """
+    将未预期的异常转换为 HTTP 错误：熔断打开时返回 503 和 Retry-After，
+    准入控制拒绝时返回 429 和 Retry-After，其余返回 500
+    """
+    if isinstance(e, AdmissionRejected):
+        return HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=str(e),
+            headers={"Retry-After": str(int(e.retry_after) + 1)}
+        )
+    return HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+
+@app.on_event("startup")
+async def start_informers():
+    """启动 list+watch 缓存（配置了快照时先从快照恢复）"""
+    if settings.snapshot_path:
+        await run_in_threadpool(snapshot_store.restore)
+        snapshot_store.start()
+    if settings.gpu_capacity_mode != "off":
+        for name in cluster_registry.names():
+            try:
+                gpu_capacity_indexes.get(name)
+            except Exception as e:
+                print(f"警告：集群 {name} 的 GPU 容量索引启动失败: {e}")
+    if settings.usage_sampler_enabled:
+        usage_sampler.start()
+    if settings.config_reload_interval or settings.config_configmap_name:
+        config_watcher.start()
+    if settings.user_index_enabled:
+        user_indexes.get(settings.default_cluster)
+    if settings.audit_enabled:
+        audit_log.start()
+    if settings.journal_enabled:
+        journal.start_recovery()
+    if settings.events_enabled:
+        event_feed.start()
+    readiness.start()
+
+
+@app.on_event("shutdown")
+async def flush_audit_log():
+    """退出前写完审计日志队列，并保存一次快照"""
+    event_feed.stop()
+    await run_in_threadpool(audit_log.close)
+    if settings.snapshot_path:
+        await run_in_threadpool(snapshot_store.stop)
+
+
 @app.get("/", response_model=ApiResponse)
 async def root():
     """API 根路径"""
-    return ApiResponse(
+    return respond(ApiResponse(
         success=True,
         message="Kubeflow User Management API",
         data={
@@ -44,189 +167,515 @@ async def root():
                 "docs": "/docs"
             }
         }
-    )
+    ))
 
 
 @app.get("/health")
 async def health_check():
-    """健康检查"""
+    """存活检查（只表示进程在运行，依赖状态见 /ready）"""
     return {"status": "healthy"}
 
 
+@app.get("/ready")
+async def readiness_check():
+    """
+    就绪检查：API Server、Dex ConfigMap/Secret/Deployment、Profile CRD 和 informer 缓存是否新鲜
+    返回后台检查线程缓存的结果，不访问集群；默认集群未就绪时返回 503
+    """
+    result = readiness.result()
+    return respond(result, status_code=status.HTTP_200_OK if result["ready"] else status.HTTP_503_SERVICE_UNAVAILABLE)
+
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics():
+    """Prometheus 格式的运行指标"""
+    return registry.render()
+
+
+@app.get("/api/admin/circuits", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def get_circuits():
+    """查询各 API 组熔断器状态"""
+    return respond(ApiResponse(success=True, message="熔断器状态", data=breaker_states()))
+
+
+@app.get("/api/admin/admission", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def get_admission():
+    """查询各操作类别的并发上限、执行中和排队请求数"""
+    return respond(ApiResponse(success=True, message="准入控制状态", data=admission.stats()))
+
+
+@app.get("/api/admin/k8s-calls", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def get_k8s_call_stats():
+    """按路由汇总的 Kubernetes API 调用次数、耗时、传输字节数和预算"""
+    return respond(ApiResponse(success=True, message="Kubernetes API 调用统计", data=route_stats.snapshot()))
+
+
+@app.get("/api/admin/events", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def get_event_stats():
+    """变更事件缓冲区、SSE 订阅数及各 webhook 的投递进度"""
+    return respond(ApiResponse(success=True, message="变更事件状态", data=event_feed.stats()))
+
+
+@app.get("/api/admin/config", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def get_config():
+    """查询当前生效的配置及其版本"""
+    return respond(ApiResponse(success=True, message="当前配置", data=settings_manager.info()))
+
+
+@app.post("/api/admin/config/reload", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def reload_config():
+    """立即重新加载配置（.env、环境变量及 ConfigMap 覆盖项），校验失败时保持原配置"""
+    try:
+        result = settings_manager.reload("api")
+        return respond(ApiResponse(success=True, message=f"当前配置版本 {result['version']}", data=result))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@app.get("/api/admin/journal", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def list_journal(
+    status_filter: Optional[str] = Query(
+        None, alias="status", description="running / completed / failed / resumed / rolled_back"),
+    limit: int = Query(100, ge=1, le=1000)
+):
+    """查询多步操作的预写日志（按更新时间倒序）"""
+    operations = await run_in_threadpool(journal.list, status_filter, limit)
+    return respond(ApiResponse(
+        success=True,
+        message=f"共 {len(operations)} 条操作记录",
+        data={"operations": [op.to_dict() for op in operations]}
+    ))
+
+
+@app.get("/api/admin/audit", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def query_audit_log(
+    since: Optional[str] = Query(None, description="起始时间（含），Unix 时间戳或 ISO 8601"),
+    until: Optional[str] = Query(None, description="结束时间（不含），Unix 时间戳或 ISO 8601"),
+    actor: Optional[str] = None,
+    name: Optional[str] = Query(None, description="变更对象名称（邮箱或项目名）"),
+    limit: int = Query(1000, ge=1, le=10000)
+):
+    """按时间范围查询审计日志（按时间升序）"""
+    try:
+        records = await run_in_threadpool(
+            audit_log.query,
+            since=parse_time(since) if since else None,
+            until=parse_time(until) if until else None,
+            actor=actor,
+            name=name,
+            limit=limit
+        )
+        return respond(ApiResponse(success=True, message=f"共 {len(records)} 条记录", data={"records": records}))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise server_error(e)
+
+
+async def require_debug() -> None:
+    """诊断接口默认关闭，未开启时返回 404"""
+    if not settings.debug_endpoints_enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+
+@app.get("/debug/profile", dependencies=[Depends(require_debug), Depends(require_admin)])
+async def debug_profile(
+    seconds: float = Query(10, gt=0, description="采样时长（秒），不超过 PROFILE_MAX_SECONDS"),
+    mode: str = Query("cpu", pattern="^(cpu|wall)$", description="cpu：按 CPU 时间采样；wall：按墙钟时间采样（包括等待）"),
+    format: str = Query("collapsed", pattern="^(collapsed|svg)$", description="collapsed：折叠调用栈文本；svg：火焰图")
+):
+    """对所有线程做调用栈采样，返回折叠调用栈或 SVG 火焰图"""
+    if seconds > settings.profile_max_seconds:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"seconds 不能超过 {settings.profile_max_seconds}"
+        )
+    try:
+        stacks = await profiler.profile(seconds, mode)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    except Exception as e:
+        raise server_error(e)
+    if format == "svg":
+        title = f"{mode} profile, {seconds:g}s, {profiler.samples} samples"
+        return Response(render_flamegraph(stacks, title), media_type="image/svg+xml")
+    return PlainTextResponse(render_collapsed(stacks))
+
+
+@app.get("/debug/memory", response_model=ApiResponse, dependencies=[Depends(require_debug), Depends(require_admin)])
+async def debug_memory(
+    seconds: float = Query(0, ge=0, description="tracemalloc 跟踪时长（秒），0 表示只返回 RSS、GC 和缓存大小"),
+    top: int = Query(20, ge=1, le=500),
+    group_by: str = Query("lineno", pattern="^(lineno|filename|traceback)$")
+):
+    """进程内存、GC 状态、各缓存大小，以及 tracemalloc 统计的分配位置排行"""
+    if seconds > settings.profile_max_seconds:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"seconds 不能超过 {settings.profile_max_seconds}"
+        )
+    try:
+        report = await memory_report(seconds, top, group_by)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return respond(ApiResponse(success=True, message="内存诊断", data=report))
+
+
+@app.get("/debug/faults", response_model=ApiResponse, dependencies=[Depends(require_debug), Depends(require_admin)])
+async def get_faults():
+    """当前生效的故障注入规则及各方法已注入的故障次数"""
+    return respond(ApiResponse(success=True, message="故障注入状态", data=fault_injector.stats()))
+
+
+@app.put("/debug/faults", response_model=ApiResponse, dependencies=[Depends(require_debug), Depends(require_admin)])
+async def set_faults(update: FaultInjectionUpdate):
+    """临时覆盖配置中的故障注入规则（rules 为空字典时关闭注入），进程重启后失效"""
+    try:
+        fault_injector.configure(update.rules, update.seed)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    return respond(ApiResponse(success=True, message=f"已设置 {len(update.rules)} 条故障规则", data=fault_injector.stats()))
+
+
+@app.delete("/debug/faults", response_model=ApiResponse, dependencies=[Depends(require_debug), Depends(require_admin)])
+async def clear_faults():
+    """取消覆盖，恢复使用配置中的 fault_injection"""
+    fault_injector.configure(None)
+    return respond(ApiResponse(success=True, message="已恢复配置中的故障规则", data=fault_injector.stats()))
+
+
+# ==================== 多集群接口 ====================
+
+@app.get("/api/clusters", response_model=ApiResponse)
+async def list_clusters():
+    """列出配置的集群"""
+    return respond(ApiResponse(
+        success=True,
+        message="集群列表",
+        data={
+            "default": settings.default_cluster,
+            "clusters": cluster_registry.names(),
+            "initialized": cluster_registry.initialized()
+        }
+    ))
+
+
+@app.get("/api/clusters/projects", response_model=ApiResponse)
+async def list_projects_all_clusters(owner: Optional[str] = None):
+    """
+    并发查询所有集群的项目并合并
+    
+    - owner: 只返回该邮箱拥有的项目（可选）
+    """
+    def collect():
+        return [p for p in project_service.list_projects() if owner is None or p["owner"] == owner]
+    
+    fan_out = await run_in_threadpool(cluster_registry.fan_out, collect)
+    projects = [
+        {**project, "cluster": name}
+        for name, items in sorted(fan_out["results"].items())
+        for project in items
+    ]
+    return respond(ApiResponse(
+        success=not fan_out["errors"],
+        message=f"共 {len(projects)} 个项目",
+        data={"projects": projects, "errors": fan_out["errors"]}
+    ))
+
+
+@app.get("/api/clusters/quotas", response_model=ApiResponse)
+async def summarize_quotas_all_clusters():
+    """并发汇总所有集群的项目配额（hard）和使用量（used）"""
+    fan_out = await run_in_threadpool(cluster_registry.fan_out, summarize_quotas)
+    return respond(ApiResponse(
+        success=not fan_out["errors"],
+        message="配额汇总",
+        data={
+            "total": merge_quota_summaries(list(fan_out["results"].values())),
+            "clusters": fan_out["results"],
+            "errors": fan_out["errors"]
+        }
+    ))
+
+
 # ==================== 用户管理接口 ====================
 
 @app.post("/api/users", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
-async def create_user(user: UserCreate):
+async def create_user(
+    user: UserCreate,
+    wait_ready: Optional[bool] = None,
+    idempotency_key: Optional[str] = Header(None)
+):
     """
     创建用户
     
     - email: 用户邮箱（必填）
     - password: 用户密码（可选，不提供则自动生成）
     - username: 用户名（可选，不提供则从邮箱提取）
+    - wait_ready: 查询参数，等待 Dex 加载新配置后再返回（可选，默认由 DEX_ROLLOUT_WAIT 决定）
+    - Idempotency-Key 请求头：可选，相同键的重试直接返回首次结果
     """
+    def handle():
+        try:
+            result = user_service.create_user(
+                email=user.email,
+                password=user.password,
+                username=user.username,
+                wait_ready=wait_ready
+            )
+            
+            profile_name = project_service.email_to_profile_name(user.email)
+            login_url = f"https://{settings.kubeflow_domain}/?ns={profile_name}"
+            
+            return UserResponse(
+                email=result["email"],
+                username=result["username"],
+                password=result["password"],
+                login_url=login_url,
+                ready=result["ready"],
+                rollout_seconds=result["rollout_seconds"]
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        except Exception as e:
+            raise server_error(e)
+    
+    return await idempotency.run("POST /api/users", idempotency_key, user, handle, status.HTTP_201_CREATED)
+
+
+@app.get("/api/users/search", response_model=ApiResponse)
+async def search_users(
+    q: str = Query(..., description="邮箱或用户名关键字"),
+    mode: str = Query("auto", description="prefix / substring / auto"),
+    limit: int = Query(50, ge=1, le=1000)
+):
+    """
+    搜索用户（Dex 用户和 Profile 所有者）
+    
+    - prefix: 邮箱或用户名以 q 开头
+    - substring: 邮箱或用户名包含 q
+    - auto: 先按前缀匹配，不足 limit 时补充子串匹配
+    """
+    if not settings.user_index_enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="用户搜索索引未启用")
     try:
-        result = user_service.create_user(
-            email=user.email,
-            password=user.password,
-            username=user.username
-        )
-        
-        profile_name = project_service.email_to_profile_name(user.email)
-        login_url = f"https://{settings.kubeflow_domain}/?ns={profile_name}"
-        
-        return UserResponse(
-            email=result["email"],
-            username=result["username"],
-            password=result["password"],
-            login_url=login_url
-        )
+        index = user_indexes.get()
+        if not index.ready and not await run_in_threadpool(index.wait_ready, settings.user_index_sync_timeout):
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="用户索引尚未同步完成，请稍后重试",
+                headers={"Retry-After": "5"}
+            )
+        users = index.search(q, mode=mode, limit=limit)
+        return respond(ApiResponse(
+            success=True,
+            message=f"找到 {len(users)} 个用户",
+            data={"users": users, "index": index.stats()}
+        ))
+    except HTTPException:
+        raise
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        raise server_error(e)
 
 
 @app.get("/api/users/{email}", response_model=UserResponse)
 async def get_user(email: str):
     """获取用户信息"""
     try:
-        user_info = user_service.get_user(email)
+        user_info = await run_in_threadpool(user_service.get_user, email)
         if not user_info:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"用户 {email} 不存在")
         
         profile_name = project_service.email_to_profile_name(email)
         login_url = f"https://{settings.kubeflow_domain}/?ns={profile_name}"
         
-        return UserResponse(
+        return respond(UserResponse(
             email=user_info["email"],
             username=user_info["username"],
             login_url=login_url
-        )
+        ))
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        raise server_error(e)
 
 
 @app.put("/api/users/password", response_model=UserResponse)
-async def reset_password(reset_data: UserPasswordReset):
+async def reset_password(
+    reset_data: UserPasswordReset,
+    wait_ready: Optional[bool] = None,
+    idempotency_key: Optional[str] = Header(None)
+):
     """
     重置用户密码
     
     - email: 用户邮箱（必填）
     - new_password: 新密码（可选，不提供则自动生成）
+    - wait_ready: 查询参数，等待 Dex 加载新配置后再返回（可选，默认由 DEX_ROLLOUT_WAIT 决定）
+    - Idempotency-Key 请求头：可选，相同键的重试直接返回首次结果
     """
-    try:
-        result = user_service.reset_password(
-            email=reset_data.email,
-            new_password=reset_data.new_password
-        )
-        
-        profile_name = project_service.email_to_profile_name(reset_data.email)
-        login_url = f"https://{settings.kubeflow_domain}/?ns={profile_name}"
-        
-        return UserResponse(
-            email=result["email"],
-            username=user_service.extract_username(result["email"]),
-            password=result["password"],
-            login_url=login_url
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    def handle():
+        try:
+            result = user_service.reset_password(
+                email=reset_data.email,
+                new_password=reset_data.new_password,
+                wait_ready=wait_ready
+            )
+            
+            profile_name = project_service.email_to_profile_name(reset_data.email)
+            login_url = f"https://{settings.kubeflow_domain}/?ns={profile_name}"
+            
+            return UserResponse(
+                email=result["email"],
+                username=user_service.extract_username(result["email"]),
+                password=result["password"],
+                login_url=login_url,
+                ready=result["ready"],
+                rollout_seconds=result["rollout_seconds"]
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        except Exception as e:
+            raise server_error(e)
+    
+    return await idempotency.run("PUT /api/users/password", idempotency_key, reset_data, handle, status.HTTP_200_OK)
 
 
 @app.delete("/api/users/{email}", response_model=ApiResponse)
-async def delete_user(email: str):
-    """删除用户"""
+async def delete_user(email: str, wait_ready: Optional[bool] = None):
+    """
+    删除用户
+    
+    - wait_ready: 等待 Dex 加载新配置后再返回（可选，默认由 DEX_ROLLOUT_WAIT 决定）
+    """
     try:
-        result = user_service.delete_user(email)
-        return ApiResponse(
+        result = await run_in_threadpool(user_service.delete_user, email, wait_ready)
+        return respond(ApiResponse(
             success=True,
             message=result["message"],
-            data={"email": email}
-        )
+            data={"email": email, "ready": result["ready"], "rollout_seconds": result["rollout_seconds"]}
+        ))
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        raise server_error(e)
 
 
 # ==================== 项目管理接口 ====================
 
 @app.post("/api/projects", response_model=ProjectResponse, status_code=status.HTTP_201_CREATED)
-async def create_project(project: ProjectCreate):
+async def create_project(
+    project: ProjectCreate,
+    wait_for_deletion: bool = False,
+    idempotency_key: Optional[str] = Header(None)
+):
     """
     创建项目（Profile/Namespace）
     
     - owner_email: 项目所有者邮箱（必填）
+    - tier: 配额档位（可选，见 /api/quota-tiers），其余参数在档位基础上覆盖
     - cpu_limit: CPU 限制（可选，默认2）
     - memory_limit: 内存限制 GiB（可选，默认4）
     - storage_size: 存储大小 GiB（可选，默认10）
     - resources: 其他资源配置，支持任意 K8s 资源键（可选）
+    - wait_for_deletion: 查询参数，同名项目正在删除时等待删除完成后再创建（默认直接返回 400）
+    - Idempotency-Key 请求头：可选，相同键的重试直接返回首次结果
     """
-    try:
-        result = project_service.create_project(
-            owner_email=project.owner_email,
-            cpu_limit=project.cpu_limit,
-            memory_limit=project.memory_limit,
-            storage_size=project.storage_size,
-            resources=project.resources
-        )
-        
-        return ProjectResponse(
-            name=result["name"],
-            owner=result["owner"],
-            namespace=result["namespace"],
-            resources=result["resources"]
-        )
-    except ValueError as e:
-        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
-    except TimeoutError as e:
-        raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=str(e))
-    except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+    def handle():
+        try:
+            result = project_service.create_project(
+                owner_email=project.owner_email,
+                cpu_limit=project.cpu_limit,
+                memory_limit=project.memory_limit,
+                storage_size=project.storage_size,
+                resources=project.resources,
+                wait_for_deletion=wait_for_deletion,
+                tier=project.tier
+            )
+            
+            return ProjectResponse(
+                name=result["name"],
+                owner=result["owner"],
+                namespace=result["namespace"],
+                resources=result["resources"],
+                warnings=result.get("warnings") or None
+            )
+        except ValueError as e:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+        except TimeoutError as e:
+            raise HTTPException(status_code=status.HTTP_408_REQUEST_TIMEOUT, detail=str(e))
+        except Exception as e:
+            raise server_error(e)
+    
+    return await idempotency.run("POST /api/projects", idempotency_key, project, handle, status.HTTP_201_CREATED)
 
 
 @app.get("/api/projects/{profile_name}", response_model=ProjectResponse)
 async def get_project(profile_name: str):
     """获取项目信息"""
     try:
-        project_info = project_service.get_project(profile_name)
+        project_info = await run_in_threadpool(project_service.get_project, profile_name)
         if not project_info:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"项目 {profile_name} 不存在")
         
-        return ProjectResponse(
+        return respond(ProjectResponse(
             name=project_info["name"],
             owner=project_info["owner"],
             namespace=project_info["namespace"],
             resources=project_info["resources"]
-        )
+        ))
     except HTTPException:
         raise
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        raise server_error(e)
 
 
 @app.get("/api/projects/by-email/{email}", response_model=ProjectResponse)
 async def get_project_by_email(email: str):
     """根据邮箱获取项目信息"""
     try:
-        project_info = project_service.get_project_by_email(email)
+        project_info = await run_in_threadpool(project_service.get_project_by_email, email)
         if not project_info:
             raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"用户 {email} 的项目不存在")
         
-        return ProjectResponse(
+        return respond(ProjectResponse(
             name=project_info["name"],
             owner=project_info["owner"],
             namespace=project_info["namespace"],
             resources=project_info["resources"]
-        )
+        ))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise server_error(e)
+
+
+@app.get("/api/projects/{profile_name}/usage", response_model=ApiResponse)
+async def get_project_usage(profile_name: str, window: str = "7d", points: int = 200):
+    """
+    查询项目配额使用量历史
+    
+    - window: 时间窗口，例如 30m、12h、7d（默认 7d）
+    - points: 降采样后的最大点数（默认 200）
+    """
+    try:
+        history = await run_in_threadpool(usage_sampler.history, profile_name, window, points)
+        if history is None:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"项目 {profile_name} 暂无使用量数据")
+        
+        return respond(ApiResponse(
+            success=True,
+            message=f"共 {len(history['samples'])} 个采样点",
+            data=history
+        ))
     except HTTPException:
         raise
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        raise server_error(e)
 
 
 @app.put("/api/projects/{profile_name}", response_model=ProjectResponse)
@@ -234,46 +683,235 @@ async def update_project(profile_name: str, update_data: ProjectUpdate):
     """
     更新项目资源限制
     
+    - tier: 切换到的配额档位（可选），其余参数在档位基础上覆盖
     - cpu_limit: CPU 限制（可选）
     - memory_limit: 内存限制 GiB（可选）
     - storage_size: 存储大小 GiB（可选）
     - resources: 其他资源配置，支持任意 K8s 资源键（可选）
     """
     try:
-        result = project_service.update_project_resources(
+        result = await run_in_threadpool(
+            project_service.update_project_resources,
             profile_name=profile_name,
             cpu_limit=update_data.cpu_limit,
             memory_limit=update_data.memory_limit,
             storage_size=update_data.storage_size,
-            resources=update_data.resources
+            resources=update_data.resources,
+            tier=update_data.tier
         )
         
-        return ProjectResponse(
+        return respond(ProjectResponse(
             name=result["name"],
             owner=result["owner"],
             namespace=result["namespace"],
-            resources=result["resources"]
-        )
+            resources=result["resources"],
+            warnings=result.get("warnings") or None
+        ))
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        raise server_error(e)
 
 
 @app.delete("/api/projects/{profile_name}", response_model=ApiResponse)
-async def delete_project(profile_name: str):
-    """删除项目（Profile/Namespace）"""
+async def delete_project(profile_name: str, wait: bool = False):
+    """
+    删除项目（Profile/Namespace）
+    
+    Profile 删除后命名空间的终止在后台跟踪，返回 202 和操作信息；
+    进度可通过 /api/operations/{id}/events（SSE）订阅。
+    - wait: 为 true 时等待命名空间删除完成（或超时）后返回
+    """
     try:
-        result = project_service.delete_project(profile_name)
-        return ApiResponse(
-            success=True,
-            message=result["message"],
-            data={"name": profile_name}
+        result = await run_in_threadpool(project_service.delete_project, profile_name, wait)
+        operation = result["operation"]
+        return respond(
+            ApiResponse(
+                success=operation["state"] in ("running", "completed"),
+                message=result["message"],
+                data={"name": profile_name, "operation": operation}
+            ),
+            status_code=status.HTTP_202_ACCEPTED if operation["state"] == "running" else status.HTTP_200_OK
         )
     except ValueError as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
     except Exception as e:
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+        raise server_error(e)
+
+
+# ==================== 后台操作接口 ====================
+
+@app.get("/api/operations/{operation_id}", response_model=ApiResponse)
+async def get_operation(operation_id: str):
+    """查询后台操作（项目删除）的状态和事件"""
+    operation = deletion_tracker.get(operation_id)
+    if operation is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"操作 {operation_id} 不存在")
+    return respond(ApiResponse(success=True, message=operation.state, data=operation.to_dict()))
+
+
+@app.get("/api/operations/{operation_id}/events")
+async def stream_operation_events(operation_id: str, last_event_id: Optional[int] = Header(None)):
+    """
+    以 SSE 推送后台操作的进度事件，操作结束后关闭连接
+    
+    - Last-Event-ID 请求头：从指定事件序号之后继续推送
+    """
+    operation = deletion_tracker.get(operation_id)
+    if operation is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail=f"操作 {operation_id} 不存在")
+    return StreamingResponse(
+        operation.stream(last_event_id or 0),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ==================== 变更事件接口 ====================
+
+@app.get("/api/events")
+async def stream_events(
+    types: Optional[str] = Query(None, description="逗号分隔的事件类型或类别，如 user、project.update"),
+    after: Optional[str] = Query(None, description="续传令牌，等同于 Last-Event-ID 请求头"),
+    last_event_id: Optional[str] = Header(None)
+):
+    """
+    以 SSE 持续推送用户、项目的变更事件（包括集群外部对 Profile 的修改）
+    
+    - Last-Event-ID 请求头或 after 参数：从该事件之后继续推送；不指定时只推送之后的新事件
+    - 令牌对应的事件已被覆盖或服务已重启时先推送 reset 事件，客户端应通过查询接口重新同步
+    """
+    if not settings.events_enabled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="变更事件未启用")
+    type_set = {item.strip() for item in types.split(",") if item.strip()} if types else None
+    return StreamingResponse(
+        event_feed.stream(event_feed.parse_token(last_event_id or after), type_set),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+# ==================== 声明式同步接口 ====================
+
+@app.post("/api/reconcile", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def reconcile(request: Request, apply: bool = False, format: str = None):
+    """
+    按期望状态文件同步用户和项目
+    
+    - 请求体：YAML 或 CSV 文本（Content-Type 为 text/csv 时按 CSV 解析）
+    - apply: 为 false 时只返回变更计划，为 true 时执行变更
+    - format: 显式指定 yaml / csv（可选）
+    """
+    try:
+        content = (await request.body()).decode("utf-8")
+        fmt = format or ("csv" if "csv" in request.headers.get("content-type", "") else "yaml")
+        desired = load_desired_state(content, fmt)
+        
+        plan = await run_in_threadpool(reconciler.plan, desired)
+        if not apply:
+            return respond(ApiResponse(success=True, message="变更计划（未执行）", data={"plan": plan}))
+        
+        result = await run_in_threadpool(reconciler.apply, desired, plan)
+        errors = result["results"]["errors"]
+        return respond(ApiResponse(
+            success=not errors,
+            message=f"同步完成，{len(errors)} 个项目失败" if errors else "同步完成",
+            data=result
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise server_error(e)
+
+
+# ==================== 导出/导入接口 ====================
+
+@app.get("/api/export", dependencies=[Depends(require_admin)])
+async def export_inventory():
+    """以 NDJSON 流式导出全部 Dex 用户（含密码哈希）和项目配额"""
+    return StreamingResponse(
+        iterate_in_threadpool(iter_export()),
+        media_type="application/x-ndjson",
+        headers={"Content-Disposition": "attachment; filename=kubeflow-inventory.ndjson"}
+    )
+
+
+@app.post("/api/import", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def import_inventory(request: Request):
+    """
+    导入 /api/export 导出的 NDJSON
+    
+    请求体按块流式读取并分批应用：已存在的用户覆盖密码哈希，已存在的项目覆盖配额
+    """
+    importer = InventoryImporter()
+    try:
+        async for chunk in request.stream():
+            if chunk:
+                await run_in_threadpool(importer.feed, chunk)
+        stats = await run_in_threadpool(importer.finish)
+        
+        return respond(ApiResponse(
+            success=not stats["errors"],
+            message=f"导入完成，共 {stats['lines']} 行",
+            data=stats
+        ))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except Exception as e:
+        raise server_error(e)
+    finally:
+        importer.close()
+
+
+# ==================== 维护接口 ====================
+
+@app.post("/api/admin/gc", response_model=ApiResponse, dependencies=[Depends(require_admin)])
+async def garbage_collect(dry_run: bool = True):
+    """
+    清理 dex-passwords Secret 中未被任何用户引用的密码键，并列出 owner 不存在的项目
+    
+    - dry_run: 为 true（默认）时只报告，不删除
+    """
+    try:
+        result = await run_in_threadpool(dex_gc.collect, dry_run)
+        if dry_run:
+            message = f"发现 {len(result['orphan_keys'])} 个孤立密码键，可回收 {result['bytes_reclaimable']} 字节"
+        else:
+            message = f"已删除 {len(result['orphan_keys'])} 个孤立密码键，回收 {result['bytes_reclaimed']} 字节"
+        return respond(ApiResponse(success=True, message=message, data=result))
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+    except ApiException as e:
+        if e.status == 409:
+            raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Secret 在清理期间被修改，请重试")
+        raise server_error(e)
+    except Exception as e:
+        raise server_error(e)
+
+
+# ==================== 集群容量接口 ====================
+
+@app.get("/api/quota-tiers", response_model=ApiResponse)
+async def list_quota_tiers():
+    """查询可用的配额档位及其完整 hard 配额"""
+    tiers = {name: dict(settings.quota_tier(name)) for name in settings.quota_tiers}
+    return respond(ApiResponse(success=True, message=f"共 {len(tiers)} 个配额档位", data={"tiers": tiers}))
+
+
+@app.get("/api/capacity/gpu", response_model=ApiResponse)
+async def get_gpu_capacity():
+    """查询当前集群（?cluster=）各 GPU 资源的容量、已分配配额和剩余可分配量"""
+    index = gpu_capacity_indexes.get()
+    return respond(ApiResponse(
+        success=True,
+        message="GPU 容量索引已同步" if index.ready else "GPU 容量索引尚未同步",
+        data={
+            "cluster": cluster_registry.validate(current_cluster.get()),
+            "mode": settings.gpu_capacity_mode,
+            "ready": index.ready,
+            "resources": index.summary()
+        }
+    ))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,95 @@
+import threading
+from typing import Dict, Tuple
+
+
+LabelValues = Tuple[Tuple[str, str], ...]
+
+
+def _labels_key(labels: Dict[str, str]) -> LabelValues:
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Metric:
+    """指标基类：按标签组合保存数值"""
+    
+    metric_type = "untyped"
+    
+    def __init__(self, name: str, documentation: str):
+        self.name = name
+        self.documentation = documentation
+        self._lock = threading.Lock()
+        self._values: Dict[LabelValues, float] = {}
+    
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(_labels_key(labels), 0.0)
+    
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for labels, value in items:
+            if labels:
+                label_str = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{self.name}{{{label_str}}} {value:g}")
+            else:
+                lines.append(f"{self.name} {value:g}")
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """只增计数器"""
+    
+    metric_type = "counter"
+    
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+
+class Gauge(_Metric):
+    """可任意设置的瞬时值"""
+    
+    metric_type = "gauge"
+    
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[_labels_key(labels)] = value
+    
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = _labels_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+    
+    def dec(self, amount: float = 1.0, **labels) -> None:
+        self.inc(-amount, **labels)
+
+
+class Registry:
+    """进程内指标注册表，以 Prometheus 文本格式输出"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+    
+    def _register(self, cls, name: str, documentation: str):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, documentation)
+            return metric
+    
+    def counter(self, name: str, documentation: str) -> Counter:
+        return self._register(Counter, name, documentation)
+    
+    def gauge(self, name: str, documentation: str) -> Gauge:
+        return self._register(Gauge, name, documentation)
+    
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
@@ -1,5 +1,5 @@
 from pydantic import BaseModel, EmailStr, Field
-from typing import Optional, Dict
+from typing import Optional, Dict, List
 
 
 class UserCreate(BaseModel):
@@ -21,11 +21,14 @@ class UserResponse(BaseModel):
     username: str
     password: Optional[str] = None  # 仅在创建或重置密码时返回
     login_url: Optional[str] = None
+    ready: Optional[bool] = None  # 等待 Dex 就绪时返回：新配置是否已生效
+    rollout_seconds: Optional[float] = None  # 等待 Dex 就绪时返回：滚动更新耗时
 
 
 class ProjectCreate(BaseModel):
     """创建项目请求模型"""
     owner_email: EmailStr = Field(..., description="项目所有者邮箱")
+    tier: Optional[str] = Field(None, description="配额档位（QUOTA_TIERS 中的名称），其余参数在档位基础上覆盖")
     cpu_limit: Optional[str] = Field(None, description="CPU 限制，例如：2")
     memory_limit: Optional[str] = Field(None, description="内存限制（GiB），例如：4")
     storage_size: Optional[str] = Field(None, description="存储大小（GiB），例如：10")
@@ -53,6 +56,7 @@ class ProjectCreate(BaseModel):
 
 class ProjectUpdate(BaseModel):
     """更新项目资源限制请求模型"""
+    tier: Optional[str] = Field(None, description="切换到的配额档位，其余参数在档位基础上覆盖")
     cpu_limit: Optional[str] = Field(None, description="CPU 限制")
     memory_limit: Optional[str] = Field(None, description="内存限制（GiB）")
     storage_size: Optional[str] = Field(None, description="存储大小（GiB）")
@@ -81,6 +85,7 @@ class ProjectResponse(BaseModel):
     owner: str
     namespace: str
     resources: dict
+    warnings: Optional[List[str]] = None  # GPU 容量校验等非致命警告
 
 
 class ResourceQuota(BaseModel):
@@ -91,6 +96,12 @@ class ResourceQuota(BaseModel):
     storage: Optional[str] = None
 
 
+class FaultInjectionUpdate(BaseModel):
+    """故障注入规则（覆盖配置中的 fault_injection，仅用于测试）"""
+    rules: Dict[str, dict] = Field(..., description="{\"API 组.方法名\" 通配: 规则}，按顺序取第一个匹配的规则")
+    seed: Optional[int] = Field(None, description="随机种子，指定后故障序列可重现")
+
+
 class ApiResponse(BaseModel):
     """通用 API 响应模型"""
     success: bool
@@ -0,0 +1,248 @@
+import asyncio
+import gc
+import os
+import signal
+import sys
+import threading
+import time
+import tracemalloc
+import zlib
+from collections import Counter
+from typing import Any, Dict, List, Optional, Tuple
+from xml.sax.saxutils import escape
+
+from config import settings
+from deletion_tracker import deletion_tracker
+from idempotency import idempotency
+from k8s_client import cluster_registry
+from user_index import user_indexes
+
+
+# 单个调用栈最多记录的帧数（从最内层开始截断）
+MAX_STACK_DEPTH = 128
+
+# cpu：按进程 CPU 时间采样（SIGPROF），空闲时几乎不采样；wall：按墙钟时间采样（SIGALRM），包括等待中的线程
+_TIMERS = {
+    "cpu": (signal.ITIMER_PROF, signal.SIGPROF),
+    "wall": (signal.ITIMER_REAL, signal.SIGALRM),
+}
+
+
+class ProfilerBusy(Exception):
+    """已有采样或内存跟踪在进行中（对应 HTTP 409）"""
+
+
+class SamplingProfiler:
+    """
+    基于信号的调用栈采样器
+    
+    定时器信号在主线程中触发处理函数，每次用 sys._current_frames() 记录所有线程的调用栈，
+    不修改被采样的代码，也不像 cProfile 那样跟踪每次函数调用；开销与采样频率和线程数成正比，
+    默认 100 Hz 时远低于 1% CPU。同一时间只允许一次采样。
+    结果按 "线程;外层函数;…;内层函数 次数" 折叠（collapsed stacks），可直接生成火焰图。
+    """
+    
+    def __init__(self):
+        self._busy = threading.Lock()
+        self._counts: Counter = Counter()
+        self._labels: Dict[Any, str] = {}
+        self._thread_names: Dict[int, str] = {}
+        self._main_ident = threading.main_thread().ident
+        self.samples = 0
+    
+    def _label(self, code) -> str:
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+        return label
+    
+    def _refresh_thread_names(self) -> None:
+        """
+        在事件循环中刷新线程名映射
+        threading.enumerate() 需要获取 threading 模块的锁，在信号处理函数中调用可能与被打断的代码死锁，
+        因此 _sample 只读这里生成的字典
+        """
+        self._thread_names = {thread.ident: thread.name for thread in threading.enumerate()}
+    
+    def _sample(self, signum, frame) -> None:
+        thread_names = self._thread_names
+        for ident, top in sys._current_frames().items():
+            # 主线程当前的帧是本处理函数，取被信号打断的帧
+            current = frame if ident == self._main_ident else top
+            stack: List[str] = []
+            while current is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(self._label(current.f_code))
+                current = current.f_back
+            if stack:
+                stack.append(thread_names.get(ident) or f"thread-{ident}")
+                self._counts[tuple(reversed(stack))] += 1
+        self.samples += 1
+    
+    async def profile(self, seconds: float, mode: str = "cpu") -> Dict[Tuple[str, ...], int]:
+        """
+        采样 seconds 秒，返回 {(线程, 外层函数, …, 内层函数): 采样次数}
+        信号处理函数只能在主线程注册，需在主线程的事件循环中调用
+        """
+        if threading.current_thread() is not threading.main_thread():
+            raise RuntimeError("采样器只能在主线程的事件循环中启动")
+        if not self._busy.acquire(blocking=False):
+            raise ProfilerBusy("已有采样在进行中")
+        timer, signum = _TIMERS[mode]
+        interval = settings.profile_interval_ms / 1000
+        self._counts = Counter()
+        self.samples = 0
+        self._refresh_thread_names()
+        previous = signal.signal(signum, self._sample)
+        # 被信号打断的系统调用自动重启，不影响其他线程中的 I/O
+        signal.siginterrupt(signum, False)
+        try:
+            signal.setitimer(timer, interval, interval)
+            # 信号可能由其他线程接收，主线程阻塞在事件循环的 select 中时不会执行 Python 处理函数，
+            # 按采样间隔唤醒事件循环
+            deadline = time.monotonic() + seconds
+            while (remaining := deadline - time.monotonic()) > 0:
+                await asyncio.sleep(min(interval, remaining))
+                self._refresh_thread_names()
+        finally:
+            signal.setitimer(timer, 0)
+            signal.signal(signum, previous)
+            self._busy.release()
+        return dict(self._counts)
+
+
+def render_collapsed(stacks: Dict[Tuple[str, ...], int]) -> str:
+    """折叠格式，每行 "帧;帧;帧 次数"（flamegraph.pl、speedscope 可直接读取）"""
+    lines = [f"{';'.join(frames)} {count}" for frames, count in sorted(stacks.items(), key=lambda item: -item[1])]
+    return "\n".join(lines) + "\n"
+
+
+def render_flamegraph(stacks: Dict[Tuple[str, ...], int], title: str, width: int = 1200) -> str:
+    """生成 SVG 火焰图：每层一行，宽度与采样次数成正比，鼠标悬停显示函数名和占比"""
+    root: Dict[str, Any] = {"count": 0, "children": {}}
+    for frames, count in stacks.items():
+        node = root
+        node["count"] += count
+        for name in frames:
+            node = node["children"].setdefault(name, {"count": 0, "children": {}})
+            node["count"] += count
+    
+    total = root["count"] or 1
+    scale = width / total
+    rects: List[Tuple[float, int, float, str, int]] = []
+    
+    def layout(node: Dict[str, Any], x: float, depth: int) -> None:
+        for name, child in sorted(node["children"].items()):
+            w = child["count"] * scale
+            if w >= 0.5:
+                rects.append((x, depth, w, name, child["count"]))
+                layout(child, x, depth + 1)
+            x += w
+    
+    layout(root, 0.0, 0)
+    row = 16
+    top = 32
+    height = top + row * (max((depth for _, depth, _, _, _ in rects), default=0) + 1) + 8
+    parts = [
+        f'<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" font-family="monospace" font-size="11">',
+        f'<text x="{width / 2}" y="20" text-anchor="middle" font-size="14">{escape(title)}</text>',
+    ]
+    for x, depth, w, name, count in rects:
+        y = height - 8 - row * (depth + 1)
+        # 按函数名取色，同一函数在各处颜色一致
+        hue = zlib.crc32(name.encode()) % 60
+        chars = int((w - 4) / 7)
+        text = name if len(name) <= chars else (name[:chars - 2] + ".." if chars > 2 else "")
+        parts.append(
+            f'<g><title>{escape(name)} ({count} 次, {count * 100 / total:.2f}%)</title>'
+            f'<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{row - 1}" fill="hsl({hue},80%,60%)" rx="2"/>'
+            f'<text x="{x + 3:.1f}" y="{y + 11}">{escape(text)}</text></g>'
+        )
+    parts.append("</svg>")
+    return "\n".join(parts)
+
+
+# ---------- 内存 ----------
+
+_tracing = threading.Lock()
+
+
+def _rss_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def cache_sizes() -> Dict[str, Any]:
+    """各缓存的条目数"""
+    clusters: Dict[str, Dict[str, Any]] = {}
+    indexes = user_indexes.loaded()
+    for name in cluster_registry.initialized():
+        kube_client = cluster_registry.client(name)
+        clusters[name] = {
+            "profiles": len(kube_client.profile_informer),
+            "nodes": len(kube_client.node_informer),
+        }
+        if name in indexes:
+            clusters[name]["user_index"] = indexes[name].stats()
+    return {
+        "clusters": clusters,
+        "idempotency_entries": len(idempotency.backend),
+        "deletion_operations": len(deletion_tracker),
+    }
+
+
+async def memory_report(seconds: float = 0, top: int = 20, group_by: str = "lineno") -> Dict[str, Any]:
+    """
+    内存诊断：进程 RSS、GC 状态、缓存大小，以及 tracemalloc 统计的分配位置排行
+    
+    tracemalloc 会让分配变慢数倍，平时不开启：seconds > 0 时只在这段时间内跟踪，
+    排行为这段时间内分配且仍未释放的内存（用于定位增长）；进程已通过 PYTHONTRACEMALLOC 开启跟踪时直接取快照。
+    group_by 为 lineno / filename / traceback。
+    """
+    report: Dict[str, Any] = {
+        "rss_bytes": _rss_bytes(),
+        "gc": {"counts": gc.get_count(), "collections": [item["collections"] for item in gc.get_stats()]},
+        "caches": cache_sizes(),
+        "tracemalloc": None,
+    }
+    if not tracemalloc.is_tracing() and seconds <= 0:
+        return report
+    
+    if not _tracing.acquire(blocking=False):
+        raise ProfilerBusy("已有内存跟踪在进行中")
+    started_here = not tracemalloc.is_tracing()
+    try:
+        if started_here:
+            tracemalloc.start(16 if group_by == "traceback" else 1)
+            await asyncio.sleep(seconds)
+        started = time.monotonic()
+        snapshot = tracemalloc.take_snapshot()
+        traced, peak = tracemalloc.get_traced_memory()
+    finally:
+        # 请求被取消时也要停止跟踪，否则之后的所有分配都会变慢
+        if started_here:
+            tracemalloc.stop()
+        _tracing.release()
+    
+    snapshot = snapshot.filter_traces((
+        tracemalloc.Filter(False, tracemalloc.__file__),
+        tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+        tracemalloc.Filter(False, "<unknown>"),
+    ))
+    allocators = []
+    for stat in snapshot.statistics(group_by)[:top]:
+        frames = stat.traceback.format() if group_by == "traceback" else [str(stat.traceback[0])]
+        allocators.append({"location": frames, "size_bytes": stat.size, "count": stat.count})
+    report["tracemalloc"] = {
+        "window_seconds": seconds if started_here else None,
+        "traced_bytes": traced,
+        "peak_bytes": peak,
+        "snapshot_ms": round((time.monotonic() - started) * 1000, 1),
+        "top": allocators,
+    }
+    return report
+
+
+profiler = SamplingProfiler()
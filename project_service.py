@@ -1,7 +1,13 @@
 import re
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, List
 from k8s_client import k8s_client
 from config import settings
+from gpu_capacity import gpu_capacity_indexes, is_gpu_key
+from quantity import normalize_hard
+from deletion_tracker import deletion_tracker
+from audit import audit_log
+from admission import admission
+from journal import journal, JournalOperation
 
 
 class ProjectService:
@@ -12,22 +18,19 @@ class ProjectService:
         """将邮箱转换为 Profile 名称"""
         return re.sub(r'[.@]', '-', email)
     
-    def create_project(
-        self,
-        owner_email: str,
+    @staticmethod
+    def build_hard_resources(
         cpu_limit: Optional[str] = None,
         memory_limit: Optional[str] = None,
         storage_size: Optional[str] = None,
-        resources: Optional[Dict[str, str]] = None
-    ) -> Dict[str, Any]:
-        """
-        创建项目（Profile）
-        """
-        profile_name = self.email_to_profile_name(owner_email)
-        
-        # 检查 Profile 是否已存在
-        if k8s_client.get_profile(profile_name):
-            raise ValueError(f"项目 {profile_name} 已存在")
+        resources: Optional[Dict[str, str]] = None,
+        tier: Optional[str] = None
+    ) -> Dict[str, str]:
+        """根据创建参数构建新项目的 ResourceQuota hard 配额，取值不合法时抛出 ValueError"""
+        if tier:
+            # 档位在加载配置时已生成完整的 hard 配额，其余参数在其基础上覆盖
+            return ProjectService.merge_hard_resources(
+                settings.quota_tier(tier), cpu_limit, memory_limit, storage_size, resources)
         
         # 使用默认值或提供的值
         cpu = cpu_limit or settings.default_cpu_limit
@@ -43,17 +46,9 @@ class ProjectService:
         
         # 添加额外的资源配置（如 GPU）
         if resources:
-            # GPU 检测模式
-            gpu_patterns = ['nvidia.com', 'amd.com/gpu', 'gpu']
-            has_gpu_config = any(
-                any(pattern in key.lower() for pattern in gpu_patterns)
-                for key in resources.keys()
-            )
-            
-            if has_gpu_config:
+            if any(is_gpu_key(key) for key in resources):
                 # 如果 resources 中有 GPU 配置，将 config 中定义的所有 GPU 键设为 0
-                gpu_keys_from_config = settings.gpu_resource_keys
-                for gpu_key in gpu_keys_from_config:
+                for gpu_key in settings.gpu_resource_keys:
                     hard_resources[gpu_key] = "0"
             
             # 应用用户提供的资源配置（会覆盖上面设置的 0）
@@ -61,10 +56,91 @@ class ProjectService:
         else:
             # 如果没有提供 resources，使用默认 GPU 配置
             default_gpu = settings.default_gpu_limit
-            gpu_keys_from_config = settings.gpu_resource_keys
-            for gpu_key in gpu_keys_from_config:
+            for gpu_key in settings.gpu_resource_keys:
                 hard_resources[gpu_key] = default_gpu
         
+        return normalize_hard(hard_resources)
+    
+    @staticmethod
+    def merge_hard_resources(
+        hard: Dict[str, str],
+        cpu_limit: Optional[str] = None,
+        memory_limit: Optional[str] = None,
+        storage_size: Optional[str] = None,
+        resources: Optional[Dict[str, str]] = None,
+        tier: Optional[str] = None
+    ) -> Dict[str, str]:
+        """
+        将更新参数合并到现有 hard 配额，返回新的配额字典，取值不合法时抛出 ValueError
+        指定 tier 时先切换到档位配额（现有 GPU 键全部置 0），其余参数在其基础上覆盖
+        """
+        if tier:
+            tier_hard = settings.quota_tier(tier)
+            hard = {key: "0" if is_gpu_key(key) else value for key, value in hard.items()}
+            hard.update(tier_hard)
+        else:
+            hard = dict(hard)
+        
+        changes = {}
+        if cpu_limit:
+            changes['cpu'] = cpu_limit
+        if memory_limit:
+            changes['memory'] = f"{memory_limit}Gi" if not memory_limit.endswith('Gi') else memory_limit
+        if storage_size:
+            changes['requests.storage'] = f"{storage_size}Gi" if not storage_size.endswith('Gi') else storage_size
+        
+        # 更新其他资源配置（如 GPU）
+        if resources:
+            # resources 中有 GPU 键时，其余 GPU 键（现有的和 config 中定义的）全部设为 0
+            if any(is_gpu_key(key) for key in resources):
+                for gpu_key in list(hard):
+                    if is_gpu_key(gpu_key):
+                        hard[gpu_key] = "0"
+                for gpu_key in settings.gpu_resource_keys:
+                    hard[gpu_key] = "0"
+            
+            # 应用用户提供的资源配置（会覆盖上面设置的 0）
+            changes.update(resources)
+        
+        # 只校验本次提供的取值，现有配额已由 API Server 校验过
+        hard.update(normalize_hard(changes))
+        return hard
+    
+    def create_project(
+        self,
+        owner_email: str,
+        cpu_limit: Optional[str] = None,
+        memory_limit: Optional[str] = None,
+        storage_size: Optional[str] = None,
+        resources: Optional[Dict[str, str]] = None,
+        wait_for_deletion: bool = False,
+        tier: Optional[str] = None
+    ) -> Dict[str, Any]:
+        """
+        创建项目（Profile）
+        
+        同名项目正在删除（命名空间 Terminating）时：wait_for_deletion 为 True 则等待删除完成后创建，
+        否则抛出 ValueError
+        """
+        profile_name = self.email_to_profile_name(owner_email)
+        # 先校验配额参数，非法取值不必等到访问集群
+        hard_resources = self.build_hard_resources(cpu_limit, memory_limit, storage_size, resources, tier)
+        
+        pending = deletion_tracker.pending(profile_name)
+        if pending is not None:
+            if not wait_for_deletion:
+                raise ValueError(f"项目 {profile_name} 正在删除中（操作 {pending.id}），请等待删除完成后再创建")
+            with admission.slot("namespace_wait"):
+                finished = pending.wait(settings.project_deletion_timeout)
+            if not finished:
+                raise TimeoutError(f"等待项目 {profile_name} 删除完成超时")
+            if pending.state != "completed":
+                raise ValueError(f"项目 {profile_name} 删除未完成（{pending.state}），无法重新创建")
+        
+        # 检查 Profile 是否已存在
+        if k8s_client.get_profile(profile_name):
+            raise ValueError(f"项目 {profile_name} 已存在")
+        
         # 创建 ConfigMap
         configmap_data = {
             "apiVersion": "v1",
@@ -79,6 +155,28 @@ class ProjectService:
             }
         }
         
+        # GPU 容量校验并预占（reject 模式下超额会抛出 ValueError）
+        warnings = self._create_profile(profile_name, owner_email, hard_resources, check_capacity=True)
+        
+        return {
+            "name": profile_name,
+            "owner": owner_email,
+            "namespace": profile_name,
+            "resources": hard_resources,
+            "warnings": warnings
+        }
+    
+    def _create_profile(
+        self,
+        profile_name: str,
+        owner_email: str,
+        hard_resources: Dict[str, str],
+        check_capacity: bool = False
+    ) -> List[str]:
+        """
+        创建 Profile，等待命名空间就绪后创建 AuthorizationPolicy
+        check_capacity 为 True 时先做 GPU 容量校验，返回容量警告
+        """
         # 创建 Profile
         profile_data = {
             "apiVersion": "kubeflow.org/v1beta1",
@@ -97,30 +195,69 @@ class ProjectService:
             }
         }
         
-        result = k8s_client.create_profile(profile_data)
-        
+        with journal.operation("create_project", profile_name, {"owner": owner_email}) as op:
+            with gpu_capacity_indexes.get().reserve(profile_name, hard_resources, check_capacity) as warnings:
+                with admission.slot("profile_write"):
+                    result = k8s_client.create_profile(profile_data)
+            op.step("profile")
+            audit_log.change("project", profile_name, "create", after=hard_resources)
+            self._finish_profile(profile_name, op)
+        return warnings
+    
+    @staticmethod
+    def _finish_profile(profile_name: str, op: JournalOperation) -> None:
+        """等待 Profile 控制器创建命名空间，然后创建 AuthorizationPolicy"""
         # 等待命名空间创建
         import time
         max_retries = 30
-        for i in range(max_retries):
-            if k8s_client.namespace_exists(profile_name):
-                break
-            time.sleep(1)
-        else:
-            raise TimeoutError(f"等待命名空间 {profile_name} 创建超时")
+        with admission.slot("namespace_wait"):
+            for i in range(max_retries):
+                if k8s_client.namespace_exists(profile_name):
+                    break
+                time.sleep(1)
+            else:
+                raise TimeoutError(f"等待命名空间 {profile_name} 创建超时")
+        op.step("namespace")
         
         # 创建 AuthorizationPolicy
         try:
             k8s_client.create_authorization_policy(profile_name)
+            op.step("authorization_policy")
         except Exception as e:
             print(f"警告：创建 AuthorizationPolicy 失败: {e}")
+    
+    def recover(self, op: JournalOperation) -> str:
+        """
+        恢复中断的项目创建（由 journal 在启动时调用）
+        Profile 存在时继续等待命名空间并创建 AuthorizationPolicy；
+        Profile 不存在（未创建，或创建后已被删除）时视为未执行，不再重建命名空间相关资源
+        """
+        if not k8s_client.get_profile(op.target):
+            return "rolled_back"
+        if not op.done("authorization_policy"):
+            self._finish_profile(op.target, op)
+        return "resumed"
+    
+    def restore_project(self, profile_name: str, owner_email: str, hard_resources: Dict[str, str]) -> str:
+        """
+        按导出的原始配额恢复项目：不存在则创建，存在则覆盖 hard 配额
+        返回: "created" / "updated" / "unchanged"（与 restore_users 的统计键一致）
+        """
+        profile = k8s_client.get_profile(profile_name)
+        if not profile:
+            self._create_profile(profile_name, owner_email, dict(hard_resources))
+            return "created"
         
-        return {
-            "name": profile_name,
-            "owner": owner_email,
-            "namespace": profile_name,
-            "resources": hard_resources
-        }
+        quota_spec = profile['spec'].setdefault('resourceQuotaSpec', {})
+        if quota_spec.get('hard') == hard_resources:
+            return "unchanged"
+        before = quota_spec.get('hard') or {}
+        quota_spec['hard'] = dict(hard_resources)
+        with gpu_capacity_indexes.get().reserve(profile_name, hard_resources, check=False):
+            with admission.slot("profile_write"):
+                k8s_client.update_profile(profile_name, profile)
+        audit_log.change("project", profile_name, "restore_update", before=before, after=hard_resources)
+        return "updated"
     
     def update_project_resources(
         self,
@@ -128,78 +265,56 @@ class ProjectService:
         cpu_limit: Optional[str] = None,
         memory_limit: Optional[str] = None,
         storage_size: Optional[str] = None,
-        resources: Optional[Dict[str, str]] = None
+        resources: Optional[Dict[str, str]] = None,
+        tier: Optional[str] = None
     ) -> Dict[str, Any]:
-        """更新项目资源限制"""
+        """更新项目资源限制（指定 tier 时切换到该档位，其余参数在档位基础上覆盖）"""
         profile = k8s_client.get_profile(profile_name)
         if not profile:
             raise ValueError(f"项目 {profile_name} 不存在")
         
         # 更新资源配额
-        hard = profile['spec'].get('resourceQuotaSpec', {}).get('hard', {})
-        
-        if cpu_limit:
-            hard['cpu'] = cpu_limit
-        if memory_limit:
-            hard['memory'] = f"{memory_limit}Gi" if not memory_limit.endswith('Gi') else memory_limit
-        if storage_size:
-            hard['requests.storage'] = f"{storage_size}Gi" if not storage_size.endswith('Gi') else storage_size
-        
-        # 更新其他资源配置（如 GPU）
-        if resources:
-            # 从配置中获取 GPU 资源键列表
-            gpu_keys_from_config = settings.gpu_resource_keys
-            
-            # 检查 resources 中是否有任何看起来像 GPU 的键
-            # GPU 键通常包含这些特征：nvidia.com, amd.com/gpu, 或者常见的 GPU 型号
-            gpu_patterns = ['nvidia.com', 'amd.com/gpu', 'gpu']
-            has_gpu_config = any(
-                any(pattern in key.lower() for pattern in gpu_patterns)
-                for key in resources.keys()
-            )
-            
-            if has_gpu_config:
-                # 找出 hard 中所有看起来像 GPU 的键
-                existing_gpu_keys = [
-                    key for key in hard.keys()
-                    if any(pattern in key.lower() for pattern in gpu_patterns)
-                ]
-                
-                # 将所有现有的 GPU 键设为 0（包括不在 config 中的）
-                for gpu_key in existing_gpu_keys:
-                    hard[gpu_key] = "0"
-                
-                # 同时确保 config 中定义的 GPU 键也设为 0（即使之前不存在）
-                for gpu_key in gpu_keys_from_config:
-                    hard[gpu_key] = "0"
-            
-            # 应用用户提供的资源配置（会覆盖上面设置的 0）
-            hard.update(resources)
+        before = profile['spec'].get('resourceQuotaSpec', {}).get('hard', {})
+        hard = self.merge_hard_resources(before, cpu_limit, memory_limit, storage_size, resources, tier)
         
         if 'resourceQuotaSpec' not in profile['spec']:
             profile['spec']['resourceQuotaSpec'] = {}
         profile['spec']['resourceQuotaSpec']['hard'] = hard
         
-        result = k8s_client.update_profile(profile_name, profile)
+        # GPU 容量校验并预占（reject 模式下超额会抛出 ValueError）
+        with gpu_capacity_indexes.get().reserve(profile_name, hard) as warnings:
+            with admission.slot("profile_write"):
+                result = k8s_client.update_profile(profile_name, profile)
+        audit_log.change("project", profile_name, "update", before=before, after=hard)
         
         return {
             "name": profile_name,
             "owner": profile['spec']['owner']['name'],
             "namespace": profile_name,
-            "resources": hard
+            "resources": hard,
+            "warnings": warnings
         }
     
-    def delete_project(self, profile_name: str) -> Dict[str, str]:
-        """删除项目（Profile）"""
-        profile = k8s_client.get_profile(profile_name)
-        if not profile:
-            raise ValueError(f"项目 {profile_name} 不存在")
-        
-        k8s_client.delete_profile(profile_name)
+    def delete_project(self, profile_name: str, wait: bool = False) -> Dict[str, Any]:
+        """
+        删除项目（Profile），命名空间的终止在后台跟踪
+        wait 为 True 时等待命名空间删除完成（或超时）后返回
+        """
+        operation = deletion_tracker.delete(profile_name)
+        if wait:
+            with admission.slot("namespace_wait"):
+                operation.wait(settings.project_deletion_timeout)
         
+        messages = {
+            "running": "项目删除已开始，命名空间正在终止",
+            "completed": "项目删除成功",
+            "failed": "项目删除失败",
+            "timeout": "等待命名空间终止超时",
+        }
         return {
             "name": profile_name,
-            "message": "项目删除成功"
+            "message": messages[operation.state],
+            "operation": operation.to_dict()
         }
     
     def get_project(self, profile_name: str) -> Optional[Dict[str, Any]]:
@@ -217,6 +332,24 @@ class ProjectService:
             "resources": hard
         }
     
+    def list_projects(self) -> List[Dict[str, Any]]:
+        """列出所有项目（优先读取 informer 缓存）"""
+        informer = k8s_client.profile_informer
+        if informer.synced.is_set():
+            profiles = informer.items()
+        else:
+            profiles = k8s_client.list_profiles().get('items') or []
+        
+        return [
+            {
+                "name": profile['metadata']['name'],
+                "owner": profile['spec'].get('owner', {}).get('name'),
+                "namespace": profile['metadata']['name'],
+                "resources": profile['spec'].get('resourceQuotaSpec', {}).get('hard', {})
+            }
+            for profile in profiles
+        ]
+    
     def get_project_by_email(self, email: str) -> Optional[Dict[str, Any]]:
         """根据邮箱获取项目"""
         profile_name = self.email_to_profile_name(email)
@@ -225,3 +358,5 @@ class ProjectService:
 
 project_service = ProjectService()
 
+journal.register("create_project", project_service.recover)
+
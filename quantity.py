@@ -0,0 +1,59 @@
+import re
+from decimal import Decimal, InvalidOperation
+from functools import lru_cache
+from typing import Any, Dict
+
+# Kubernetes 资源数量：<数字><后缀>，后缀为二进制（Ki…Ei）、十进制（n u m k M G T P E）或指数（e3、E-2）
+_QUANTITY = re.compile(r"([+-]?(?:\d+\.?\d*|\.\d+))(Ki|Mi|Gi|Ti|Pi|Ei|n|u|m|k|M|G|T|P|E|[eE][+-]?\d+)?")
+
+_MULTIPLIERS = {
+    None: Decimal(1),
+    "n": Decimal("1e-9"), "u": Decimal("1e-6"), "m": Decimal("1e-3"),
+    "k": Decimal(10) ** 3, "M": Decimal(10) ** 6, "G": Decimal(10) ** 9,
+    "T": Decimal(10) ** 12, "P": Decimal(10) ** 15, "E": Decimal(10) ** 18,
+    "Ki": Decimal(2) ** 10, "Mi": Decimal(2) ** 20, "Gi": Decimal(2) ** 30,
+    "Ti": Decimal(2) ** 40, "Pi": Decimal(2) ** 50, "Ei": Decimal(2) ** 60,
+}
+
+
+@lru_cache(maxsize=4096)
+def _parse(text: str) -> Decimal:
+    match = _QUANTITY.fullmatch(text)
+    if match is None:
+        raise ValueError(f"无效的资源数量: {text!r}")
+    number, suffix = match.groups()
+    try:
+        if suffix is not None and suffix[0] in "eE" and suffix not in _MULTIPLIERS:
+            return Decimal(number + suffix)
+        return Decimal(number) * _MULTIPLIERS[suffix]
+    except InvalidOperation:
+        raise ValueError(f"无效的资源数量: {text!r}")
+
+
+def parse_quantity(value: Any) -> Decimal:
+    """
+    解析 Kubernetes 资源数量（如 "500m"、"4Gi"、"1e3"），返回 Decimal，非法值抛出 ValueError
+    与 kubernetes.utils.parse_quantity 结果一致；配额中反复出现的取值有缓存，解析只需一次查表
+    """
+    return _parse(str(value).strip())
+
+
+def normalize_quantity(value: Any) -> str:
+    """校验资源数量并返回去除空白的字符串（YAML 中的数字也转为字符串），非法值抛出 ValueError"""
+    text = str(value).strip()
+    _parse(text)
+    return text
+
+
+def normalize_hard(hard: Dict[str, Any]) -> Dict[str, str]:
+    """校验 ResourceQuota hard 配额的每个取值（不能为负数），返回规范化后的新字典"""
+    normalized = {}
+    for key, value in hard.items():
+        try:
+            text = normalize_quantity(value)
+        except ValueError:
+            raise ValueError(f"配额 {key} 的取值无效: {value!r}")
+        if _parse(text) < 0:
+            raise ValueError(f"配额 {key} 不能为负数: {value!r}")
+        normalized[key] = text
+    return normalized
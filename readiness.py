@@ -0,0 +1,191 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import orjson
+from kubernetes.client.rest import ApiException
+
+from config import settings
+from k8s_client import KubernetesClient, cluster_registry
+from metrics import registry
+from user_index import user_indexes
+
+
+dependency_up = registry.gauge(
+    "kubeflow_manager_dependency_up", "依赖检查结果（1 正常，0 异常），由就绪检查线程定期更新")
+readiness_check_seconds = registry.gauge(
+    "kubeflow_manager_readiness_check_seconds", "最近一次就绪检查的耗时（秒）")
+
+# 只返回对象的 metadata，检查 Secret、ConfigMap 是否存在时不传输数据内容
+_METADATA_ONLY = "application/json;as=PartialObjectMetadata;g=meta.k8s.io;v=v1,application/json"
+
+
+def _get(kube_client: KubernetesClient, path: str, metadata_only: bool = False) -> Dict[str, Any]:
+    """直接 GET（不经过重试和熔断，检查结果应反映 API Server 的当前状态）"""
+    response = kube_client.api_client.call_api(
+        path, "GET",
+        header_params={"Accept": _METADATA_ONLY if metadata_only else "application/json"},
+        auth_settings=["BearerToken"],
+        _return_http_data_only=True,
+        _preload_content=False,
+        _request_timeout=settings.readiness_timeout,
+    )
+    return orjson.loads(response.data)
+
+
+def _check_api_server(kube_client: KubernetesClient) -> Tuple[bool, str]:
+    version = _get(kube_client, "/version")
+    return True, version.get("gitVersion", "")
+
+
+def _check_dex_configmap(kube_client: KubernetesClient) -> Tuple[bool, str]:
+    _get(kube_client, f"/api/v1/namespaces/{settings.dex_namespace}/configmaps/{settings.dex_configmap_name}", True)
+    return True, f"{settings.dex_namespace}/{settings.dex_configmap_name}"
+
+
+def _check_dex_secret(kube_client: KubernetesClient) -> Tuple[bool, str]:
+    _get(kube_client, f"/api/v1/namespaces/{settings.dex_namespace}/secrets/{settings.dex_secret_name}", True)
+    return True, f"{settings.dex_namespace}/{settings.dex_secret_name}"
+
+
+def _check_dex_deployment(kube_client: KubernetesClient) -> Tuple[bool, str]:
+    deployment = _get(
+        kube_client, f"/apis/apps/v1/namespaces/{settings.dex_namespace}/deployments/{settings.dex_deployment_name}")
+    available = (deployment.get("status") or {}).get("availableReplicas") or 0
+    replicas = (deployment.get("spec") or {}).get("replicas", 1)
+    return available > 0, f"{available}/{replicas} 可用"
+
+
+def _check_profile_crd(kube_client: KubernetesClient) -> Tuple[bool, str]:
+    # 通过 API 发现接口检查，不需要读取 CRD 的集群权限
+    resources = _get(kube_client, "/apis/kubeflow.org/v1beta1").get("resources") or []
+    if any(resource.get("name") == "profiles" for resource in resources):
+        return True, "kubeflow.org/v1beta1 profiles"
+    return False, "kubeflow.org/v1beta1 中没有 profiles"
+
+
+def _check_informers(kube_client: KubernetesClient) -> Tuple[bool, Dict[str, Any]]:
+    """已启动的 informer 是否已同步，且最近 readiness_max_staleness 秒内收到过 API Server 的响应"""
+    informers = [kube_client.profile_informer, kube_client.node_informer]
+    index = user_indexes.loaded().get(kube_client.cluster_name)
+    if index is not None:
+        informers.append(index.dex_informer)
+    now = time.time()
+    ok = True
+    details = {}
+    for informer in informers:
+        status = informer.status()
+        if not status["running"]:
+            continue
+        age = now - status["last_contact_at"] if status["last_contact_at"] else None
+        fresh = status["synced"] and age is not None and age <= settings.readiness_max_staleness
+        ok = ok and fresh
+        details[informer.name] = {
+            "synced": status["synced"],
+            "objects": status["objects"],
+            "seconds_since_contact": round(age, 1) if age is not None else None,
+            "fresh": fresh,
+        }
+    return ok, details
+
+
+CHECKS: Dict[str, Callable[[KubernetesClient], Tuple[bool, Any]]] = {
+    "api_server": _check_api_server,
+    "dex_configmap": _check_dex_configmap,
+    "dex_secret": _check_dex_secret,
+    "dex_deployment": _check_dex_deployment,
+    "profile_crd": _check_profile_crd,
+    "informers": _check_informers,
+}
+
+
+class ReadinessChecker:
+    """
+    就绪检查
+    
+    后台线程每 readiness_interval 秒检查一次各集群的依赖（API Server、Dex ConfigMap/Secret/Deployment、
+    Profile CRD、informer 缓存是否新鲜），/ready 只读取缓存的结果，探针请求不会访问集群。
+    默认集群的全部检查通过才算就绪，其他集群的结果只用于展示。
+    """
+    
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._result: Optional[Dict[str, Any]] = None
+    
+    @staticmethod
+    def _check_cluster(name: str) -> Dict[str, Any]:
+        kube_client: Optional[KubernetesClient] = None
+        checks = {}
+        for check, func in CHECKS.items():
+            started = time.perf_counter()
+            try:
+                if check == "api_server":
+                    # 客户端创建失败（如 kubeconfig 无效）同样记为 API Server 检查失败，不影响其他集群的检查
+                    kube_client = cluster_registry.client(name)
+                    ok, detail = func(kube_client)
+                elif kube_client is None or (check != "informers" and not checks["api_server"]["ok"]):
+                    # API Server 不可达时其余请求必然失败，不再逐项等待超时
+                    ok, detail = False, "API Server 不可达，未检查"
+                else:
+                    ok, detail = func(kube_client)
+            except ApiException as e:
+                ok, detail = False, "不存在" if e.status == 404 else f"{e.status} {e.reason}"
+            except Exception as e:
+                ok, detail = False, str(e)
+            checks[check] = {"ok": ok, "detail": detail, "ms": round((time.perf_counter() - started) * 1000, 1)}
+            dependency_up.set(1 if ok else 0, cluster=name, check=check)
+        return {"ready": all(item["ok"] for item in checks.values()), "checks": checks}
+    
+    def check(self) -> Dict[str, Any]:
+        """立即执行一次检查并更新缓存的结果"""
+        started = time.perf_counter()
+        names = cluster_registry.names()
+        with ThreadPoolExecutor(max_workers=len(names)) as pool:
+            clusters = dict(zip(names, pool.map(self._check_cluster, names)))
+        elapsed = time.perf_counter() - started
+        readiness_check_seconds.set(elapsed)
+        default = clusters.get(settings.default_cluster)
+        self._result = {
+            "ready": bool(default and default["ready"]),
+            "checked_at": time.time(),
+            "duration_ms": round(elapsed * 1000, 1),
+            "clusters": clusters,
+        }
+        return self._result
+    
+    def result(self) -> Dict[str, Any]:
+        """
+        最近一次检查的结果（不访问集群）
+        尚未完成首次检查，或检查线程停止更新超过 3 个间隔时视为未就绪
+        """
+        result = self._result
+        if result is None:
+            return {"ready": False, "reason": "尚未完成首次检查"}
+        age = time.time() - result["checked_at"]
+        if age > 3 * settings.readiness_interval:
+            return dict(result, ready=False, reason=f"检查结果已过期（{age:.0f} 秒前）")
+        return result
+    
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="readiness-checker", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        self._stop.set()
+    
+    def _run(self) -> None:
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                print(f"警告：就绪检查失败: {e}")
+            if self._stop.wait(settings.readiness_interval):
+                return
+
+
+readiness = ReadinessChecker()
@@ -0,0 +1,298 @@
+import csv
+import io
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Callable, Dict, List, Optional
+
+import yaml
+
+from config import settings
+from k8s_client import bind_cluster
+from user_service import user_service
+from project_service import project_service
+
+
+_FALSE_VALUES = {"", "0", "false", "no", "n", "否"}
+_QUOTA_FIELDS = ("cpu_limit", "memory_limit", "storage_size", "resources", "tier")
+
+
+def _is_resource_column(column: str) -> bool:
+    """CSV 中包含 "/" 或以 requests./limits. 开头的列视为额外资源键"""
+    return "/" in column or column.startswith(("requests.", "limits."))
+
+
+def _truthy(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).strip().lower() not in _FALSE_VALUES
+
+
+def load_desired_state(content: str, fmt: str = "yaml") -> Dict[str, Any]:
+    """
+    解析期望状态文件，返回 {"users": [...], "projects": [...], "prune": bool}
+    
+    YAML 格式：
+        users:    [{email, username?, password?, reset_password?}]
+        projects: [{owner_email, cpu_limit?, memory_limit?, storage_size?, resources?, tier?}]
+        prune: false    # 为 true 时删除文件中未列出的用户和项目
+    
+    CSV 格式：每行一个用户，默认同时创建项目（project 列为 false 时跳过），
+    列：email, username, password, cpu_limit, memory_limit, storage_size, tier，
+    以及任意资源键列（如 requests.nvidia.com/l4）
+    """
+    if fmt == "csv":
+        users, projects = [], []
+        for row in csv.DictReader(io.StringIO(content)):
+            row = {k.strip(): (v or "").strip() for k, v in row.items() if k}
+            if not row.get("email"):
+                continue
+            users.append({
+                "email": row["email"],
+                "username": row.get("username") or None,
+                "password": row.get("password") or None,
+                "reset_password": _truthy(row.get("reset_password", "")),
+            })
+            if not _truthy(row.get("project", "true")):
+                continue
+            resources = {k: v for k, v in row.items() if _is_resource_column(k) and v}
+            projects.append({
+                "owner_email": row["email"],
+                "cpu_limit": row.get("cpu_limit") or None,
+                "memory_limit": row.get("memory_limit") or None,
+                "storage_size": row.get("storage_size") or None,
+                "resources": resources or None,
+                "tier": row.get("tier") or None,
+            })
+        return {"users": users, "projects": projects, "prune": False}
+    
+    if fmt != "yaml":
+        raise ValueError(f"不支持的格式: {fmt}")
+    
+    data = yaml.safe_load(content) or {}
+    if not isinstance(data, dict):
+        raise ValueError("期望状态文件必须是包含 users/projects 的 YAML 映射")
+    
+    users = []
+    for item in data.get("users") or []:
+        if not item.get("email"):
+            raise ValueError(f"用户缺少 email: {item}")
+        users.append({
+            "email": item["email"],
+            "username": item.get("username"),
+            "password": item.get("password"),
+            "reset_password": bool(item.get("reset_password", False)),
+        })
+    
+    projects = []
+    for item in data.get("projects") or []:
+        if not item.get("owner_email"):
+            raise ValueError(f"项目缺少 owner_email: {item}")
+        projects.append({
+            "owner_email": item["owner_email"],
+            "cpu_limit": _quantity_str(item.get("cpu_limit")),
+            "memory_limit": _quantity_str(item.get("memory_limit")),
+            "storage_size": _quantity_str(item.get("storage_size")),
+            "resources": {k: str(v) for k, v in (item.get("resources") or {}).items()} or None,
+            "tier": item.get("tier"),
+        })
+    
+    return {"users": users, "projects": projects, "prune": bool(data.get("prune", False))}
+
+
+def _quantity_str(value: Any) -> Optional[str]:
+    """YAML 中的数字配额统一转为字符串"""
+    return None if value is None else str(value)
+
+
+class Reconciler:
+    """
+    声明式同步：对比期望状态与当前 Dex 用户、Profile，只应用差异
+    
+    用户变更合并为一次 Dex 写入和一次重启，Profile 变更并行执行。
+    """
+    
+    def plan(self, desired: Dict[str, Any]) -> Dict[str, Any]:
+        """计算变更计划（不修改集群），计划中不包含明文密码"""
+        prune = desired.get("prune", False)
+        
+        current_users = {u["email"]: u for u in user_service.list_users()}
+        desired_users = {u["email"]: u for u in desired.get("users", [])}
+        
+        user_plan = {"create": [], "update": [], "delete": []}
+        unchanged_users = 0
+        for email, item in desired_users.items():
+            current = current_users.get(email)
+            if current is None:
+                user_plan["create"].append({
+                    "email": email,
+                    "username": item.get("username") or user_service.extract_username(email),
+                })
+                continue
+            change = {"email": email}
+            if item.get("username") and item["username"] != current.get("username"):
+                change["username"] = item["username"]
+            if item.get("reset_password"):
+                change["reset_password"] = True
+            if len(change) > 1:
+                user_plan["update"].append(change)
+            else:
+                unchanged_users += 1
+        if prune:
+            user_plan["delete"] = sorted(set(current_users) - set(desired_users))
+        
+        current_projects = {p["name"]: p for p in project_service.list_projects()}
+        desired_projects = {}
+        for item in desired.get("projects", []):
+            desired_projects[project_service.email_to_profile_name(item["owner_email"])] = item
+        
+        project_plan = {"create": [], "update": [], "delete": []}
+        unchanged_projects = 0
+        for name, item in desired_projects.items():
+            quota_args = [item.get(field) for field in _QUOTA_FIELDS]
+            current = current_projects.get(name)
+            if current is None:
+                project_plan["create"].append({
+                    "name": name,
+                    "owner": item["owner_email"],
+                    "resources": project_service.build_hard_resources(*quota_args),
+                })
+                continue
+            merged = project_service.merge_hard_resources(current["resources"], *quota_args)
+            if merged != current["resources"]:
+                project_plan["update"].append({
+                    "name": name,
+                    "owner": current["owner"],
+                    "from": current["resources"],
+                    "to": merged,
+                })
+            else:
+                unchanged_projects += 1
+        if prune:
+            project_plan["delete"] = sorted(set(current_projects) - set(desired_projects))
+        
+        return {
+            "users": user_plan,
+            "projects": project_plan,
+            "unchanged": {"users": unchanged_users, "projects": unchanged_projects},
+        }
+    
+    def apply(
+        self,
+        desired: Dict[str, Any],
+        plan: Optional[Dict[str, Any]] = None,
+        user_batch_size: int = 0,
+        concurrency: Optional[int] = None,
+        progress: Optional[Callable[[str, int, int], None]] = None
+    ) -> Dict[str, Any]:
+        """
+        按计划应用变更，返回计划与执行结果
+        
+        - user_batch_size: 每次 Dex 写入的用户数，0 表示全部合并为一次写入
+        - concurrency: 并行处理项目的线程数（默认 settings.profile_concurrency）
+        - progress: 进度回调 progress(阶段, 已完成数, 总数)，阶段为 users / projects
+        """
+        started = time.monotonic()
+        if plan is None:
+            plan = self.plan(desired)
+        
+        desired_users = {u["email"]: u for u in desired.get("users", [])}
+        desired_projects = {
+            project_service.email_to_profile_name(p["owner_email"]): p
+            for p in desired.get("projects", [])
+        }
+        
+        # 1. 用户：按批合并 Dex 写入（默认一次）
+        user_plan = plan["users"]
+        creates = [
+            {
+                "email": item["email"],
+                "username": item["username"],
+                "password": desired_users[item["email"]].get("password"),
+            }
+            for item in user_plan["create"]
+        ]
+        updates = []
+        for item in user_plan["update"]:
+            update = {"email": item["email"], "username": item.get("username")}
+            if item.get("reset_password"):
+                update["password"] = (
+                    desired_users[item["email"]].get("password") or user_service.generate_password()
+                )
+            updates.append(update)
+        
+        changes = [("create", item) for item in creates] + [("update", item) for item in updates]
+        changes += [("delete", email) for email in user_plan["delete"]]
+        batch_size = user_batch_size or len(changes) or 1
+        user_results: List[Dict[str, Any]] = []
+        user_batches: List[Dict[str, Any]] = []
+        for offset in range(0, len(changes), batch_size):
+            batch = changes[offset:offset + batch_size]
+            batch_started = time.monotonic()
+            user_results += user_service.apply_changes(
+                [item for action, item in batch if action == "create"],
+                [item for action, item in batch if action == "update"],
+                [item for action, item in batch if action == "delete"]
+            )
+            user_batches.append({"users": len(batch), "elapsed_ms": int((time.monotonic() - batch_started) * 1000)})
+            if progress:
+                progress("users", offset + len(batch), len(changes))
+        
+        # 2. 项目：并行创建/更新/删除，单个失败不影响其他项目
+        project_plan = plan["projects"]
+        tasks = [("create", item["name"]) for item in project_plan["create"]]
+        tasks += [("update", item["name"]) for item in project_plan["update"]]
+        tasks += [("delete", name) for name in project_plan["delete"]]
+        
+        project_results: List[Dict[str, Any]] = []
+        errors: List[Dict[str, str]] = []
+        
+        def run(task):
+            action, name = task
+            task_started = time.monotonic()
+            try:
+                self._apply_project(action, name, desired_projects.get(name))
+                error = None
+            except Exception as e:
+                error = str(e)
+            result = {"name": name, "action": action, "elapsed_ms": int((time.monotonic() - task_started) * 1000)}
+            if error is not None:
+                return None, {**result, "error": error}
+            return result, None
+        
+        if tasks:
+            workers = min(len(tasks), concurrency or settings.profile_concurrency)
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = [pool.submit(bind_cluster(run), task) for task in tasks]
+                for done, future in enumerate(as_completed(futures), 1):
+                    result, error = future.result()
+                    if result:
+                        project_results.append(result)
+                    else:
+                        errors.append(error)
+                    if progress:
+                        progress("projects", done, len(tasks))
+        
+        return {
+            "plan": plan,
+            "results": {
+                "users": user_results,
+                "user_batches": user_batches,
+                "projects": project_results,
+                "errors": errors,
+            },
+            "elapsed_ms": int((time.monotonic() - started) * 1000),
+        }
+    
+    @staticmethod
+    def _apply_project(action: str, name: str, source: Optional[Dict[str, Any]]) -> None:
+        if action == "delete":
+            project_service.delete_project(name)
+            return
+        quota_args = {field: source.get(field) for field in _QUOTA_FIELDS}
+        if action == "create":
+            project_service.create_project(owner_email=source["owner_email"], **quota_args)
+        else:
+            project_service.update_project_resources(profile_name=name, **quota_args)
+
+
+reconciler = Reconciler()
@@ -0,0 +1,224 @@
+import functools
+import random
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Dict, Optional, Tuple
+
+from kubernetes.client.rest import ApiException
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+
+import k8s_accounting
+from config import settings
+from fault_injection import fault_injector
+from metrics import registry
+
+
+# 读请求可重试的状态码（0 表示连接层错误）
+RETRYABLE_READ_STATUSES = {0, 429, 500, 502, 503, 504}
+# 写请求只在这些状态码下重试：409 需配合 resourceVersion 刷新，429/503 表示请求未被处理
+RETRYABLE_WRITE_STATUSES = {409, 429, 503}
+# 计入熔断错误率的状态码（4xx 业务错误如 404/409 不算 API Server 故障）
+FAILURE_STATUSES = {0, 429, 500, 502, 503, 504}
+
+CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+_STATE_VALUES = {CLOSED: 0, OPEN: 1, HALF_OPEN: 2}
+
+circuit_state = registry.gauge(
+    "kubeflow_manager_circuit_state", "熔断器状态（0=closed, 1=open, 2=half_open）")
+circuit_rejections = registry.counter(
+    "kubeflow_manager_circuit_rejections_total", "熔断打开时被直接拒绝的调用次数")
+k8s_retries = registry.counter(
+    "kubeflow_manager_k8s_retries_total", "Kubernetes API 调用重试次数")
+k8s_failures = registry.counter(
+    "kubeflow_manager_k8s_failures_total", "Kubernetes API 调用失败次数（计入熔断的错误）")
+
+
+class CircuitOpenError(Exception):
+    """熔断器打开，调用被快速拒绝"""
+    
+    def __init__(self, group: str, retry_after: float, cluster: str = "default"):
+        self.group = group
+        self.cluster = cluster
+        self.retry_after = retry_after
+        super().__init__(f"Kubernetes API（{cluster}/{group}）暂时不可用，请在 {int(retry_after) + 1} 秒后重试")
+
+
+def _status_of(error: Exception) -> Optional[int]:
+    """提取异常对应的状态码，非 API 错误返回 None"""
+    if isinstance(error, ApiException):
+        return error.status or 0
+    if isinstance(error, (Urllib3HTTPError, ConnectionError, TimeoutError)):
+        return 0
+    return None
+
+
+class CircuitBreaker:
+    """
+    按集群和 API 组划分的熔断器
+    
+    在滑动时间窗口内统计调用结果，请求数达到下限且错误率超过阈值时打开，
+    打开期间直接拒绝；冷却结束后进入半开状态，放行一个探测请求决定关闭或重新打开。
+    """
+    
+    def __init__(self, group: str, cluster: str = "default"):
+        self.group = group
+        self.cluster = cluster
+        self._lock = threading.Lock()
+        self._outcomes: Deque[Tuple[float, bool]] = deque()
+        self._failures = 0
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        circuit_state.set(0, cluster=cluster, group=group)
+    
+    def _set_state(self, state: str) -> None:
+        self.state = state
+        circuit_state.set(_STATE_VALUES[state], cluster=self.cluster, group=self.group)
+    
+    def _trim(self, now: float) -> None:
+        horizon = now - settings.circuit_window_seconds
+        while self._outcomes and self._outcomes[0][0] < horizon:
+            _, ok = self._outcomes.popleft()
+            if not ok:
+                self._failures -= 1
+    
+    def before_call(self) -> None:
+        """调用前检查，熔断打开时抛出 CircuitOpenError"""
+        with self._lock:
+            if self.state == CLOSED:
+                return
+            now = time.monotonic()
+            remaining = self._opened_at + settings.circuit_open_seconds - now
+            if self.state == OPEN and remaining > 0:
+                circuit_rejections.inc(cluster=self.cluster, group=self.group)
+                raise CircuitOpenError(self.group, remaining, self.cluster)
+            # 冷却结束：半开状态只放行一个探测请求
+            if self._probe_in_flight:
+                circuit_rejections.inc(cluster=self.cluster, group=self.group)
+                raise CircuitOpenError(self.group, 1.0, self.cluster)
+            self._set_state(HALF_OPEN)
+            self._probe_in_flight = True
+    
+    def record(self, ok: bool) -> None:
+        with self._lock:
+            now = time.monotonic()
+            if self.state == HALF_OPEN:
+                self._probe_in_flight = False
+                if ok:
+                    self._outcomes.clear()
+                    self._failures = 0
+                    self._set_state(CLOSED)
+                else:
+                    self._opened_at = now
+                    self._set_state(OPEN)
+                return
+            
+            self._outcomes.append((now, ok))
+            if not ok:
+                self._failures += 1
+            self._trim(now)
+            total = len(self._outcomes)
+            if (
+                self.state == CLOSED
+                and total >= settings.circuit_min_requests
+                and self._failures / total >= settings.circuit_error_threshold
+            ):
+                self._opened_at = now
+                self._set_state(OPEN)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            self._trim(time.monotonic())
+            return {
+                "state": self.state,
+                "requests": len(self._outcomes),
+                "failures": self._failures,
+            }
+
+
+_breakers: Dict[Tuple[str, str], CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def get_breaker(group: str, cluster: str = "default") -> CircuitBreaker:
+    with _breakers_lock:
+        breaker = _breakers.get((cluster, group))
+        if breaker is None:
+            breaker = _breakers[(cluster, group)] = CircuitBreaker(group, cluster)
+        return breaker
+
+
+def breaker_states() -> Dict[str, Dict[str, Dict[str, Any]]]:
+    """返回 {集群: {API 组: 状态}}"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    states: Dict[str, Dict[str, Dict[str, Any]]] = {}
+    for b in breakers:
+        states.setdefault(b.cluster, {})[b.group] = b.snapshot()
+    return states
+
+
+def _backoff_delay(attempt: int, error: Exception) -> float:
+    """带抖动的指数退避（full jitter），429 时优先使用服务端的 Retry-After"""
+    if isinstance(error, ApiException) and error.status == 429 and error.headers:
+        retry_after = error.headers.get("Retry-After")
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), settings.k8s_retry_max_delay)
+    ceiling = min(settings.k8s_retry_max_delay, settings.k8s_retry_base_delay * (2 ** attempt))
+    return random.uniform(0, ceiling)
+
+
+def resilient(group: str, idempotent: bool = True, refresh: Optional[str] = None) -> Callable:
+    """
+    为 KubernetesClient 方法添加重试和熔断
+    
+    - group: API 组，与实例的 cluster_name 一起决定使用哪个熔断器
+    - idempotent: 读请求在连接错误、429、5xx 时重试；写请求只在 409/429/503 时重试
+    - refresh: 写请求遇到 409 时调用的方法名，签名与被装饰方法相同，
+      返回刷新 resourceVersion 后的 (args, kwargs)；未提供则 409 不重试
+    
+    配置了故障注入时，每次尝试前先注入延迟或错误（见 fault_injection.py）
+    """
+    retryable = RETRYABLE_READ_STATUSES if idempotent else RETRYABLE_WRITE_STATUSES
+    
+    def decorator(func: Callable) -> Callable:
+        @functools.wraps(func)
+        def wrapper(self, *args, **kwargs):
+            cluster = getattr(self, "cluster_name", "default")
+            breaker = get_breaker(group, cluster)
+            attempt = 0
+            while True:
+                breaker.before_call()
+                operation = k8s_accounting.set_operation(f"{group}.{func.__name__}")
+                try:
+                    fault_injector.inject(cluster, f"{group}.{func.__name__}", kwargs.get("watch", False))
+                    result = func(self, *args, **kwargs)
+                except Exception as e:
+                    status = _status_of(e)
+                    if status is None:
+                        breaker.record(True)
+                        raise
+                    failed = status in FAILURE_STATUSES
+                    breaker.record(not failed)
+                    if failed:
+                        k8s_failures.inc(cluster=cluster, group=group, status=status)
+                    
+                    attempt += 1
+                    if status not in retryable or attempt >= settings.k8s_retry_max_attempts:
+                        raise
+                    if status == 409:
+                        if not refresh:
+                            raise
+                        args, kwargs = getattr(self, refresh)(*args, **kwargs)
+                    k8s_retries.inc(cluster=cluster, group=group, method=func.__name__)
+                    time.sleep(_backoff_delay(attempt, e))
+                    continue
+                finally:
+                    k8s_accounting.reset_operation(operation)
+                breaker.record(True)
+                return result
+        
+        return wrapper
+    
+    return decorator
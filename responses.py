@@ -0,0 +1,27 @@
+from typing import Any
+
+import orjson
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel
+
+
+class FastJSONResponse(ORJSONResponse):
+    """
+    默认响应类
+    
+    pydantic 模型直接用 pydantic-core 序列化，其余内容用 orjson，
+    不经过 jsonable_encoder 的逐字段转换。
+    """
+    
+    def render(self, content: Any) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.model_dump_json().encode("utf-8")
+        return orjson.dumps(content, option=orjson.OPT_NON_STR_KEYS)
+
+
+def respond(content: Any, status_code: int = 200, **kwargs) -> FastJSONResponse:
+    """
+    直接返回响应对象，跳过 FastAPI 对 response_model 的再次校验和编码
+    路由上的 response_model 仍然保留，用于生成 API 文档
+    """
+    return FastJSONResponse(content, status_code=status_code, **kwargs)
@@ -0,0 +1,162 @@
+import os
+import threading
+import time
+import zlib
+from typing import Any, Dict, Optional, Tuple
+
+import orjson
+
+from config import settings
+from k8s_client import cluster_registry
+from user_index import user_indexes
+
+
+# 快照格式版本，格式变化时递增，旧快照被忽略
+SNAPSHOT_VERSION = 1
+
+
+class SnapshotStore:
+    """
+    informer 缓存的启动快照
+    
+    定期把各集群已同步的 Profile、Node 缓存和用户搜索索引（Dex ConfigMap 及解析出的用户）
+    连同 resourceVersion 写入 snapshot_path（orjson + zlib，先写临时文件再原子替换）。
+    启动时先从快照恢复缓存，立即可以提供读服务，随后从保存的 resourceVersion 继续 watch，
+    只有 resourceVersion 已过期（410 Gone）时才重新 list。
+    """
+    
+    def __init__(self):
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._saved_versions: Optional[Tuple] = None
+        self.last_saved_at: Optional[float] = None
+        self.last_size = 0
+    
+    # ---------- 写入 ----------
+    
+    @staticmethod
+    def collect() -> Dict[str, Any]:
+        clusters: Dict[str, Dict[str, Any]] = {}
+        indexes = user_indexes.loaded()
+        for name in cluster_registry.initialized():
+            kube_client = cluster_registry.client(name)
+            data: Dict[str, Any] = {}
+            for key, informer in (("profiles", kube_client.profile_informer), ("nodes", kube_client.node_informer)):
+                dump = informer.dump()
+                if dump is not None:
+                    data[key] = dump
+            if name in indexes:
+                dump = indexes[name].dump()
+                if dump is not None:
+                    data["user_index"] = dump
+            if data:
+                clusters[name] = data
+        return {"version": SNAPSHOT_VERSION, "created_at": time.time(), "clusters": clusters}
+    
+    @staticmethod
+    def _versions(snapshot: Dict[str, Any]) -> Tuple:
+        """各缓存的 resourceVersion，全部未变化时跳过写入"""
+        versions = []
+        for cluster, data in sorted(snapshot["clusters"].items()):
+            for key in ("profiles", "nodes"):
+                if key in data:
+                    versions.append((cluster, key, data[key]["resource_version"]))
+            if "user_index" in data:
+                versions.append((cluster, "user_index", data["user_index"]["dex"]["resource_version"]))
+        return tuple(versions)
+    
+    def save(self) -> bool:
+        """写入快照，缓存自上次写入后没有变化时返回 False"""
+        path = settings.snapshot_path
+        with self._lock:
+            snapshot = self.collect()
+            versions = self._versions(snapshot)
+            if not versions or versions == self._saved_versions:
+                return False
+            payload = zlib.compress(orjson.dumps(snapshot), 1)
+            tmp_path = f"{path}.tmp"
+            with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, path)
+            self._saved_versions = versions
+            self.last_saved_at = snapshot["created_at"]
+            self.last_size = len(payload)
+            return True
+    
+    # ---------- 恢复 ----------
+    
+    @staticmethod
+    def load() -> Optional[Dict[str, Any]]:
+        """读取快照；文件不存在、损坏、版本不符或超过 snapshot_max_age 时返回 None"""
+        path = settings.snapshot_path
+        if not path or not os.path.exists(path):
+            return None
+        try:
+            with open(path, "rb") as f:
+                snapshot = orjson.loads(zlib.decompress(f.read()))
+        except (OSError, zlib.error, orjson.JSONDecodeError) as e:
+            print(f"警告：读取快照 {path} 失败，将重新 list: {e}")
+            return None
+        if snapshot.get("version") != SNAPSHOT_VERSION:
+            return None
+        age = time.time() - snapshot["created_at"]
+        if age > settings.snapshot_max_age:
+            print(f"快照已过期（{age:.0f} 秒前），将重新 list")
+            return None
+        return snapshot
+    
+    def restore(self) -> Dict[str, Dict[str, int]]:
+        """
+        从快照恢复缓存（在启动 informer 之前调用）
+        返回: {集群: {缓存: 对象数量}}；没有可用快照时返回空字典
+        """
+        snapshot = self.load()
+        if snapshot is None:
+            return {}
+        restored: Dict[str, Dict[str, int]] = {}
+        configured = cluster_registry.names()
+        for cluster, data in snapshot["clusters"].items():
+            if cluster not in configured:
+                continue
+            kube_client = cluster_registry.client(cluster)
+            counts = restored[cluster] = {}
+            for key, informer in (("profiles", kube_client.profile_informer), ("nodes", kube_client.node_informer)):
+                if key in data:
+                    informer.restore(data[key])
+                    counts[key] = len(data[key]["items"])
+            if "user_index" in data and settings.user_index_enabled:
+                user_indexes.get(cluster, snapshot=data["user_index"])
+                counts["users"] = len(data["user_index"]["users"])
+        self._saved_versions = self._versions(snapshot)
+        print(f"已从快照恢复缓存（{time.time() - snapshot['created_at']:.0f} 秒前）: {restored}")
+        return restored
+    
+    # ---------- 生命周期 ----------
+    
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="snapshot-writer", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        """停止定期写入并最后写入一次"""
+        self._stop.set()
+        try:
+            self.save()
+        except Exception as e:
+            print(f"警告：写入快照失败: {e}")
+    
+    def _run(self) -> None:
+        while not self._stop.wait(settings.snapshot_interval):
+            try:
+                self.save()
+            except Exception as e:
+                print(f"警告：写入快照失败: {e}")
+
+
+snapshot_store = SnapshotStore()
@@ -0,0 +1,115 @@
+"""
+测试公共夹具
+
+测试不连接集群：kubeconfig 指向一个不存在的地址，默认集群 ApiClient 连接池的 urlopen 被替换为内存中的
+FakeApiServer。请求仍经过 kubernetes 客户端、resilient（重试与熔断）和 k8s_accounting（调用统计与预算），
+与生产环境的调用路径一致。
+"""
+import json
+import os
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import pytest
+import yaml
+from urllib3 import HTTPResponse
+
+_TMP = tempfile.mkdtemp(prefix="kubeflow-manager-tests-")
+_KUBECONFIG = os.path.join(_TMP, "kubeconfig")
+with open(_KUBECONFIG, "w") as f:
+    yaml.safe_dump({
+        "apiVersion": "v1",
+        "kind": "Config",
+        "clusters": [{"name": "test", "cluster": {"server": "https://kube-apiserver.test:6443"}}],
+        "users": [{"name": "test", "user": {"token": "test-token"}}],
+        "contexts": [{"name": "test", "context": {"cluster": "test", "user": "test"}}],
+        "current-context": "test",
+    }, f)
+
+# 在导入任何应用模块之前设置，Settings 在导入 config 时构造
+os.environ.update({
+    "KUBECONFIG_PATH": _KUBECONFIG,
+    "JOURNAL_PATH": os.path.join(_TMP, "journal.db"),
+    "AUDIT_DIR": os.path.join(_TMP, "audit"),
+    "USAGE_SAMPLER_ENABLED": "false",
+    "GPU_CAPACITY_MODE": "off",
+    "IDEMPOTENCY_BACKEND": "memory",
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings, settings_manager  # noqa: E402
+from k8s_client import cluster_registry  # noqa: E402
+
+
+# 以资源复数名结尾的 GET 视为列表请求
+_PLURALS = {"configmaps", "secrets", "namespaces", "resourcequotas", "nodes", "profiles"}
+
+
+class FakeApiServer:
+    """
+    内存中的 API Server
+    
+    对象按 URL 路径保存；GET 对象路径返回该对象，GET 集合路径（如 .../profiles、/api/v1/resourcequotas）
+    返回集合下的所有对象（不处理 labelSelector/fieldSelector）。每次请求记录在 requests 中。
+    """
+    
+    def __init__(self):
+        self.objects: Dict[str, Dict[str, Any]] = {}
+        self.requests: List[Tuple[str, str]] = []
+    
+    def add(self, path: str, obj: Dict[str, Any]) -> None:
+        self.objects[path] = obj
+    
+    def _list(self, path: str) -> Optional[List[Dict[str, Any]]]:
+        plural = path.rsplit("/", 1)[-1]
+        if plural not in _PLURALS:
+            return None
+        # /api/v1/<plural> 同时包含所有命名空间下的对象
+        all_namespaces = path == f"/api/v1/{plural}"
+        items = []
+        for object_path, obj in self.objects.items():
+            parent = object_path.rsplit("/", 1)[0]
+            if parent == path or (all_namespaces and parent.startswith("/api/v1/namespaces/") and parent.endswith(f"/{plural}")):
+                items.append(obj)
+        return items
+    
+    @staticmethod
+    def _response(status: int, body: Dict[str, Any]) -> HTTPResponse:
+        return HTTPResponse(
+            body=json.dumps(body).encode(),
+            status=status,
+            reason="OK" if status == 200 else "Not Found",
+            headers={"Content-Type": "application/json"},
+            preload_content=False,
+        )
+    
+    def urlopen(self, method: str, url: str, *args, **kwargs) -> HTTPResponse:
+        path = urlsplit(url).path
+        self.requests.append((method, path))
+        if method == "GET":
+            if path in self.objects:
+                return self._response(200, self.objects[path])
+            items = self._list(path)
+            if items is not None:
+                return self._response(200, {"kind": "List", "metadata": {"resourceVersion": "1"}, "items": items})
+        return self._response(404, {"kind": "Status", "status": "Failure", "reason": "NotFound", "code": 404})
+
+
+@pytest.fixture
+def api_server(monkeypatch) -> FakeApiServer:
+    """替换默认集群连接池的 urlopen（k8s_accounting 的统计包装在其外层，仍然生效）"""
+    server = FakeApiServer()
+    pool_manager = cluster_registry.client(settings.default_cluster).api_client.rest_client.pool_manager
+    monkeypatch.setattr(pool_manager, "urlopen", server.urlopen)
+    return server
+
+
+@pytest.fixture
+def configure(monkeypatch):
+    """临时修改配置：configure(gpu_capacity_mode="reject", ...)，测试结束后恢复"""
+    def apply(**values: Any) -> None:
+        monkeypatch.setattr(settings_manager, "_active", settings_manager._active.model_copy(update=values))
+    
+    return apply
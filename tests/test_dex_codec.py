@@ -0,0 +1,91 @@
+"""dex_codec：config.yaml 解析与写回（只序列化变化的条目，其余文本原样保留）"""
+import yaml
+from kubernetes import client
+
+from dex_codec import DexConfigCodec
+
+
+CONFIG = """\
+# Dex 配置（由运维维护，注释需要保留）
+issuer: http://dex.auth.svc.cluster.local:5556/dex
+storage:
+  type: kubernetes
+  config:
+    inCluster: true
+staticPasswords:
+- email: "alice@example.com"   # 管理员
+  hashFromEnv: ALICE_HASH
+  username: alice
+- email: bob@example.com
+  hashFromEnv: BOB_HASH
+  username: bob
+oauth2:
+  skipApprovalScreen: true
+"""
+
+
+def configmap(text: str, resource_version: str = "1") -> client.V1ConfigMap:
+    return client.V1ConfigMap(
+        metadata=client.V1ObjectMeta(name="dex", namespace="auth", resource_version=resource_version),
+        data={"config.yaml": text},
+    )
+
+
+def test_round_trip_keeps_untouched_text():
+    codec = DexConfigCodec()
+    cm = configmap(CONFIG)
+    data = codec.loads(cm)
+    assert [user["email"] for user in data["staticPasswords"]] == ["alice@example.com", "bob@example.com"]
+    
+    data["staticPasswords"][1]["hashFromEnv"] = "BOB_HASH_2"
+    data["staticPasswords"].append({"email": "carol@example.com", "hashFromEnv": "CAROL_HASH", "username": "carol"})
+    text = codec.dumps(cm, data)
+    
+    assert yaml.safe_load(text) == data
+    # 未修改的条目、注释和其他顶层键原样保留
+    assert "# Dex 配置（由运维维护，注释需要保留）" in text
+    assert '- email: "alice@example.com"   # 管理员\n' in text
+    assert text.endswith("oauth2:\n  skipApprovalScreen: true\n")
+
+
+def test_written_text_is_reused_on_next_read():
+    codec = DexConfigCodec()
+    cm = configmap(CONFIG)
+    data = codec.loads(cm)
+    del data["staticPasswords"][0]
+    text = codec.dumps(cm, data)
+    
+    reread = codec.loads(configmap(text, resource_version="2"))
+    assert reread == data
+    assert codec.loads(configmap(text, resource_version="2")) == data
+
+
+def test_loads_returns_a_copy():
+    codec = DexConfigCodec()
+    cm = configmap(CONFIG)
+    data = codec.loads(cm)
+    data["staticPasswords"][0]["username"] = "changed"
+    data["storage"]["type"] = "changed"
+    again = codec.loads(cm)
+    assert again["staticPasswords"][0]["username"] == "alice"
+    assert again["storage"]["type"] == "kubernetes"
+
+
+def test_other_changes_fall_back_to_full_dump():
+    codec = DexConfigCodec()
+    cm = configmap(CONFIG)
+    data = codec.loads(cm)
+    data["oauth2"]["skipApprovalScreen"] = False
+    text = codec.dumps(cm, data)
+    assert yaml.safe_load(text) == data
+
+
+def test_missing_static_passwords_block():
+    codec = DexConfigCodec()
+    cm = configmap("issuer: http://dex\n")
+    data = codec.loads(cm)
+    assert "staticPasswords" not in data
+    data["staticPasswords"] = [{"email": "a@example.com", "hashFromEnv": "A_HASH", "username": "a"}]
+    text = codec.dumps(cm, data)
+    assert text.startswith("issuer: http://dex\n")
+    assert yaml.safe_load(text) == data
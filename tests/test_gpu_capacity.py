@@ -0,0 +1,77 @@
+"""GpuCapacityIndex.reserve：并发预占、写入失败撤销、修改已有项目"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from gpu_capacity import GpuCapacityIndex
+
+
+class SyncedInformer:
+    """已同步的 informer 替身，事件由测试直接调用索引的处理函数"""
+    
+    def __init__(self):
+        self.synced = threading.Event()
+        self.synced.set()
+    
+    def add_handler(self, handler) -> None:
+        pass
+
+
+@pytest.fixture
+def index(configure):
+    configure(gpu_capacity_mode="reject", gpu_overcommit_default_ratio=1.0, gpu_overcommit_ratios={})
+    index = GpuCapacityIndex()
+    index.attach(SyncedInformer(), SyncedInformer())
+    index.on_node_event("ADDED", {"metadata": {"name": "gpu-node"}, "status": {"allocatable": {"nvidia.com/l4": "4"}}}, None)
+    return index
+
+
+def committed(index: GpuCapacityIndex) -> int:
+    return index.summary()["nvidia.com/l4"]["committed"]
+
+
+def test_concurrent_reservations_do_not_overcommit(index):
+    def create(n: int) -> bool:
+        try:
+            with index.reserve(f"project-{n}", {"requests.nvidia.com/l4": "1"}):
+                # 模拟 Profile 写入耗时，期间其他请求并发校验
+                time.sleep(0.05)
+            return True
+        except ValueError:
+            return False
+    
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        results = list(pool.map(create, range(8)))
+    assert results.count(True) == 4
+    assert committed(index) == 4
+
+
+def test_failed_write_releases_reservation(index):
+    with pytest.raises(RuntimeError):
+        with index.reserve("project-a", {"requests.nvidia.com/l4": "3"}):
+            raise RuntimeError("写入 Profile 失败")
+    assert committed(index) == 0
+    with index.reserve("project-b", {"requests.nvidia.com/l4": "4"}) as warnings:
+        assert warnings == []
+    assert committed(index) == 4
+
+
+def test_update_counts_only_the_difference(index):
+    with index.reserve("project-a", {"requests.nvidia.com/l4": "3"}):
+        pass
+    with index.reserve("project-a", {"requests.nvidia.com/l4": "4"}):
+        pass
+    assert committed(index) == 4
+    with pytest.raises(ValueError):
+        with index.reserve("project-b", {"requests.nvidia.com/l4": "1"}):
+            pass
+    assert committed(index) == 4
+
+
+def test_warn_mode_reserves_and_returns_warnings(index, configure):
+    configure(gpu_capacity_mode="warn")
+    with index.reserve("project-a", {"requests.nvidia.com/l4": "6"}) as warnings:
+        assert len(warnings) == 1 and "nvidia.com/l4" in warnings[0]
+    assert committed(index) == 6
@@ -0,0 +1,101 @@
+"""Idempotency-Key：重放、请求内容不一致、4xx 缓存、进行中请求被取消"""
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from idempotency import IdempotencyManager
+from models import ApiResponse
+
+
+class Handler:
+    """记录调用次数的路由处理函数（在线程池中执行）"""
+    
+    def __init__(self, delay: float = 0, error: HTTPException = None):
+        self.calls = 0
+        self.delay = delay
+        self.error = error
+    
+    def __call__(self) -> ApiResponse:
+        self.calls += 1
+        time.sleep(self.delay)
+        if self.error is not None:
+            raise self.error
+        return ApiResponse(success=True, message=f"第 {self.calls} 次执行")
+
+
+def test_replay_returns_first_response():
+    manager, handler = IdempotencyManager(), Handler()
+    
+    async def scenario():
+        first = await manager.run("POST /api/users", "key-1", {"email": "a@example.com"}, handler, 201)
+        second = await manager.run("POST /api/users", "key-1", {"email": "a@example.com"}, handler, 201)
+        return first, second
+    
+    first, second = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert second.status_code == first.status_code == 201
+    assert second.body == first.body
+    assert second.headers["Idempotent-Replayed"] == "true"
+    assert "Idempotent-Replayed" not in first.headers
+
+
+def test_same_key_different_payload_rejected():
+    manager, handler = IdempotencyManager(), Handler()
+    
+    async def scenario():
+        await manager.run("POST /api/users", "key-1", {"email": "a@example.com"}, handler)
+        await manager.run("POST /api/users", "key-1", {"email": "b@example.com"}, handler)
+    
+    with pytest.raises(HTTPException) as exc:
+        asyncio.run(scenario())
+    assert exc.value.status_code == 422
+    assert handler.calls == 1
+
+
+def test_client_errors_are_replayed():
+    manager = IdempotencyManager()
+    handler = Handler(error=HTTPException(status_code=400, detail="用户已存在"))
+    
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(HTTPException) as exc:
+                await manager.run("POST /api/users", "key-1", {"email": "a@example.com"}, handler)
+            assert exc.value.status_code == 400
+        return exc.value
+    
+    replayed = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert replayed.headers == {"Idempotent-Replayed": "true"}
+
+
+def test_concurrent_duplicates_run_once():
+    manager, handler = IdempotencyManager(), Handler(delay=0.1)
+    
+    async def scenario():
+        return await asyncio.gather(*(
+            manager.run("POST /api/projects", "key-1", {"owner_email": "a@example.com"}, handler)
+            for _ in range(5)
+        ))
+    
+    responses = asyncio.run(scenario())
+    assert handler.calls == 1
+    assert len({response.body for response in responses}) == 1
+
+
+def test_waiter_runs_when_first_request_is_cancelled():
+    manager, handler = IdempotencyManager(), Handler(delay=0.2)
+    
+    async def scenario():
+        first = asyncio.create_task(manager.run("POST /api/users", "key-1", {}, handler))
+        await asyncio.sleep(0.05)
+        waiter = asyncio.create_task(manager.run("POST /api/users", "key-1", {}, handler))
+        await asyncio.sleep(0.05)
+        first.cancel()
+        # 客户端断开：等待者不能一直挂起，应重新检查缓存并自己执行
+        return await asyncio.wait_for(waiter, 5)
+    
+    response = asyncio.run(scenario())
+    assert response.status_code == 200
+    assert handler.calls == 2
@@ -0,0 +1,62 @@
+"""预写日志：崩溃后恢复、失败操作的处理、清理，以及项目创建的恢复"""
+import pytest
+
+from journal import Journal
+from project_service import project_service
+
+
+@pytest.fixture
+def journal(tmp_path, configure):
+    configure(journal_enabled=True, journal_path=str(tmp_path / "journal.db"), journal_retention_seconds=0)
+    return Journal()
+
+
+def crash_after(journal: Journal, kind: str, target: str, steps):
+    """执行到一半时进程崩溃：写入意图和已完成的步骤，但不结束操作"""
+    op = journal.operation(kind, target, {"target": target}).__enter__()
+    for step in steps:
+        op.step(step, {"step": step})
+    return op
+
+
+def test_recover_resumes_crashed_operation(journal):
+    op = crash_after(journal, "create_user", "a@example.com", ["secret", "configmap"])
+    seen = []
+    
+    def recoverer(pending):
+        seen.append((pending.id, pending.intent, dict(pending.steps)))
+        return "resumed"
+    
+    journal.register("create_user", recoverer)
+    assert journal.recover() == {"resumed": 1}
+    assert seen == [(op.id, {"target": "a@example.com"},
+                     {"secret": {"step": "secret"}, "configmap": {"step": "configmap"}})]
+    assert journal.pending() == []
+    # 恢复后的操作超过保留期（测试中为 0）被清理
+    assert journal.list() == []
+
+
+def test_failed_operation_without_steps_is_not_recovered(journal):
+    journal.register("create_user", lambda op: pytest.fail("不应恢复"))
+    with pytest.raises(RuntimeError):
+        with journal.operation("create_user", "a@example.com", {}):
+            raise RuntimeError("写入 Secret 失败")
+    assert journal.pending() == []
+    assert journal.recover() == {}
+
+
+def test_failed_recovery_is_retried_next_time(journal):
+    crash_after(journal, "create_user", "a@example.com", ["secret"])
+    journal.register("create_user", lambda op: (_ for _ in ()).throw(RuntimeError("API Server 不可达")))
+    assert journal.recover() == {"error": 1}
+    assert [op.status for op in journal.pending()] == ["running"]
+    journal.register("create_user", lambda op: "rolled_back")
+    assert journal.recover() == {"rolled_back": 1}
+
+
+def test_project_recovery_rolls_back_when_profile_is_gone(journal, api_server):
+    # Profile 已创建后进程崩溃，重启前 Profile 又被删除：不能继续创建命名空间相关资源
+    crash_after(journal, "create_project", "alice-example-com", ["profile"])
+    journal.register("create_project", project_service.recover)
+    assert journal.recover() == {"rolled_back": 1}
+    assert api_server.requests == [("GET", "/apis/kubeflow.org/v1beta1/profiles/alice-example-com")]
@@ -0,0 +1,97 @@
+"""
+查询路由的 Kubernetes API 调用预算
+
+k8s_call_budget_mode=fail 时超出预算的调用不会发出、请求返回 500，
+因此每个路由在预算内返回 200 即说明没有引入 N+1 调用。
+"""
+import pytest
+import yaml
+from fastapi.testclient import TestClient
+
+from main import app
+
+
+OWNER = "alice@example.com"
+PROFILE = "alice-example-com"
+
+BUDGETS = {
+    "GET /api/users/{email}": 1,
+    "GET /api/projects/{profile_name}": 1,
+    "GET /api/projects/by-email/{email}": 1,
+    "GET /api/clusters/projects": 1,
+    "GET /api/clusters/quotas": 1,
+    "GET /api/capacity/gpu": 0,
+    "GET /api/quota-tiers": 0,
+}
+
+ROUTES = [
+    (f"/api/users/{OWNER}", "GET /api/users/{email}"),
+    (f"/api/projects/{PROFILE}", "GET /api/projects/{profile_name}"),
+    (f"/api/projects/by-email/{OWNER}", "GET /api/projects/by-email/{email}"),
+    ("/api/clusters/projects", "GET /api/clusters/projects"),
+    (f"/api/clusters/projects?owner={OWNER}", "GET /api/clusters/projects"),
+    ("/api/clusters/quotas", "GET /api/clusters/quotas"),
+    ("/api/capacity/gpu", "GET /api/capacity/gpu"),
+    ("/api/quota-tiers", "GET /api/quota-tiers"),
+]
+
+
+@pytest.fixture
+def client(api_server, configure):
+    """已写入一个用户和一个项目的集群；不进入 TestClient 上下文，不执行 startup（不启动 informer 和后台线程）"""
+    configure(k8s_call_budgets=BUDGETS, k8s_call_budget_mode="fail", k8s_accounting_headers=True)
+    api_server.add("/api/v1/namespaces/auth/configmaps/dex", {
+        "apiVersion": "v1",
+        "kind": "ConfigMap",
+        "metadata": {"name": "dex", "namespace": "auth", "resourceVersion": "1"},
+        "data": {"config.yaml": yaml.safe_dump({
+            "issuer": "http://dex.auth.svc.cluster.local:5556/dex",
+            "staticPasswords": [{"email": OWNER, "username": "alice", "hashFromEnv": "ALICE_HASH"}],
+        })},
+    })
+    api_server.add(f"/apis/kubeflow.org/v1beta1/profiles/{PROFILE}", {
+        "apiVersion": "kubeflow.org/v1beta1",
+        "kind": "Profile",
+        "metadata": {"name": PROFILE, "resourceVersion": "1"},
+        "spec": {
+            "owner": {"kind": "User", "name": OWNER},
+            "resourceQuotaSpec": {"hard": {"cpu": "2", "memory": "4Gi", "requests.nvidia.com/l4": "1"}},
+        },
+    })
+    api_server.add(f"/api/v1/namespaces/{PROFILE}/resourcequotas/kf-resource-quota", {
+        "apiVersion": "v1",
+        "kind": "ResourceQuota",
+        "metadata": {"name": "kf-resource-quota", "namespace": PROFILE},
+        "status": {"hard": {"cpu": "2", "memory": "4Gi"}, "used": {"cpu": "500m", "memory": "1Gi"}},
+    })
+    return TestClient(app)
+
+
+@pytest.mark.parametrize("url, route", ROUTES)
+def test_route_within_budget(client, url, route):
+    response = client.get(url)
+    assert response.status_code == 200, response.text
+    assert int(response.headers["X-K8s-Calls"]) <= BUDGETS[route]
+
+
+def test_lookup_results(client):
+    assert client.get(f"/api/users/{OWNER}").json()["username"] == "alice"
+    assert client.get(f"/api/projects/{PROFILE}").json()["resources"]["requests.nvidia.com/l4"] == "1"
+    projects = client.get(f"/api/clusters/projects?owner={OWNER}").json()["data"]["projects"]
+    assert [(p["name"], p["cluster"]) for p in projects] == [(PROFILE, "default")]
+    assert client.get("/api/clusters/quotas").json()["data"]["total"]["projects"] == 1
+
+
+def test_missing_objects_within_budget(client):
+    assert client.get("/api/users/nobody@example.com").status_code == 404
+    response = client.get("/api/projects/nobody")
+    assert response.status_code == 404
+    assert int(response.headers["X-K8s-Calls"]) <= BUDGETS["GET /api/projects/{profile_name}"]
+
+
+def test_exceeding_budget_fails_without_calling(client, api_server, configure):
+    configure(k8s_call_budgets={"GET /api/projects/{profile_name}": 0})
+    response = client.get(f"/api/projects/{PROFILE}")
+    assert response.status_code == 500
+    assert "超出预算" in response.json()["detail"]
+    assert api_server.requests == []
@@ -0,0 +1,281 @@
+import mmap
+import os
+import re
+import threading
+import time
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+
+import orjson
+
+from config import settings
+from k8s_client import k8s_client, cluster_registry, current_cluster
+from quantity import parse_quantity
+
+
+# Kubeflow profile-controller 为每个 Profile 创建的 ResourceQuota 名称
+PROFILE_QUOTA_NAME = "kf-resource-quota"
+
+# 头部：head（下一个写入位置）、count（有效样本数）、key 数量
+_HEADER_SLOTS = 3
+
+_WINDOW_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400, "w": 604800}
+
+
+def parse_window(window: str) -> int:
+    """解析时间窗口，例如 30m / 12h / 7d，返回秒数"""
+    match = re.fullmatch(r"(\d+)([smhdw])", window.strip())
+    if not match:
+        raise ValueError(f"无效的时间窗口: {window}，示例：30m、12h、7d")
+    return int(match.group(1)) * _WINDOW_UNITS[match.group(2)]
+
+
+def summarize_quotas() -> Dict[str, Any]:
+    """
+    汇总当前集群所有项目配额的 hard 和 used（按资源求和）
+    返回: {"projects": int, "hard": {资源: float}, "used": {资源: float}}
+    """
+    resp = k8s_client.list_resource_quotas(
+        field_selector=f"metadata.name={PROFILE_QUOTA_NAME}",
+        _preload_content=False
+    )
+    summary: Dict[str, Any] = {"projects": 0, "hard": {}, "used": {}}
+    for quota in orjson.loads(resp.data).get("items") or []:
+        summary["projects"] += 1
+        status = quota.get("status") or {}
+        for field in ("hard", "used"):
+            totals = summary[field]
+            for key, value in (status.get(field) or {}).items():
+                try:
+                    totals[key] = totals.get(key, 0.0) + float(parse_quantity(value))
+                except Exception:
+                    continue
+    return summary
+
+
+def merge_quota_summaries(summaries: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """合并多个集群的 summarize_quotas 结果"""
+    merged: Dict[str, Any] = {"projects": 0, "hard": {}, "used": {}}
+    for summary in summaries:
+        merged["projects"] += summary["projects"]
+        for field in ("hard", "used"):
+            for key, value in summary[field].items():
+                merged[field][key] = merged[field].get(key, 0.0) + value
+    return merged
+
+
+class RingBuffer:
+    """
+    定长环形缓冲区
+    
+    每行为 [timestamp, value_1, ..., value_n]，全部以 double 平铺存放在一块连续内存中，
+    每个命名空间占用固定大小：(3 + capacity * (n + 1)) * 8 字节。
+    底层可以是 array（纯内存）或 mmap（文件持久化，重启后保留历史）。
+    """
+    
+    def __init__(self, keys: List[str], capacity: int, path: Optional[str] = None):
+        self.keys = list(keys)
+        self.capacity = capacity
+        self.width = len(self.keys) + 1
+        slots = _HEADER_SLOTS + capacity * self.width
+        self._file = None
+        self._mmap = None
+        
+        if path:
+            size = slots * 8
+            fresh = not os.path.exists(path) or os.path.getsize(path) != size
+            self._file = open(path, "w+b" if fresh else "r+b")
+            if fresh:
+                self._file.truncate(size)
+            self._mmap = mmap.mmap(self._file.fileno(), size)
+            self._buf = memoryview(self._mmap).cast("d")
+            if not fresh and int(self._buf[2]) != len(self.keys):
+                # key 集合发生变化，旧数据无法对应，清空重来
+                fresh = True
+            if fresh:
+                self._buf[0] = 0
+                self._buf[1] = 0
+                self._buf[2] = len(self.keys)
+        else:
+            self._storage = array("d", bytes(slots * 8))
+            self._buf = memoryview(self._storage)
+            self._buf[2] = len(self.keys)
+    
+    def append(self, timestamp: float, values: Dict[str, float]) -> None:
+        head = int(self._buf[0])
+        offset = _HEADER_SLOTS + head * self.width
+        self._buf[offset] = timestamp
+        for i, key in enumerate(self.keys, start=1):
+            self._buf[offset + i] = values.get(key, 0.0)
+        self._buf[0] = (head + 1) % self.capacity
+        self._buf[1] = min(int(self._buf[1]) + 1, self.capacity)
+    
+    def rows(self, since: float = 0.0):
+        """按时间顺序迭代 (timestamp, values) 行"""
+        head = int(self._buf[0])
+        count = int(self._buf[1])
+        start = (head - count) % self.capacity
+        for n in range(count):
+            offset = _HEADER_SLOTS + ((start + n) % self.capacity) * self.width
+            timestamp = self._buf[offset]
+            if timestamp < since:
+                continue
+            yield timestamp, self._buf[offset + 1:offset + self.width]
+    
+    def flush(self) -> None:
+        if self._mmap is not None:
+            self._mmap.flush()
+    
+    @property
+    def nbytes(self) -> int:
+        return self._buf.nbytes
+
+
+class UsageSampler:
+    """
+    配额使用量采样器
+    
+    后台线程定期并发读取每个配置的集群中所有 Profile 命名空间的 ResourceQuota.status.used，
+    记录 CPU、内存以及 settings.gpu_resource_keys 中的 GPU 用量；历史按 (集群, 命名空间) 分别保存。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._buffers: Dict[Tuple[str, str], RingBuffer] = {}
+        self._thread: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.last_sample_at: Optional[float] = None
+    
+    @staticmethod
+    def tracked_keys() -> List[str]:
+        return ["cpu", "memory"] + list(settings.gpu_resource_keys)
+    
+    def _buffer(self, cluster: str, namespace: str, keys: List[str]) -> RingBuffer:
+        buffer = self._buffers.get((cluster, namespace))
+        if buffer is None or buffer.keys != keys:
+            path = None
+            if settings.usage_storage_dir:
+                # 默认集群的文件保持在根目录（兼容已有数据），其他集群放在以集群名命名的子目录
+                directory = settings.usage_storage_dir
+                if cluster != settings.default_cluster:
+                    directory = os.path.join(directory, cluster)
+                os.makedirs(directory, exist_ok=True)
+                path = os.path.join(directory, f"{namespace}.ring")
+            buffer = RingBuffer(keys, settings.usage_retention_points, path)
+            self._buffers[(cluster, namespace)] = buffer
+        return buffer
+    
+    # ---------- 采样 ----------
+    
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="usage-sampler", daemon=True)
+        self._thread.start()
+    
+    def stop(self) -> None:
+        self._stop.set()
+    
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            try:
+                self.sample_once()
+            except Exception as e:
+                print(f"警告：配额使用量采样失败: {e}")
+            self._stop.wait(settings.usage_sample_interval)
+    
+    def sample_once(self) -> int:
+        """对所有集群各采样一次，返回记录的命名空间总数；单个集群失败不影响其他集群"""
+        fan_out = cluster_registry.fan_out(self._sample_cluster)
+        for name, error in fan_out["errors"].items():
+            print(f"警告：集群 {name} 配额使用量采样失败: {error}")
+        self.last_sample_at = time.time()
+        return sum(fan_out["results"].values())
+    
+    def _sample_cluster(self) -> int:
+        """采样当前集群，返回记录的命名空间数量"""
+        cluster = cluster_registry.validate(current_cluster.get())
+        resp = k8s_client.list_resource_quotas(
+            field_selector=f"metadata.name={PROFILE_QUOTA_NAME}",
+            _preload_content=False
+        )
+        quotas = orjson.loads(resp.data).get("items") or []
+        keys = self.tracked_keys()
+        now = time.time()
+        with self._lock:
+            for quota in quotas:
+                namespace = quota["metadata"]["namespace"]
+                used = (quota.get("status") or {}).get("used") or {}
+                values = {}
+                for key in keys:
+                    if key in used:
+                        try:
+                            values[key] = float(parse_quantity(used[key]))
+                        except Exception:
+                            continue
+                buffer = self._buffer(cluster, namespace, keys)
+                buffer.append(now, values)
+                buffer.flush()
+        return len(quotas)
+    
+    # ---------- 查询 ----------
+    
+    def history(
+        self,
+        namespace: str,
+        window: str = "7d",
+        points: int = 200,
+        cluster: Optional[str] = None
+    ) -> Optional[Dict[str, Any]]:
+        """
+        返回集群（默认为当前集群）中命名空间在时间窗口内降采样后的使用量历史
+        每个时间桶给出各资源的平均值和最大值
+        """
+        cluster = cluster_registry.validate(cluster or current_cluster.get())
+        window_seconds = parse_window(window)
+        points = max(1, min(points, settings.usage_retention_points))
+        now = time.time()
+        since = now - window_seconds
+        bucket_seconds = window_seconds / points
+        
+        with self._lock:
+            buffer = self._buffers.get((cluster, namespace))
+            if buffer is None:
+                return None
+            keys = buffer.keys
+            width = len(keys)
+            buckets: Dict[int, List[Any]] = {}
+            for timestamp, values in buffer.rows(since):
+                index = min(int((timestamp - since) / bucket_seconds), points - 1)
+                bucket = buckets.get(index)
+                if bucket is None:
+                    bucket = buckets[index] = [0, [0.0] * width, [0.0] * width]
+                bucket[0] += 1
+                sums, maxes = bucket[1], bucket[2]
+                for i in range(width):
+                    value = values[i]
+                    sums[i] += value
+                    if value > maxes[i]:
+                        maxes[i] = value
+        
+        samples = []
+        for index in sorted(buckets):
+            count, sums, maxes = buckets[index]
+            samples.append({
+                "timestamp": int(since + index * bucket_seconds),
+                "avg": {key: sums[i] / count for i, key in enumerate(keys)},
+                "max": {key: maxes[i] for i, key in enumerate(keys)},
+            })
+        
+        return {
+            "cluster": cluster,
+            "namespace": namespace,
+            "window": window,
+            "bucket_seconds": int(bucket_seconds),
+            "keys": keys,
+            "samples": samples,
+        }
+
+
+usage_sampler = UsageSampler()
@@ -0,0 +1,315 @@
+import bisect
+import threading
+import time
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from kubernetes import client
+
+from config import settings
+from dex_codec import dex_codec
+from informer import Informer
+from k8s_client import KubernetesClient, cluster_registry, current_cluster
+
+
+# 单次变化条目数超过该值时整体重排有序数组
+_BULK_THRESHOLD = 256
+
+
+def _trigrams(text: str) -> Set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _Entry:
+    __slots__ = ("email", "username", "in_dex", "profiles")
+    
+    def __init__(self, email: str):
+        self.email = email
+        self.username: Optional[str] = None
+        self.in_dex = False
+        self.profiles: Set[str] = set()
+    
+    def terms(self) -> Tuple[str, str]:
+        return self.email.lower(), (self.username or "").lower()
+    
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "email": self.email,
+            "username": self.username,
+            "in_dex": self.in_dex,
+            "profiles": sorted(self.profiles),
+        }
+
+
+class UserIndex:
+    """
+    单个集群的用户搜索索引
+    
+    数据来源：Dex ConfigMap 的 staticPasswords（watch）和 Profile 的 owner（profile informer）。
+    - 前缀查询：邮箱、用户名各维护一个有序数组，二分查找
+    - 子串查询：邮箱和用户名的三元组（trigram）倒排集合求交，再逐个确认
+    ConfigMap 变化时只对新增、删除或用户名变化的条目更新倒排。
+    """
+    
+    def __init__(self, kube_client: KubernetesClient):
+        self._client = kube_client
+        self._lock = threading.RLock()
+        self._entries: Dict[str, _Entry] = {}
+        self._emails: List[Tuple[str, str]] = []      # (小写邮箱, 邮箱)，有序
+        self._usernames: List[Tuple[str, str]] = []   # (小写用户名, 邮箱)，有序
+        self._grams: Dict[str, Set[str]] = {}
+        self._dex_synced = threading.Event()
+        self.updated_at: Optional[float] = None
+        
+        selector = f"metadata.name={settings.dex_configmap_name}"
+        namespace = settings.dex_namespace
+        self._dex_informer = Informer(
+            f"dex-configmap-{kube_client.cluster_name}",
+            lambda **kwargs: kube_client.list_configmaps(namespace, field_selector=selector, **kwargs)
+        )
+        self._dex_informer.add_handler(self._on_dex_configmap)
+        kube_client.profile_informer.add_handler(self._on_profile)
+    
+    # ---------- 生命周期 ----------
+    
+    def start(self) -> None:
+        self._dex_informer.start()
+        self._client.profile_informer.start()
+    
+    @property
+    def dex_informer(self) -> Informer:
+        return self._dex_informer
+    
+    @property
+    def ready(self) -> bool:
+        return self._dex_synced.is_set() and self._client.profile_informer.synced.is_set()
+    
+    def wait_ready(self, timeout: float) -> bool:
+        deadline = time.monotonic() + timeout
+        if not self._dex_synced.wait(timeout):
+            return False
+        return self._client.profile_informer.wait_for_sync(max(0.0, deadline - time.monotonic()))
+    
+    # ---------- 快照 ----------
+    
+    def dump(self) -> Optional[Dict[str, Any]]:
+        """导出 Dex ConfigMap 缓存和解析出的用户，Dex 未同步时返回 None"""
+        # 先导出 ConfigMap 再导出用户：用户不会比 ConfigMap 旧，恢复后重放的事件按差异更新，结果一致
+        dex = self._dex_informer.dump()
+        if dex is None:
+            return None
+        with self._lock:
+            users = {email: entry.username for email, entry in self._entries.items() if entry.in_dex}
+        return {"dex": dex, "users": users}
+    
+    def restore(self, snapshot: Dict[str, Any]) -> None:
+        """从快照恢复 Dex 用户，不重新解析 config.yaml（在 start 之前调用）"""
+        self._dex_informer.restore(snapshot["dex"], notify=False)
+        with self._lock:
+            for email, username in snapshot["users"].items():
+                self._update(email, bulk=True, in_dex=True, username=username)
+            self._resort()
+        self._dex_synced.set()
+    
+    # ---------- 增量更新 ----------
+    
+    def _add_terms(self, entry: _Entry, bulk: bool = False) -> None:
+        email_term, username_term = entry.terms()
+        if not bulk:
+            bisect.insort(self._emails, (email_term, entry.email))
+            if username_term:
+                bisect.insort(self._usernames, (username_term, entry.email))
+        for gram in _trigrams(email_term) | _trigrams(username_term):
+            self._grams.setdefault(gram, set()).add(entry.email)
+    
+    def _remove_terms(self, entry: _Entry, bulk: bool = False) -> None:
+        email_term, username_term = entry.terms()
+        if not bulk:
+            self._remove_sorted(self._emails, (email_term, entry.email))
+            if username_term:
+                self._remove_sorted(self._usernames, (username_term, entry.email))
+        for gram in _trigrams(email_term) | _trigrams(username_term):
+            emails = self._grams.get(gram)
+            if emails is not None:
+                emails.discard(entry.email)
+                if not emails:
+                    del self._grams[gram]
+    
+    @staticmethod
+    def _remove_sorted(items: List[Tuple[str, str]], item: Tuple[str, str]) -> None:
+        i = bisect.bisect_left(items, item)
+        if i < len(items) and items[i] == item:
+            del items[i]
+    
+    def _update(self, email: str, bulk: bool = False, **changes) -> None:
+        """
+        修改条目属性并重建该条目的索引项，条目不再有来源时删除
+        bulk 为 True 时不维护有序数组，由调用方最后调用 _resort 整体重排
+        """
+        entry = self._entries.get(email)
+        if entry is None:
+            entry = self._entries[email] = _Entry(email)
+        else:
+            self._remove_terms(entry, bulk)
+        for name, value in changes.items():
+            setattr(entry, name, value)
+        if entry.in_dex or entry.profiles:
+            self._add_terms(entry, bulk)
+        else:
+            del self._entries[email]
+        self.updated_at = time.time()
+    
+    def _resort(self) -> None:
+        self._emails = sorted((email.lower(), email) for email in self._entries)
+        self._usernames = sorted(
+            (entry.username.lower(), email) for email, entry in self._entries.items() if entry.username
+        )
+    
+    def _on_dex_configmap(self, event_type: str, obj: Optional[Dict[str, Any]], old: Optional[Dict[str, Any]]) -> None:
+        users: Dict[str, Optional[str]] = {}
+        if obj is not None:
+            metadata = obj.get("metadata") or {}
+            configmap = client.V1ConfigMap(
+                data=obj.get("data") or {},
+                metadata=client.V1ObjectMeta(
+                    name=metadata.get("name"),
+                    namespace=metadata.get("namespace"),
+                    resource_version=metadata.get("resourceVersion"),
+                ),
+            )
+            token = current_cluster.set(self._client.cluster_name)
+            try:
+                config_data = dex_codec.loads(configmap)
+            finally:
+                current_cluster.reset(token)
+            for user in config_data.get("staticPasswords") or []:
+                if user.get("email"):
+                    users[user["email"]] = user.get("username")
+        
+        with self._lock:
+            removed = [email for email, entry in self._entries.items() if entry.in_dex and email not in users]
+            changed = [
+                (email, username) for email, username in users.items()
+                if email not in self._entries
+                or not self._entries[email].in_dex
+                or self._entries[email].username != username
+            ]
+            # 变化较多时（如首次同步）逐条插入有序数组是 O(n^2)，改为最后整体排序
+            bulk = len(removed) + len(changed) > _BULK_THRESHOLD
+            for email in removed:
+                self._update(email, bulk, in_dex=False, username=None)
+            for email, username in changed:
+                self._update(email, bulk, in_dex=True, username=username)
+            if bulk:
+                self._resort()
+        self._dex_synced.set()
+    
+    def _on_profile(self, event_type: str, obj: Optional[Dict[str, Any]], old: Optional[Dict[str, Any]]) -> None:
+        def owner_of(profile):
+            return ((profile or {}).get("spec") or {}).get("owner", {}).get("name")
+        
+        with self._lock:
+            if old is not None and owner_of(old):
+                entry = self._entries.get(owner_of(old))
+                if entry is not None and old["metadata"]["name"] in entry.profiles:
+                    self._update(entry.email, profiles=entry.profiles - {old["metadata"]["name"]})
+            if obj is not None and owner_of(obj):
+                email = owner_of(obj)
+                entry = self._entries.get(email)
+                profiles = entry.profiles if entry is not None else set()
+                if obj["metadata"]["name"] not in profiles:
+                    self._update(email, profiles=profiles | {obj["metadata"]["name"]})
+    
+    # ---------- 查询 ----------
+    
+    @staticmethod
+    def _prefix(items: List[Tuple[str, str]], q: str, limit: int) -> List[str]:
+        result = []
+        i = bisect.bisect_left(items, (q, ""))
+        while i < len(items) and items[i][0].startswith(q) and len(result) < limit:
+            result.append(items[i][1])
+            i += 1
+        return result
+    
+    def _substring(self, q: str, limit: int) -> List[str]:
+        if len(q) < 3:
+            # 太短无法使用三元组：按邮箱顺序扫描，凑够 limit 个即停止
+            matches = []
+            for email_term, email in self._emails:
+                if q in email_term or q in (self._entries[email].username or "").lower():
+                    matches.append(email)
+                    if len(matches) >= limit:
+                        break
+            return matches
+        
+        postings = [self._grams.get(gram) for gram in _trigrams(q)]
+        if not all(postings):
+            return []
+        postings.sort(key=len)
+        candidates = postings[0].intersection(*postings[1:])
+        matches = []
+        for email in candidates:
+            email_term, username_term = self._entries[email].terms()
+            if q in email_term or q in username_term:
+                matches.append((email_term, email))
+        matches.sort()
+        return [email for _, email in matches[:limit]]
+    
+    def search(self, q: str, mode: str = "auto", limit: int = 50) -> List[Dict[str, Any]]:
+        """
+        搜索用户
+        mode: prefix（邮箱或用户名前缀）/ substring（邮箱或用户名包含）/ auto（先前缀，不足时补充子串匹配）
+        """
+        if mode not in ("prefix", "substring", "auto"):
+            raise ValueError(f"无效的搜索模式: {mode}，可选 prefix / substring / auto")
+        q = q.strip().lower()
+        if not q:
+            raise ValueError("搜索关键字不能为空")
+        
+        with self._lock:
+            emails: List[str] = []
+            if mode in ("prefix", "auto"):
+                for email in self._prefix(self._emails, q, limit) + self._prefix(self._usernames, q, limit):
+                    if email not in emails:
+                        emails.append(email)
+            if mode == "substring" or (mode == "auto" and len(emails) < limit):
+                for email in self._substring(q, limit):
+                    if email not in emails:
+                        emails.append(email)
+            return [self._entries[email].to_dict() for email in emails[:limit]]
+    
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "users": len(self._entries),
+                "trigrams": len(self._grams),
+                "ready": self.ready,
+                "updated_at": self.updated_at,
+            }
+
+
+class UserIndexRegistry:
+    """按集群管理用户搜索索引，首次使用时创建并启动"""
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes: Dict[str, UserIndex] = {}
+    
+    def get(self, cluster: Optional[str] = None, snapshot: Optional[Dict[str, Any]] = None) -> UserIndex:
+        """返回集群的索引；首次创建时先从 snapshot（如有）恢复再启动"""
+        kube_client = cluster_registry.client(cluster or current_cluster.get())
+        with self._lock:
+            index = self._indexes.get(kube_client.cluster_name)
+            if index is None:
+                index = self._indexes[kube_client.cluster_name] = UserIndex(kube_client)
+                if snapshot is not None:
+                    index.restore(snapshot)
+                index.start()
+            return index
+    
+    def loaded(self) -> Dict[str, UserIndex]:
+        """已创建的索引"""
+        with self._lock:
+            return dict(self._indexes)
+
+
+user_indexes = UserIndexRegistry()
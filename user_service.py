@@ -3,11 +3,69 @@ import re
 import base64
 import secrets
 import string
-import yaml
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from passlib.hash import bcrypt
-from typing import Optional, Tuple, Dict, Any
-from k8s_client import k8s_client
+from typing import Optional, Tuple, Dict, Any, Iterable, Iterator, List, Set
+from k8s_client import k8s_client, bind_cluster, cluster_registry, current_cluster
 from config import settings
+from dex_rollout import dex_rollout
+from dex_codec import dex_codec
+from audit import audit_log
+from admission import admission
+from journal import journal, JournalOperation
+
+
+class PendingKeys:
+    """
+    已写入 Secret、尚未被 ConfigMap 引用的密码键（按集群记录，进程内）
+    
+    用户变更先写 Secret 再写 ConfigMap，两次写入之间新键在 Secret 中看起来是孤立的；
+    孤立键清理排除这些键，不会删除并发的用户变更刚写入的密码。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._keys: Counter = Counter()
+    
+    @staticmethod
+    def _items(keys: Iterable[str]) -> List[Tuple[str, str]]:
+        cluster = cluster_registry.validate(current_cluster.get())
+        return [(cluster, key) for key in keys]
+    
+    def acquire(self, keys: Iterable[str]) -> List[Tuple[str, str]]:
+        """写入 Secret 之前调用，返回登记的条目（传给 release）"""
+        items = self._items(keys)
+        with self._lock:
+            self._keys.update(items)
+        return items
+    
+    def release(self, items: List[Tuple[str, str]]) -> None:
+        """ConfigMap 写入之后（或操作失败时）调用"""
+        with self._lock:
+            self._keys.subtract(items)
+            for item in items:
+                if self._keys[item] <= 0:
+                    del self._keys[item]
+    
+    @contextmanager
+    def hold(self, keys: Iterable[str]) -> Iterator[None]:
+        items = self.acquire(keys)
+        try:
+            yield
+        finally:
+            self.release(items)
+    
+    def keys(self) -> Set[str]:
+        """当前集群进行中的密码键"""
+        cluster = cluster_registry.validate(current_cluster.get())
+        with self._lock:
+            return {key for key_cluster, key in self._keys if key_cluster == cluster}
+
+
+pending_keys = PendingKeys()
 
 
 class UserService:
@@ -25,7 +83,8 @@ class UserService:
         哈希密码并返回 Base64 编码
         返回: (base64_hash, env_name)
         """
-        hashed = bcrypt.using(rounds=12, ident="2y").hash(password)
+        with admission.slot("hash"):
+            hashed = bcrypt.using(rounds=12, ident="2y").hash(password)
         hashed_base64 = base64.b64encode(hashed.encode()).decode()
         env_name = password.upper()
         return hashed_base64, env_name
@@ -35,10 +94,42 @@ class UserService:
         """从邮箱提取用户名"""
         return email.split('@')[0]
     
-    def create_user(self, email: str, password: Optional[str] = None, username: Optional[str] = None) -> Dict[str, str]:
+    @staticmethod
+    def load_dex_config() -> Tuple[Any, Dict[str, Any]]:
+        """
+        读取 Dex ConfigMap 并解析 config.yaml
+        返回: (configmap, config_data)
+        """
+        configmap = k8s_client.get_configmap(settings.dex_configmap_name, settings.dex_namespace)
+        if not configmap:
+            raise ValueError(f"ConfigMap {settings.dex_configmap_name} 不存在")
+        
+        config_data = dex_codec.loads(configmap)
+        return configmap, config_data
+    
+    @staticmethod
+    def save_dex_config(configmap: Any, config_data: Dict[str, Any]) -> None:
+        """序列化 config.yaml 并写回 Dex ConfigMap"""
+        configmap.data['config.yaml'] = dex_codec.dumps(configmap, config_data)
+        with admission.slot("dex_write"):
+            k8s_client.update_configmap(settings.dex_configmap_name, settings.dex_namespace, configmap)
+    
+    @staticmethod
+    def referenced_keys(config_data: Dict[str, Any]) -> set:
+        """ConfigMap 中仍被用户引用的密码键（相同密码的用户共用同一个键）"""
+        return {u.get('hashFromEnv') for u in config_data.get('staticPasswords') or []}
+    
+    def create_user(
+        self,
+        email: str,
+        password: Optional[str] = None,
+        username: Optional[str] = None,
+        wait_ready: Optional[bool] = None
+    ) -> Dict[str, Any]:
         """
         创建用户
-        返回: {"email": str, "username": str, "password": str}
+        wait_ready: 是否等待 Dex 滚动更新完成后再返回（None 时使用 settings.dex_rollout_wait）
+        返回: {"email": str, "username": str, "password": str, "ready": bool|None, "rollout_seconds": float|None}
         """
         if not k8s_client.namespace_exists(settings.dex_namespace):
             raise ValueError(f"命名空间 {settings.dex_namespace} 不存在")
@@ -50,18 +141,9 @@ class UserService:
             password = self.generate_password()
         
         passwd_base64, passwd_hash_env_name = self.hash_password(password)
-        
-        # 更新 Secret
         env_key = f"USER_{passwd_hash_env_name}"
-        secret_data = {env_key: passwd_base64}
-        k8s_client.patch_secret(settings.dex_secret_name, settings.dex_namespace, secret_data)
-        
-        # 更新 ConfigMap
-        configmap = k8s_client.get_configmap(settings.dex_configmap_name, settings.dex_namespace)
-        if not configmap:
-            raise ValueError(f"ConfigMap {settings.dex_configmap_name} 不存在")
         
-        config_data = yaml.safe_load(configmap.data.get('config.yaml', '{}'))
+        configmap, config_data = self.load_dex_config()
         
         if 'staticPasswords' not in config_data:
             config_data['staticPasswords'] = []
@@ -79,22 +161,38 @@ class UserService:
         }
         config_data['staticPasswords'].append(new_user)
         
-        configmap.data['config.yaml'] = yaml.dump(config_data, default_flow_style=False)
-        k8s_client.update_configmap(settings.dex_configmap_name, settings.dex_namespace, configmap)
-        
-        # 重启 Dex
-        k8s_client.restart_deployment(settings.dex_deployment_name, settings.dex_namespace)
+        intent = {"expect": {email: env_key}, "added_keys": [env_key]}
+        with journal.operation("create_user", email, intent) as op:
+            with pending_keys.hold([env_key]):
+                # 更新 Secret
+                k8s_client.patch_secret(settings.dex_secret_name, settings.dex_namespace, {env_key: passwd_base64})
+                op.step("secret")
+                
+                # 更新 ConfigMap
+                self.save_dex_config(configmap, config_data)
+                op.step("configmap")
+            audit_log.change("user", email, "create", after={"username": username})
+            
+            # 重启 Dex
+            rollout = dex_rollout.restart(wait_ready)
+            op.step("restart")
         
         return {
             "email": email,
             "username": username,
-            "password": password
+            "password": password,
+            **rollout
         }
     
-    def reset_password(self, email: str, new_password: Optional[str] = None) -> Dict[str, str]:
+    def reset_password(
+        self,
+        email: str,
+        new_password: Optional[str] = None,
+        wait_ready: Optional[bool] = None
+    ) -> Dict[str, Any]:
         """
         重置用户密码
-        返回: {"email": str, "password": str}
+        返回: {"email": str, "password": str, "ready": bool|None, "rollout_seconds": float|None}
         """
         if not new_password:
             new_password = self.generate_password()
@@ -103,11 +201,7 @@ class UserService:
         env_key = f"USER_{passwd_hash_env_name}"
         
         # 获取 ConfigMap 并查找用户
-        configmap = k8s_client.get_configmap(settings.dex_configmap_name, settings.dex_namespace)
-        if not configmap:
-            raise ValueError(f"ConfigMap {settings.dex_configmap_name} 不存在")
-        
-        config_data = yaml.safe_load(configmap.data.get('config.yaml', '{}'))
+        configmap, config_data = self.load_dex_config()
         
         if 'staticPasswords' not in config_data:
             raise ValueError(f"用户 {email} 不存在")
@@ -125,53 +219,53 @@ class UserService:
         if not user_found:
             raise ValueError(f"用户 {email} 不存在")
         
-        # 更新 Secret（添加新密码，删除旧密码）
-        secret_data = {env_key: passwd_base64}
-        k8s_client.patch_secret(settings.dex_secret_name, settings.dex_namespace, secret_data)
-        
-        # 如果有旧的环境变量，从 Secret 中删除
-        if old_env_key and old_env_key != env_key:
-            try:
-                secret = k8s_client.get_secret(settings.dex_secret_name, settings.dex_namespace)
-                if secret and secret.data and old_env_key in secret.data:
-                    del secret.data[old_env_key]
-                    k8s_client.core_v1.replace_namespaced_secret(
-                        settings.dex_secret_name, 
-                        settings.dex_namespace, 
-                        secret
-                    )
-            except Exception as e:
-                print(f"警告：删除旧密码失败: {e}")
-        
-        # 更新 ConfigMap
-        configmap.data['config.yaml'] = yaml.dump(config_data, default_flow_style=False)
-        k8s_client.update_configmap(settings.dex_configmap_name, settings.dex_namespace, configmap)
-        
-        # 重启 Dex
-        k8s_client.restart_deployment(settings.dex_deployment_name, settings.dex_namespace)
+        # 旧密码键不再被任何用户引用时删除
+        released = [old_env_key] if old_env_key and old_env_key not in self.referenced_keys(config_data) else []
+        
+        # 先添加新密码、写入 ConfigMap，最后删除旧密码：任何一步中断都不会使用户引用不存在的键
+        intent = {"expect": {email: env_key}, "added_keys": [env_key], "released_keys": released}
+        with journal.operation("reset_password", email, intent) as op:
+            with pending_keys.hold([env_key]):
+                k8s_client.patch_secret(settings.dex_secret_name, settings.dex_namespace, {env_key: passwd_base64})
+                op.step("secret")
+                
+                # 更新 ConfigMap
+                self.save_dex_config(configmap, config_data)
+                op.step("configmap")
+            audit_log.change("user", email, "reset_password")
+            
+            if released:
+                try:
+                    k8s_client.patch_secret(settings.dex_secret_name, settings.dex_namespace, {released[0]: None})
+                    op.step("release")
+                except Exception as e:
+                    print(f"警告：删除旧密码失败: {e}")
+            
+            # 重启 Dex
+            rollout = dex_rollout.restart(wait_ready)
+            op.step("restart")
         
         return {
             "email": email,
-            "password": new_password
+            "password": new_password,
+            **rollout
         }
     
-    def delete_user(self, email: str) -> Dict[str, str]:
+    def delete_user(self, email: str, wait_ready: Optional[bool] = None) -> Dict[str, Any]:
         """删除用户"""
-        configmap = k8s_client.get_configmap(settings.dex_configmap_name, settings.dex_namespace)
-        if not configmap:
-            raise ValueError(f"ConfigMap {settings.dex_configmap_name} 不存在")
-        
-        config_data = yaml.safe_load(configmap.data.get('config.yaml', '{}'))
+        configmap, config_data = self.load_dex_config()
         
         if 'staticPasswords' not in config_data:
             raise ValueError(f"用户 {email} 不存在")
         
         # 查找并删除用户
         env_key_to_delete = None
+        deleted_username = None
         new_passwords = []
         for user in config_data['staticPasswords']:
             if user.get('email') == email:
                 env_key_to_delete = user.get('hashFromEnv')
+                deleted_username = user.get('username')
             else:
                 new_passwords.append(user)
         
@@ -179,29 +273,228 @@ class UserService:
             raise ValueError(f"用户 {email} 不存在")
         
         config_data['staticPasswords'] = new_passwords
+        released = (
+            [env_key_to_delete]
+            if env_key_to_delete and env_key_to_delete not in self.referenced_keys(config_data) else []
+        )
+        
+        # 先从 ConfigMap 中删除用户，再删除密码，中断时不会留下引用不存在密码键的用户
+        intent = {"expect": {email: None}, "released_keys": released}
+        with journal.operation("delete_user", email, intent) as op:
+            self.save_dex_config(configmap, config_data)
+            op.step("configmap")
+            audit_log.change("user", email, "delete", before={"username": deleted_username})
+            
+            if released:
+                try:
+                    k8s_client.patch_secret(settings.dex_secret_name, settings.dex_namespace, {released[0]: None})
+                    op.step("release")
+                except Exception as e:
+                    print(f"警告：删除密码失败: {e}")
+            
+            # 重启 Dex
+            rollout = dex_rollout.restart(wait_ready)
+            op.step("restart")
+        
+        return {"email": email, "message": "用户删除成功", **rollout}
+    
+    def apply_changes(
+        self,
+        creates: Optional[List[Dict[str, Any]]] = None,
+        updates: Optional[List[Dict[str, Any]]] = None,
+        deletes: Optional[List[str]] = None
+    ) -> List[Dict[str, Any]]:
+        """
+        批量变更用户：添加和删除密码各一次 Secret patch、一次 ConfigMap 写入、一次 Dex 重启
         
-        # 从 Secret 中删除密码
-        if env_key_to_delete:
-            try:
-                secret = k8s_client.get_secret(settings.dex_secret_name, settings.dex_namespace)
-                if secret and secret.data and env_key_to_delete in secret.data:
-                    del secret.data[env_key_to_delete]
-                    k8s_client.core_v1.replace_namespaced_secret(
-                        settings.dex_secret_name, 
-                        settings.dex_namespace, 
-                        secret
-                    )
-            except Exception as e:
-                print(f"警告：删除密码失败: {e}")
-        
-        # 更新 ConfigMap
-        configmap.data['config.yaml'] = yaml.dump(config_data, default_flow_style=False)
-        k8s_client.update_configmap(settings.dex_configmap_name, settings.dex_namespace, configmap)
-        
-        # 重启 Dex
-        k8s_client.restart_deployment(settings.dex_deployment_name, settings.dex_namespace)
-        
-        return {"email": email, "message": "用户删除成功"}
+        - creates: [{"email", "username"?, "password"?}]
+        - updates: [{"email", "username"?, "password"?}]，提供 password 时重置密码
+        - deletes: [email]
+        返回每个用户的处理结果，新建或重置密码的用户包含明文密码
+        """
+        creates = creates or []
+        updates = updates or []
+        deletes = deletes or []
+        if not (creates or updates or deletes):
+            return []
+        
+        configmap, config_data = self.load_dex_config()
+        static_passwords = config_data.get('staticPasswords') or []
+        by_email = {u.get('email'): u for u in static_passwords}
+        
+        for item in creates:
+            if item['email'] in by_email:
+                raise ValueError(f"用户 {item['email']} 已存在")
+        for item in updates:
+            if item['email'] not in by_email:
+                raise ValueError(f"用户 {item['email']} 不存在")
+        
+        # bcrypt 在 C 扩展中释放 GIL，多线程并行哈希
+        to_hash = []
+        for item in creates:
+            to_hash.append((item['email'], item.get('password') or self.generate_password()))
+        for item in updates:
+            if item.get('password'):
+                to_hash.append((item['email'], item['password']))
+        
+        hashed: Dict[str, Tuple[str, str, str]] = {}
+        if to_hash:
+            with ThreadPoolExecutor(max_workers=min(len(to_hash), settings.hash_concurrency)) as pool:
+                for (email, password), (passwd_base64, env_name) in zip(
+                    to_hash, pool.map(bind_cluster(lambda x: self.hash_password(x[1])), to_hash)
+                ):
+                    hashed[email] = (password, passwd_base64, f"USER_{env_name}")
+        
+        secret_data: Dict[str, str] = {}
+        released_keys = set()
+        results = []
+        
+        for item in creates:
+            email = item['email']
+            password, passwd_base64, env_key = hashed[email]
+            username = item.get('username') or self.extract_username(email)
+            entry = {'email': email, 'hashFromEnv': env_key, 'username': username}
+            static_passwords.append(entry)
+            by_email[email] = entry
+            secret_data[env_key] = passwd_base64
+            results.append({"email": email, "username": username, "password": password, "action": "create"})
+        
+        for item in updates:
+            email = item['email']
+            entry = by_email[email]
+            result = {"email": email, "username": entry.get('username'), "action": "update"}
+            if item.get('username'):
+                entry['username'] = item['username']
+                result['username'] = item['username']
+            if email in hashed:
+                password, passwd_base64, env_key = hashed[email]
+                if entry.get('hashFromEnv') and entry['hashFromEnv'] != env_key:
+                    released_keys.add(entry['hashFromEnv'])
+                entry['hashFromEnv'] = env_key
+                secret_data[env_key] = passwd_base64
+                result['password'] = password
+            results.append(result)
+        
+        delete_set = set(deletes)
+        for email in deletes:
+            if email not in by_email:
+                raise ValueError(f"用户 {email} 不存在")
+            if by_email[email].get('hashFromEnv'):
+                released_keys.add(by_email[email]['hashFromEnv'])
+            results.append({"email": email, "action": "delete"})
+        config_data['staticPasswords'] = [u for u in static_passwords if u.get('email') not in delete_set]
+        
+        # 只删除不再被任何用户引用的密码键
+        released = sorted(released_keys - self.referenced_keys(config_data) - set(secret_data))
+        
+        # 顺序：添加新密码 → 写入 ConfigMap → 删除旧密码 → 重启 Dex
+        expect = {u['email']: u.get('hashFromEnv') for u in config_data['staticPasswords'] if u.get('email') in hashed}
+        expect.update({email: None for email in deletes})
+        intent = {"expect": expect, "added_keys": sorted(secret_data), "released_keys": released}
+        with journal.operation("apply_user_changes", f"{len(results)} users", intent) as op:
+            with pending_keys.hold(secret_data):
+                if secret_data:
+                    k8s_client.patch_secret(settings.dex_secret_name, settings.dex_namespace, secret_data)
+                    op.step("secret")
+                self.save_dex_config(configmap, config_data)
+                op.step("configmap")
+            for result in results:
+                action = "reset_password" if result["action"] == "update" and "password" in result else result["action"]
+                after = {"username": result["username"]} if result.get("username") else None
+                audit_log.change("user", result["email"], action, after=after)
+            if released:
+                k8s_client.patch_secret(settings.dex_secret_name, settings.dex_namespace, {key: None for key in released})
+                op.step("release")
+            dex_rollout.restart()
+            op.step("restart")
+        
+        return results
+    
+    def restore_users(self, entries: List[Dict[str, str]]) -> Dict[str, int]:
+        """
+        按导出的条目恢复 Dex 静态用户（密码哈希需已写入 Secret）
+        新用户追加、已存在的用户覆盖 username/hashFromEnv，一次 ConfigMap 写入、一次 Dex 重启
+        返回: {"created": int, "updated": int, "unchanged": int}
+        """
+        counts = {"created": 0, "updated": 0, "unchanged": 0}
+        if not entries:
+            return counts
+        
+        configmap, config_data = self.load_dex_config()
+        static_passwords = config_data.get('staticPasswords') or []
+        index = {u.get('email'): i for i, u in enumerate(static_passwords)}
+        changed: List[Tuple[Dict[str, str], str]] = []
+        
+        for entry in entries:
+            new_user = {
+                'email': entry['email'],
+                'hashFromEnv': entry['hashFromEnv'],
+                'username': entry.get('username') or self.extract_username(entry['email'])
+            }
+            i = index.get(entry['email'])
+            if i is None:
+                index[entry['email']] = len(static_passwords)
+                static_passwords.append(new_user)
+                counts["created"] += 1
+                changed.append((new_user, "restore_create"))
+            elif static_passwords[i] != new_user:
+                static_passwords[i] = new_user
+                counts["updated"] += 1
+                changed.append((new_user, "restore_update"))
+            else:
+                counts["unchanged"] += 1
+        
+        if counts["created"] or counts["updated"]:
+            config_data['staticPasswords'] = static_passwords
+            intent = {"expect": {user['email']: user['hashFromEnv'] for user, _ in changed}}
+            with journal.operation("restore_users", f"{len(changed)} users", intent) as op:
+                self.save_dex_config(configmap, config_data)
+                op.step("configmap")
+                for user, action in changed:
+                    audit_log.change("user", user['email'], action, after={"username": user['username']})
+                dex_rollout.restart()
+                op.step("restart")
+        
+        return counts
+    
+    def recover(self, op: JournalOperation) -> str:
+        """
+        恢复中断的 Dex 用户变更（由 journal 在启动时调用）
+        ConfigMap 已按意图写入：删除释放的密码键并重启 Dex（resumed）；
+        未写入：删除已添加且未被任何用户引用的密码键（rolled_back）
+        """
+        configmap, config_data = self.load_dex_config()
+        current = {u.get('email'): u.get('hashFromEnv') for u in config_data.get('staticPasswords') or []}
+        # 写入成功但未来得及记录步骤时，通过比较当前内容判断
+        applied = op.done("configmap") or all(current.get(email) == key for email, key in op.intent["expect"].items())
+        
+        keys = op.intent.get("released_keys", []) if applied else op.intent.get("added_keys", [])
+        stale = {key: None for key in keys if key not in set(current.values())}
+        if stale and not op.done("release"):
+            k8s_client.patch_secret(settings.dex_secret_name, settings.dex_namespace, stale)
+            op.step("release")
+        if not applied:
+            return "rolled_back"
+        if not op.done("restart"):
+            dex_rollout.restart(False)
+            op.step("restart")
+        return "resumed"
+    
+    def list_users(self) -> List[Dict[str, str]]:
+        """列出 Dex 中的所有静态用户"""
+        configmap = k8s_client.get_configmap(settings.dex_configmap_name, settings.dex_namespace)
+        if not configmap:
+            return []
+        
+        config_data = dex_codec.loads(configmap)
+        return [
+            {
+                "email": user.get('email'),
+                "username": user.get('username'),
+                "hashFromEnv": user.get('hashFromEnv')
+            }
+            for user in config_data.get('staticPasswords') or []
+        ]
     
     def get_user(self, email: str) -> Optional[Dict[str, str]]:
         """获取用户信息"""
@@ -209,7 +502,7 @@ class UserService:
         if not configmap:
             return None
         
-        config_data = yaml.safe_load(configmap.data.get('config.yaml', '{}'))
+        config_data = dex_codec.loads(configmap)
         
         if 'staticPasswords' not in config_data:
             return None
@@ -227,3 +520,6 @@ class UserService:
 
 user_service = UserService()
 
+for kind in ("create_user", "reset_password", "delete_user", "apply_user_changes", "restore_users"):
+    journal.register(kind, user_service.recover)
+